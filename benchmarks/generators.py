@@ -0,0 +1,102 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Generators of synthetic DAG files of different shapes. Each generator
+# writes a DAG file with (about) num_nodes nodes that all use the given job
+# submission file, and returns the number of PARENT/CHILD edges written.
+
+import math
+
+
+def write_jobs(fd, num_nodes, job_submission_file, vars_template=None):
+    for i in range(num_nodes):
+        fd.write('JOB N%i %s\n' % (i, job_submission_file))
+        if vars_template is not None:
+            fd.write('VARS N%i %s\n' % (i, vars_template % {'i': i}))
+
+
+def write_wide_dag(dag_file, num_nodes, job_submission_file):
+    # A single root node with all the other nodes as children.
+    with open(dag_file, 'w') as fd:
+        write_jobs(fd, num_nodes, job_submission_file)
+        for i in range(1, num_nodes):
+            fd.write('PARENT N0 CHILD N%i\n' % (i))
+    return max(num_nodes - 1, 0)
+
+
+def write_chain_dag(dag_file, num_nodes, job_submission_file):
+    # Each node is the child of the previous one.
+    with open(dag_file, 'w') as fd:
+        write_jobs(fd, num_nodes, job_submission_file)
+        for i in range(1, num_nodes):
+            fd.write('PARENT N%i CHILD N%i\n' % (i-1, i))
+    return max(num_nodes - 1, 0)
+
+
+def write_diamond_dag(dag_file, num_nodes, job_submission_file):
+    # A lattice of about sqrt(num_nodes) layers of about sqrt(num_nodes)
+    # nodes each, where node k of a layer is the child of nodes k and k+1
+    # (wrapping around) of the previous layer.
+    width = max(int(math.sqrt(num_nodes)), 1)
+    num_edges = 0
+    with open(dag_file, 'w') as fd:
+        write_jobs(fd, num_nodes, job_submission_file)
+        for i in range(width, num_nodes):
+            layer_start = (i // width - 1) * width
+            k = i % width
+            parents = sorted(set([layer_start + k, layer_start + (k + 1) % width]))
+            fd.write('PARENT %s CHILD N%i\n' % (' '.join(['N%i' % (p) for p in parents]), i))
+            num_edges += len(parents)
+    return num_edges
+
+
+def write_all_to_all_dag(dag_file, num_nodes, job_submission_file, block_size=100):
+    # Blocks of block_size nodes, where every node of a block is the child
+    # of every node of the previous block, written as one PARENT line per
+    # pair of blocks.
+    num_edges = 0
+    with open(dag_file, 'w') as fd:
+        write_jobs(fd, num_nodes, job_submission_file)
+        for start in range(block_size, num_nodes, block_size):
+            parents = ['N%i' % (i) for i in range(start - block_size, start)]
+            children = ['N%i' % (i) for i in range(start, min(start + block_size, num_nodes))]
+            fd.write('PARENT %s CHILD %s\n' % (' '.join(parents), ' '.join(children)))
+            num_edges += len(parents) * len(children)
+    return num_edges
+
+
+def write_heavy_vars_dag(dag_file, num_nodes, job_submission_file, num_macros=20):
+    # Independent nodes, each with num_macros macros in its VARS line, some
+    # of them with white spaces and escaped double quotes in their values.
+    macros = []
+    for m in range(num_macros):
+        if m % 2:
+            macros.append('macro%i="value %i of node %%(i)i with \\"quotes\\""' % (m, m))
+        else:
+            macros.append('macro%i="value%i_%%(i)i"' % (m, m))
+    with open(dag_file, 'w') as fd:
+        write_jobs(fd, num_nodes, job_submission_file, ' '.join(macros))
+    return 0
+
+
+DAG_GENERATORS = {
+    'wide': write_wide_dag,
+    'chain': write_chain_dag,
+    'diamond': write_diamond_dag,
+    'all_to_all': write_all_to_all_dag,
+    'heavy_vars': write_heavy_vars_dag,
+}
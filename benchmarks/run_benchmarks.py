@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+# Benchmarks of the DAG engine phases on synthetic DAGs of different shapes
+# and sizes, run against a simulated Slurm cluster. The results are written
+# to a JSON file, so that releases can be compared. Run with --help for the
+# options, for example:
+#   python benchmarks/run_benchmarks.py --sizes 1000,10000 --output results.json
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'lib'))
+
+from SlurmDagman import __version__
+from SlurmDagman.backends.simulator import SimulatedBackend
+from SlurmDagman.dag import Dag
+from SlurmDagman.process.worker import Worker
+
+from generators import DAG_GENERATORS
+
+
+# Private Worker methods that are timed while the DAG is executed, with the
+# name under which they are reported. The time of the monitor phase includes
+# the time of the fix_parents phase.
+WORKER_PHASES = [
+    ('_Worker__pre_execute_dag', 'pre_execute'),
+    ('_Worker__monitor', 'monitor'),
+    ('_Worker__fix_parents', 'fix_parents'),
+    ('_Worker__submit_ready_nodes', 'submit'),
+]
+
+JOB_SUBMISSION_FILE_CONTENT = """#!/bin/bash
+#SBATCH --time=10
+#SBATCH --output=/dev/null
+echo $(macro0) $(macro1)
+"""
+
+
+class PhaseTimer(object):
+
+    def __init__(self):
+        super(PhaseTimer, self).__init__()
+        self.phases = {}
+        self.original_methods = {}
+
+
+    def __wrap(self, method, phase):
+        def timed_method(*args, **kwargs):
+            start = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.phases[phase]['time'] += time.time() - start
+                self.phases[phase]['calls'] += 1
+        return timed_method
+
+
+    def install(self, cls, methods):
+        for method_name, phase in methods:
+            self.phases[phase] = {'time': 0.0, 'calls': 0}
+            self.original_methods[method_name] = getattr(cls, method_name)
+            setattr(cls, method_name, self.__wrap(self.original_methods[method_name], phase))
+
+
+    def uninstall(self, cls):
+        for method_name, method in self.original_methods.items():
+            setattr(cls, method_name, method)
+        self.original_methods.clear()
+
+
+def measure(function, memory=True):
+    # Run function and return its result, the time it took and its peak
+    # memory allocation (None if not measured).
+    if memory and tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    try:
+        result = function()
+    finally:
+        elapsed = time.time() - start
+        peak_memory = None
+        if memory and tracemalloc is not None:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return result, elapsed, peak_memory
+
+
+def run_benchmark(shape, num_nodes, workdir, options):
+    dag_file = os.path.join(workdir, '%s_%i.dag' % (shape, num_nodes))
+    job_submission_file = os.path.join(workdir, 'job.sh')
+    num_edges, generate_time, _ = measure(lambda: DAG_GENERATORS[shape](dag_file, num_nodes, job_submission_file), memory=False)
+    result = {
+        'shape': shape,
+        'num_nodes': num_nodes,
+        'num_edges': num_edges,
+        'dag_file_size': os.path.getsize(dag_file),
+        'generate_time': generate_time,
+        'phases': {},
+    }
+
+    def parse():
+        dag = Dag(dag_file)
+        dag.parse()
+        return dag
+
+    dag, elapsed, peak_memory = measure(parse, options.memory)
+    result['phases']['parse'] = {'time': elapsed, 'peak_memory': peak_memory}
+
+    rescue_dag_file = dag_file + '.rescue'
+    _, elapsed, peak_memory = measure(lambda: dag.write(rescue_dag_file, use_dag_nodes_appearance_order=True, add_done_labels=True), options.memory)
+    result['phases']['write'] = {'time': elapsed, 'peak_memory': peak_memory}
+    result['rescue_dag_file_size'] = os.path.getsize(rescue_dag_file)
+    _, elapsed, peak_memory = measure(lambda: dag.write(rescue_dag_file, use_dag_nodes_appearance_order=True, add_done_labels=True,
+                                                        group_dependencies=True), options.memory)
+    result['phases']['write_grouped'] = {'time': elapsed, 'peak_memory': peak_memory}
+    result['grouped_rescue_dag_file_size'] = os.path.getsize(rescue_dag_file)
+    del dag
+
+    if options.execute:
+        backend = SimulatedBackend(num_slots=options.slots, runtime=options.runtime, failure_rate=0.0,
+                                   latency=options.latency, time_scale=options.time_scale, seed=0)
+        worker = Worker(dag_file=dag_file, outfile=None, sleep_time=0, min_sleep_time=0, max_jobs_queued=options.max_jobs_queued,
+                        max_jobs_pending=0, max_jobs_submit=0, submit_wait_time=0, backend=backend, register_status=False)
+        timer = PhaseTimer()
+        timer.install(Worker, WORKER_PHASES)
+        try:
+            rc, elapsed, peak_memory = measure(worker.run, options.memory)
+        finally:
+            timer.uninstall(Worker)
+        result['phases']['execute'] = {'time': elapsed, 'peak_memory': peak_memory, 'rc': rc}
+        result['phases'].update(timer.phases)
+        result['iterations'] = timer.phases['monitor']['calls']
+        result['backend_calls'] = dict(backend.num_calls)
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the SlurmDagman DAG engine phases on synthetic DAGs.')
+    parser.add_argument('--shapes', default=','.join(sorted(DAG_GENERATORS)),
+                        help='comma separated list of DAG shapes (default: all of %s)' % (', '.join(sorted(DAG_GENERATORS))))
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated list of numbers of nodes (default: 1000,10000,100000)')
+    parser.add_argument('--output', default='slurm_dagman_benchmarks.json',
+                        help='file where to write the results in JSON format')
+    parser.add_argument('--workdir', default=None,
+                        help='directory where to write the DAG files (default: a temporary directory that is removed at the end)')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='do not measure the peak memory (which slows down the phases)')
+    parser.add_argument('--no-execute', dest='execute', action='store_false',
+                        help='only benchmark the parsing and writing of the DAG files')
+    parser.add_argument('--slots', type=int, default=10000,
+                        help='number of job slots of the simulated cluster')
+    parser.add_argument('--runtime', type=float, default=0,
+                        help='runtime -in simulated seconds- of the simulated jobs')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='latency -in simulated seconds- of the simulated Slurm commands')
+    parser.add_argument('--time-scale', type=float, default=1,
+                        help='how much faster than real time the simulated time runs')
+    parser.add_argument('--max-jobs-queued', type=int, default=0,
+                        help='maximum number of jobs in the queue (0 = no limit)')
+    options = parser.parse_args()
+    options.shapes = [shape for shape in options.shapes.split(',') if shape]
+    for shape in options.shapes:
+        if shape not in DAG_GENERATORS:
+            parser.error('Unknown DAG shape %s' % (shape))
+    options.sizes = [int(size) for size in options.sizes.split(',') if size]
+    return options
+
+
+def main():
+    options = parse_args()
+    workdir = options.workdir or tempfile.mkdtemp(prefix='slurm_dagman_benchmarks.')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    with open(os.path.join(workdir, 'job.sh'), 'w') as fd:
+        fd.write(JOB_SUBMISSION_FILE_CONTENT)
+    report = {
+        'slurm_dagman_version': __version__,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'date': datetime.datetime.now().isoformat().split('.')[0],
+        'options': dict((name, value) for name, value in vars(options).items() if name not in ['output', 'workdir']),
+        'results': [],
+    }
+    try:
+        for shape in options.shapes:
+            for num_nodes in options.sizes:
+                result = run_benchmark(shape, num_nodes, workdir, options)
+                report['results'].append(result)
+                print('%-10s %8i nodes: %s' % (shape, num_nodes, ', '.join(['%s %.3fs' % (phase, result['phases'][phase]['time']) for phase in sorted(result['phases'])])))
+                with open(options.output, 'w') as fd:
+                    json.dump(report, fd, indent=2, sort_keys=True)
+    finally:
+        if not options.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
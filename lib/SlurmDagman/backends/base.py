@@ -0,0 +1,50 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+class SlurmBackend(object):
+    # Interface between the worker and the Slurm cluster. All methods return
+    # a pair (result, errors), where errors is a list of error messages.
+
+    # Whether the jobs only exist in this process (e.g. for benchmarks).
+    simulated = False
+
+    def submit(self, script, sbatch_options, working_dir=None):
+        # Submit the given job script with the given sbatch command line
+        # options, from the given directory (by default the current one).
+        # Return (job_id, None), or (None, error message).
+        raise NotImplementedError
+
+
+    def sacct(self, wckey, job_ids=None, states=None, starttime=None, endtime=None, array=False):
+        # Query the accounting records of the job allocations with the given
+        # wckey (or comma-separated list of wckeys). Optionally restrict to the given job ids, job states (sacct
+        # --state abbreviations) and time window (ISO format). Return a list
+        # of (job_id, job_name, state, node_list, exit_code) records.
+        raise NotImplementedError
+
+
+    def squeue(self, user, job_ids, array=False):
+        # Query the queue for the given job ids (or all the jobs, if None) of
+        # the given user. Return a list of (job_id, state, wckey, node_list)
+        # records.
+        raise NotImplementedError
+
+
+    def cancel(self, wckey):
+        # Cancel all the queued jobs with the given wckey.
+        raise NotImplementedError
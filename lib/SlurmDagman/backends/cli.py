@@ -0,0 +1,100 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import subprocess
+
+from SlurmDagman import constants as C
+from SlurmDagman.backends.base import SlurmBackend
+
+
+class CliBackend(SlurmBackend):
+    # Backend that runs the Slurm commands.
+
+    def __run(self, cmd, stdin=None, cwd=None):
+        p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
+        out, err = p.communicate(stdin.encode('utf-8') if stdin is not None else None)
+        out = [l for l in out.decode('utf-8').strip().split('\n') if l]
+        err = [l for l in err.decode('utf-8').strip().split('\n') if l]
+        return out, err
+
+
+    def submit(self, script, sbatch_options, working_dir=None):
+        # The job script is passed to sbatch via its standard input.
+        out, err = self.__run(['sbatch'] + sbatch_options, stdin=script, cwd=working_dir)
+        if err or not out:
+            return None, '\n'.join(err)
+        job_id = out[-1].split()[-1]
+        return job_id, None
+
+
+    def sacct(self, wckey, job_ids=None, states=None, starttime=None, endtime=None, array=False):
+        # Only job allocations are queried, not job steps. A long list of job
+        # ids is split into several sacct queries.
+        cmd = ['sacct', '--noheader', '-P', '--allocations', '--wckeys=%s' % (wckey), '--format=JobID,JobName,State,NodeList,ExitCode']
+        if states:
+            cmd.append('--state=%s' % (','.join(states)))
+        if starttime:
+            cmd.append('--starttime=%s' % (starttime))
+        if endtime:
+            cmd.append('--endtime=%s' % (endtime))
+        if array:
+            cmd.append('--array')
+        if job_ids is None:
+            cmds = [cmd]
+        else:
+            cmds = []
+            for i in range(0, len(job_ids), C.SACCT_MAX_JOB_IDS_PER_QUERY):
+                cmds.append(cmd + ['--jobs=%s' % (','.join(job_ids[i:i+C.SACCT_MAX_JOB_IDS_PER_QUERY]))])
+        records = []
+        errors = []
+        for cmd in cmds:
+            out, err = self.__run(cmd)
+            for l in out:
+                fields = l.split('|')
+                if len(fields) == 5:
+                    records.append(tuple(fields))
+            errors.extend(err)
+        return records, errors
+
+
+    def squeue(self, user, job_ids, array=False):
+        # A long list of job ids is split into several squeue queries.
+        cmd = ['squeue', '--noheader', '--user=%s' % (user), '--format=%i|%T|%w|%N']
+        if array:
+            cmd.append('--array')
+        if job_ids is None:
+            cmds = [cmd]
+        else:
+            cmds = []
+            for i in range(0, len(job_ids), C.SQUEUE_MAX_JOB_IDS_PER_QUERY):
+                cmds.append(cmd + ['--jobs=%s' % (','.join(job_ids[i:i+C.SQUEUE_MAX_JOB_IDS_PER_QUERY]))])
+        records = []
+        errors = []
+        for cmd in cmds:
+            out, err = self.__run(cmd)
+            for l in out:
+                fields = l.split('|', 3)
+                if len(fields) == 4:
+                    records.append(tuple(fields))
+            # squeue complains about job ids that have already left the
+            # queue, which is expected and not an error.
+            errors.extend([l for l in err if 'Invalid job id specified' not in l])
+        return records, errors
+
+
+    def cancel(self, wckey):
+        return self.__run(['scancel', '--wckey=%s' % (wckey)])
@@ -0,0 +1,254 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import bisect
+import collections
+import datetime
+import heapq
+import random
+import re
+import threading
+import time
+
+from SlurmDagman.backends.base import SlurmBackend
+from SlurmDagman.utils.slurm import build_array_task_job_id
+
+
+# Full job state names of the sacct --state abbreviations.
+SACCT_STATE_NAMES = {
+    'BF': 'BOOT_FAIL',
+    'CA': 'CANCELLED',
+    'CD': 'COMPLETED',
+    'DL': 'DEADLINE',
+    'F': 'FAILED',
+    'NF': 'NODE_FAIL',
+    'OOM': 'OUT_OF_MEMORY',
+    'PD': 'PENDING',
+    'PR': 'PREEMPTED',
+    'R': 'RUNNING',
+    'TO': 'TIMEOUT',
+}
+
+
+class SimulatedJob(object):
+
+    __slots__ = ['job_id', 'job_name', 'wckey', 'state', 'exit_code', 'submit_time', 'start_time', 'end_time', 'runtime', 'fail', 'slot']
+
+    def __init__(self, job_id, job_name, wckey, submit_time, runtime, fail):
+        self.job_id = job_id
+        self.job_name = job_name
+        self.wckey = wckey
+        self.state = 'PENDING'
+        self.exit_code = 0
+        self.submit_time = submit_time
+        self.start_time = None
+        self.end_time = None
+        self.runtime = runtime
+        self.fail = fail
+        self.slot = None
+
+
+class SimulatedBackend(SlurmBackend):
+    # An in-process simulated Slurm cluster with num_slots identical job
+    # slots served in submission order. The job scripts are not run: the
+    # runtime of a job is drawn from runtime (a number of seconds, or a
+    # callable that takes a random.Random and returns a number of seconds)
+    # and a job fails (exit code 1) with probability failure_rate. Every call
+    # takes latency seconds, as if the Slurm controller was busy. Simulated
+    # time runs time_scale times faster than real time. The times shown by
+    # the queries are real times, so that the worker can be used unchanged.
+
+    simulated = True
+
+    def __init__(self, num_slots=100, runtime=60, failure_rate=0.0, latency=0.0, time_scale=1.0, seed=None):
+        super(SimulatedBackend, self).__init__()
+        self.num_slots = num_slots
+        self.runtime = runtime
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.time_scale = float(time_scale)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.real_start_time = time.time()
+        self.clock = 0.0
+        self.next_job_id = 1000
+        self.jobs = {}
+        self.array_task_job_ids = {}
+        self.pending_jobs = collections.deque()
+        self.running_jobs = []
+        # The (end time, job id) of the ended jobs, sorted by end time.
+        self.ended_jobs = []
+        self.free_slots = list(range(num_slots, 0, -1))
+        self.num_calls = {'submit': 0, 'sacct': 0, 'squeue': 0, 'cancel': 0}
+
+
+    def __get_sim_time(self):
+        return (time.time() - self.real_start_time) * self.time_scale
+
+
+    def __get_sim_time_from_iso(self, iso_time):
+        real_time = time.mktime(datetime.datetime.strptime(iso_time, '%Y-%m-%dT%H:%M:%S').timetuple())
+        return (real_time - self.real_start_time) * self.time_scale
+
+
+    def __wait_for_controller(self):
+        if self.latency > 0:
+            time.sleep(self.latency / self.time_scale)
+
+
+    def __draw_runtime(self):
+        if callable(self.runtime):
+            return max(float(self.runtime(self.random)), 0.0)
+        return float(self.runtime)
+
+
+    def __advance(self):
+        # Start and finish jobs, in time order, up to the current time.
+        now = self.__get_sim_time()
+        while True:
+            if self.pending_jobs and self.free_slots:
+                job = self.pending_jobs.popleft()
+                job.state = 'RUNNING'
+                job.start_time = max(job.submit_time, self.clock)
+                job.slot = self.free_slots.pop()
+                heapq.heappush(self.running_jobs, (job.start_time + job.runtime, job.job_id))
+            elif self.running_jobs and self.running_jobs[0][0] <= now:
+                end_time, job_id = heapq.heappop(self.running_jobs)
+                job = self.jobs[job_id]
+                if job.state != 'RUNNING':
+                    # Cancelled while running.
+                    continue
+                self.clock = end_time
+                self.__end_job(job, end_time, 'FAILED' if job.fail else 'COMPLETED')
+            else:
+                break
+
+
+    def __end_job(self, job, end_time, state):
+        if job.state == 'RUNNING':
+            self.free_slots.append(job.slot)
+        job.state = state
+        job.end_time = end_time
+        job.exit_code = 1 if state == 'FAILED' else 0
+        bisect.insort(self.ended_jobs, (end_time, job.job_id))
+
+
+    def submit(self, script, sbatch_options, working_dir=None):
+        self.__wait_for_controller()
+        options = {}
+        for option in sbatch_options:
+            if option.startswith('--') and '=' in option:
+                name, value = option[2:].split('=', 1)
+                options[name] = value
+        task_ids = [None]
+        if 'array' in options:
+            m = re.match(r'^([0-9]+)-([0-9]+)(%[0-9]+)?$', options['array'])
+            if not m:
+                return None, 'sbatch: error: Invalid job array specification'
+            task_ids = range(int(m.group(1)), int(m.group(2)) + 1)
+        with self.lock:
+            self.num_calls['submit'] += 1
+            self.__advance()
+            submit_time = self.__get_sim_time()
+            job_id = str(self.next_job_id)
+            self.next_job_id += 1
+            for task_id in task_ids:
+                task_job_id = job_id if task_id is None else build_array_task_job_id(job_id, task_id)
+                fail = self.random.random() < self.failure_rate
+                job = SimulatedJob(task_job_id, options.get('job-name', 'sbatch'), options.get('wckey', ''), submit_time, self.__draw_runtime(), fail)
+                self.jobs[task_job_id] = job
+                if task_id is not None:
+                    self.array_task_job_ids.setdefault(job_id, []).append(task_job_id)
+                self.pending_jobs.append(job)
+            self.__advance()
+        return job_id, None
+
+
+    def __select_jobs(self, job_ids):
+        if job_ids is None:
+            return list(self.jobs.values())
+        jobs = []
+        for job_id in job_ids:
+            if job_id in self.jobs:
+                jobs.append(self.jobs[job_id])
+            for task_job_id in self.array_task_job_ids.get(job_id, []):
+                jobs.append(self.jobs[task_job_id])
+        return jobs
+
+
+    def sacct(self, wckey, job_ids=None, states=None, starttime=None, endtime=None, array=False):
+        # Like sacct with --state, only the jobs that were in one of the given
+        # states during the time window are shown. Only end states are
+        # supported, in addition to PD and R (for which the window is ignored).
+        self.__wait_for_controller()
+        with self.lock:
+            self.num_calls['sacct'] += 1
+            self.__advance()
+            state_names = None
+            if states:
+                state_names = set([SACCT_STATE_NAMES.get(state, state) for state in states])
+            # Times are shown by sacct to the second.
+            window_start = self.__get_sim_time_from_iso(starttime) if starttime else None
+            window_end = self.__get_sim_time_from_iso(endtime) + self.time_scale if endtime else None
+            if state_names is not None and window_start is not None and not state_names & set(['PENDING', 'RUNNING']):
+                first = bisect.bisect_left(self.ended_jobs, (window_start, ''))
+                jobs = [self.jobs[job_id] for _, job_id in self.ended_jobs[first:]]
+                if job_ids is not None:
+                    job_ids = set(job_ids)
+                    jobs = [job for job in jobs if job.job_id in job_ids or job.job_id.split('_')[0] in job_ids]
+            else:
+                jobs = self.__select_jobs(job_ids)
+            records = []
+            for job in jobs:
+                if job.wckey not in wckey.split(','):
+                    continue
+                if state_names is not None:
+                    if job.state not in state_names:
+                        continue
+                    if job.end_time is not None:
+                        if (window_start is not None and job.end_time < window_start) or (window_end is not None and job.end_time >= window_end):
+                            continue
+                node_list = 'sim%i' % (job.slot) if job.slot is not None else 'None assigned'
+                records.append((job.job_id, job.job_name, job.state, node_list, '%i:0' % (job.exit_code)))
+        return records, []
+
+
+    def squeue(self, user, job_ids, array=False):
+        self.__wait_for_controller()
+        with self.lock:
+            self.num_calls['squeue'] += 1
+            self.__advance()
+            records = []
+            for job in self.__select_jobs(job_ids):
+                if job.state in ['PENDING', 'RUNNING']:
+                    node_list = 'sim%i' % (job.slot) if job.slot is not None else ''
+                    records.append((job.job_id, job.state, job.wckey, node_list))
+        return records, []
+
+
+    def cancel(self, wckey):
+        self.__wait_for_controller()
+        with self.lock:
+            self.num_calls['cancel'] += 1
+            self.__advance()
+            now = self.__get_sim_time()
+            for job in self.jobs.values():
+                if job.wckey == wckey and job.state in ['PENDING', 'RUNNING']:
+                    if job.state == 'PENDING':
+                        self.pending_jobs.remove(job)
+                    self.__end_job(job, now, 'CANCELLED')
+        return [], []
@@ -10,3 +10,16 @@ DEFAULTS['DAGMAN']['max_jobs_queued'] = '500'
 DEFAULTS['DAGMAN']['max_jobs_pending'] = '0'
 DEFAULTS['DAGMAN']['max_jobs_submit'] = '0'
 DEFAULTS['DAGMAN']['submit_wait_time'] = '2'
+DEFAULTS['DAGMAN']['array_submit'] = 'no'
+DEFAULTS['DAGMAN']['max_array_size'] = '1000'
+DEFAULTS['DAGMAN']['submit_concurrency'] = '1'
+DEFAULTS['DAGMAN']['min_sleep_time'] = '5'
+DEFAULTS['DAGMAN']['checkpoint_interval'] = '0'
+DEFAULTS['DAGMAN']['checkpoint_completions'] = '0'
+DEFAULTS['DAGMAN']['group_dependencies'] = 'no'
+DEFAULTS['DAGMAN']['profile'] = 'no'
+DEFAULTS['DAGMAN']['profile_per_iteration'] = 'no'
+DEFAULTS['DAGMAN']['adaptive_submit'] = 'no'
+DEFAULTS['DAGMAN']['min_submit_rate'] = '6'
+DEFAULTS['DAGMAN']['max_submit_rate'] = '600'
+DEFAULTS['DAGMAN']['submit_latency_target'] = '2'
@@ -9,3 +9,11 @@ DEFAULTS['SLURM']['partition'] = ''
 DEFAULTS['SLURM']['qos'] = ''
 DEFAULTS['SLURM']['time_limit'] = '5-00:00:00'
 DEFAULTS['SLURM']['scratch_dir'] = ''
+DEFAULTS['DAGMAN'] = OrderedDict()
+DEFAULTS['DAGMAN']['dag_cache'] = 'no'
+DEFAULTS['DAGMAN']['metrics'] = 'no'
+DEFAULTS['DAGMAN']['metrics_textfile_dir'] = ''
+DEFAULTS['DAEMON'] = OrderedDict()
+DEFAULTS['DAEMON']['poll_interval'] = '30'
+DEFAULTS['DAEMON']['max_jobs_queued'] = '0'
+DEFAULTS['DAEMON']['max_jobs_pending'] = '0'
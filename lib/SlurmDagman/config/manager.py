@@ -25,6 +25,13 @@ try:
 except ImportError:
     from ordereddict import OrderedDict
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from SlurmDagman.utils.files import write_file_atomically
+
 
 class ConfigurationError(configparser.Error):
 
@@ -86,8 +93,10 @@ class ConfigManager(object):
 
 
     def write_to_file(self, filename):
-        with open(filename, 'w') as fd:
-            self.config.write(fd)
+        # Readers never see a partially written file.
+        fd = StringIO()
+        self.config.write(fd)
+        write_file_atomically(filename, fd.getvalue(), sync=False)
 
 
     def validate(self, sections_and_options, must_exist=False):
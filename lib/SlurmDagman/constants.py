@@ -1 +1,11 @@
 MAX_RESCUE_NUMBER = 999
+SACCT_MAX_JOB_IDS_PER_QUERY = 1000
+SQUEUE_MAX_JOB_IDS_PER_QUERY = 1000
+
+# Approximate size (in characters) of the chunks in which a DAG file is written.
+DAG_WRITE_CHUNK_SIZE = 1024*1024
+
+# Default time (in seconds) between two Slurm polls of the daemon, and between
+# two scans of its spool directory.
+DAEMON_POLL_INTERVAL = 30
+DAEMON_SCAN_INTERVAL = 5
@@ -16,6 +16,21 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import copy
+import logging
+import os
+
+from array import array
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+from SlurmDagman import constants as C
+from SlurmDagman.dag.node import DagNode, NO_NODE_IDS
+from SlurmDagman.dag.utils.cache import array_from_bytes, array_to_bytes, read_dag_cache, write_dag_cache
+from SlurmDagman.dag.utils.macros import format_macros, is_canonical_macros_text, is_well_formed_macros_text, parse_macros
+from SlurmDagman.utils.files import write_file_atomically
 
 
 class Dag(object):
@@ -24,10 +39,16 @@ class Dag(object):
         super(Dag, self).__init__()
         self.dag_file = dag_file.strip()
         self.dag_nodes_appearance_order = {}
+        # The node records by node name and by node id (the position in
+        # which the node was added to the dag).
         self.dag = {}
-        self.empty_node_template = {'job_submission_file': '', 'parents': [], 'done': False}
+        self.dag_nodes = []
+        # Each distinct job submission file path is stored only once.
+        self.job_submission_files = {}
         self.max_retries = None
         self.no_retry_exit_codes = [0]
+        # Whether the last parsing loaded the dag from the cache.
+        self.loaded_from_cache = False
 
 
     def get_dag_file(self):
@@ -39,10 +60,72 @@ class Dag(object):
 
 
     def set_dag(self, dag, copy_dag_nodes_appearance_order=False):
+        # The dag to copy can be another Dag or a dict of dict-like node
+        # records. The values in a node record are strings, numbers and
+        # booleans, or flat containers of these; so copying the containers is
+        # enough for the copy to be independent of the original.
         if copy_dag_nodes_appearance_order and isinstance(dag, Dag):
             self.dag_nodes_appearance_order = copy.copy(dag.dag_nodes_appearance_order)
-        for node in dag:
-            self.dag[node] = copy.deepcopy(dag[node])
+        nodes = [node_record.name for node_record in dag.dag_nodes] if isinstance(dag, Dag) else list(dag)
+        for node in nodes:
+            self.reset_node(node)
+            for key, value in dag[node].items():
+                if key == 'parents':
+                    continue
+                if isinstance(value, list):
+                    value = list(value)
+                elif isinstance(value, dict):
+                    value = value.copy()
+                self.dag[node][key] = value
+            if isinstance(dag, Dag):
+                self.dag[node].raw_vars = dag[node].raw_vars
+        for node in nodes:
+            self.set_parents(node, dag[node]['parents'])
+
+
+    def intern_job_submission_file(self, job_submission_file):
+        return self.job_submission_files.setdefault(job_submission_file, job_submission_file)
+
+
+    def get_node_name(self, node_id):
+        return self.dag_nodes[node_id].name
+
+
+    def set_parents(self, node, parents):
+        node_record = self.dag[node]
+        for parent_id in node_record.parent_ids:
+            self.dag_nodes[parent_id].child_ids.remove(node_record.node_id)
+        node_record.parent_ids = NO_NODE_IDS
+        seen_parents = set()
+        for parent in parents:
+            if parent not in seen_parents:
+                seen_parents.add(parent)
+                self.__add_dependency(self.dag[parent], node_record)
+
+
+    def __add_dependency(self, parent_record, child_record):
+        # A dependency given twice is added twice; the callers remove the
+        # duplicates.
+        child_record.add_parent_id(parent_record.node_id)
+        parent_record.add_child_id(child_record.node_id)
+
+
+    def __remove_duplicate_dependencies(self):
+        # A PARENT ... CHILD pair can be given more than once in the dag file.
+        # Only the first occurrence is kept, so that the parents and children
+        # keep the order in which they were first given.
+        for node_record in self.dag_nodes:
+            for ids_key in ['parent_ids', 'child_ids']:
+                ids = getattr(node_record, ids_key)
+                if len(ids) < 2 or len(set(ids)) == len(ids):
+                    continue
+                seen_ids = set()
+                unique_ids = array('i')
+                for node_id in ids:
+                    if node_id not in seen_ids:
+                        seen_ids.add(node_id)
+                        unique_ids.append(node_id)
+                setattr(node_record, ids_key, unique_ids)
 
 
     def reset(self):
@@ -51,151 +134,457 @@ class Dag(object):
 
 
     def reset_node(self, node):
-        self.dag[node] = copy.deepcopy(self.empty_node_template)
+        # Give the node an empty record, keeping its node id if it already has one.
+        if node in self.dag:
+            node_id = self.dag[node].node_id
+            self.set_parents(node, [])
+            node_record = DagNode(self, node, node_id)
+            node_record.child_ids = self.dag[node].child_ids
+            self.dag_nodes[node_id] = node_record
+        else:
+            node_record = DagNode(self, node, len(self.dag_nodes))
+            self.dag_nodes.append(node_record)
+        self.dag[node] = node_record
 
 
     def get_nodes(self):
         return list(self.dag.keys())
 
 
-    def parse(self):
+    def parse(self, progress_callback=None, progress_interval=100000, use_cache=False):
+        # Parse the dag file in a single pass, reading one line at a time.
+        # VARS and PARENT lines that refer to a node whose JOB line has not
+        # been read yet are kept aside and processed at the end of the file,
+        # as well as RETRY and PRIORITY lines with that problem. If given, progress_callback
+        # is called every progress_interval lines and at the end of the parsing
+        # with the number of lines read, the number of bytes read and the size
+        # of the dag file. With use_cache, the parsed dag is loaded from the
+        # cache file of the dag file if the cache is up to date, and otherwise
+        # saved to it after the parsing.
+        self.loaded_from_cache = False
+        if use_cache:
+            cache_data = read_dag_cache(self.dag_file)
+            if cache_data is not None:
+                self.__set_cache_data(cache_data)
+                self.loaded_from_cache = True
+                return
+        self.__retry_all_nodes_line = None
+        self.__retry_all_nodes_has_exit_codes = False
+        deferred_lines = []
+        # As when the JOB lines were read in a first pass, an error in a JOB
+        # line is raised right away, and an error in another line only
+        # after all the JOB lines were read. Once such an error is found,
+        # the lines other than JOB lines are skipped.
+        syntax_error = None
+        deferred_nodes = set()
+        dag_file_size = os.path.getsize(self.dag_file)
+        num_bytes_read = 0
+        i = -1
         with open(self.dag_file, 'r') as fd:
-            lines = fd.readlines()
-            # Make a first pass to get all the dag nodes.
-            for i, line in enumerate(lines):
+            for i, line in enumerate(fd):
+                num_bytes_read += len(line)
                 linestrip = line.strip()
                 if linestrip.startswith('JOB '):
-                    items = linestrip.split()
-                    if len(items) < 3 or len(items) > 4 or (len(items) == 4 and items[3] != 'DONE'):
-                        msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
-                        msg += "Unexpected line format.\n"
-                        msg += "Expected line format:\n"
-                        msg += "JOB <node> <job-submission-file> [DONE]"
-                        raise SyntaxError(msg)
-                    node = items[1]
-                    if node in self.dag_nodes_appearance_order:
-                        msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
-                        msg += "Node '%s' was already defined in line %i." % (node, self.dag_nodes_appearance_order[node])
-                        raise SyntaxError(msg)
-                    self.dag_nodes_appearance_order[node] = i
-                    self.reset_node(node)
-                    self.dag[node]['job_submission_file'] = items[2]
-                    if len(items) == 4:
-                        self.dag[node]['done'] = True
-            # Make a second pass to find all the needed information about the dag nodes.
-            for i, line in enumerate(lines):
-                linestrip = line.strip()
-                if linestrip.startswith('VARS '):
-                    items = linestrip.split()
-                    if len(items) < 3:
-                        msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
-                        msg += "Unexpected line format.\n"
-                        msg += "Expected line format:\n"
-                        msg += "VARS <node> <macro-1-key>=\"<macro-1-value>\" [<macro-2-key>=\"<macro-2-value>\" ...]\n"
-                        msg += "(where macro values are allowed to contain white spaces)"
-                        raise SyntaxError(msg)
-                    node = items[1]
-                    if node not in self.dag:
-                        msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
-                        msg += "Found a VARS line for node '%s', but there is no JOB line for this node." % (node)
-                        raise SyntaxError(msg)
-                    if 'vars' in self.dag[node]:
-                        msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
-                        msg += "Found a second VARS line for node '%s'.\n" % (node)
-                        msg += "Only one VARS line can be specified per node."
-                        raise SyntaxError(msg)
-                    self.dag[node]['vars'] = ' '.join(items[2:])
-                elif linestrip.startswith('PARENT '):
-                    j = linestrip.find(' CHILD ')
-                    if j == -1:
-                        msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
-                        msg += "Unexpected line format.\n"
-                        msg += 'Expected line format:\n'
-                        msg += 'PARENT <parent-node-1> [<parent-node-2> ...] CHILD <child-node-1> [<child-node-2> ...]'
-                        raise SyntaxError(msg)
-                    parents = linestrip[:j][len('PARENT '):].replace(',', ' ').split()
-                    children = linestrip[j+len(' CHILD '):].replace(',', ' ').split()
-                    for parent in parents:
-                        if parent not in self.dag:
-                            msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
-                            msg += "There is no JOB line for parent node '%s'." % (parent)
-                            raise SyntaxError(msg)
-                    for child in children:
-                        if child not in self.dag:
-                            msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
-                            msg += "There is no JOB line for child node '%s'." % (child)
-                            raise SyntaxError(msg)
-                        for parent in parents:
-                            if parent not in self.dag[child]['parents']:
-                                self.dag[child]['parents'].append(parent)
-                elif linestrip.startswith('RETRY '):
-                    items = linestrip.split()
-                    wrong_line_format_msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
-                    wrong_line_format_msg += "Unexpected line format.\n"
-                    wrong_line_format_msg += "Expected line format:\n"
-                    wrong_line_format_msg += "RETRY [<node> | ALL_NODES] <max-retries> [UNLESS-EXIT <exit-code1>[,<exit-code2>...]]\n"
-                    wrong_line_format_msg += "(with max-retries a non-negative integer value and exit-code an integer value)"
-                    if len(items) not in [3, 5]:
-                        raise SyntaxError(wrong_line_format_msg)
+                    self.__parse_job_line(i, linestrip)
+                elif syntax_error is None:
+                    # The lines for a node with a deferred line are deferred
+                    # too, so that they are processed in order (e.g. the
+                    # error for a second VARS line is for the second one).
+                    node = self.__get_line_node(linestrip) if deferred_nodes else None
                     try:
-                        max_retries = int(items[2])
-                        if max_retries < 0:
-                            raise ValueError
-                    except ValueError:
-                        raise SyntaxError(wrong_line_format_msg)
-                    if len(items) == 5:
-                        if items[3] != 'UNLESS-EXIT':
-                            raise SyntaxError(wrong_line_format_msg)
-                        try:
-                            no_retry_exit_codes = [int(i) for i in items[4].split(',')]
-                        except ValueError:
-                            raise SyntaxError(wrong_line_format_msg)
-                    if items[1] == 'ALL_NODES':
-                        if self.max_retries is not None:
-                            msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
-                            msg += "Found a second RETRY ALL_NODES line.\n"
-                            msg += "Only one RETRY ALL_NODES line can be specified."
-                            raise SyntaxError(msg)
-                        self.max_retries = max_retries
-                        for node in self.dag:
-                            self.dag[node].pop('max_retries', None)
-                            if max_retries > 0:
-                                self.dag[node]['retry_num'] = -1
-                            else:
-                                self.dag[node].pop('retry_num', None)
-                        if len(items) == 5:
-                            self.no_retry_exit_codes = no_retry_exit_codes
-                            for node in self.dag:
-                                self.dag[node].pop('no_retry_exit_codes', None)
-                    else:
-                        node = items[1]
-                        if node not in self.dag:
-                            msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
-                            msg += "Found a RETRY line for node '%s', but there is no JOB line for this node." % (node)
-                            raise SyntaxError(msg)
-                        if 'max_retries' in self.dag[node]:
-                            msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
-                            msg += "Found a second RETRY line for node '%s'.\n" % (node)
-                            msg += "Only one RETRY line can be specified per node."
-                            raise SyntaxError(msg)
-                        self.dag[node]['max_retries'] = max_retries
-                        if max_retries > 0:
-                            self.dag[node]['retry_num'] = -1
-                        else:
-                            self.dag[node].pop('retry_num', None)
-                        if len(items) == 5:
-                            self.dag[node]['no_retry_exit_codes'] = no_retry_exit_codes
+                        if (node is not None and node in deferred_nodes) or not self.__parse_line(i, linestrip):
+                            deferred_lines.append((i, linestrip))
+                            node = self.__get_line_node(linestrip)
+                            if node is not None:
+                                deferred_nodes.add(node)
+                    except SyntaxError as e:
+                        syntax_error = e
+                if progress_callback is not None and (i+1) % progress_interval == 0:
+                    progress_callback(i+1, num_bytes_read, dag_file_size)
+        # All the JOB lines have been read, so now a reference to an unknown
+        # node is an error. The deferred lines come before the line of the
+        # syntax error found while reading, if any, which is raised only if
+        # none of them has an error.
+        for j, linestrip in deferred_lines:
+            self.__parse_line(j, linestrip, True)
+        del deferred_lines
+        if syntax_error is not None:
+            raise syntax_error
+        self.__remove_duplicate_dependencies()
+        self.__set_retry_nums()
+        if progress_callback is not None:
+            progress_callback(i+1, num_bytes_read, dag_file_size)
+        if use_cache:
+            try:
+                write_dag_cache(self.dag_file, self.__get_cache_data())
+            except (IOError, OSError):
+                # The cache is only an optimization.
+                pass
+
+
+    def __get_cache_data(self):
+        # A compact columnar copy of what the parsing sets, indexed by node id.
+        # The parents and children of all the nodes are concatenated in single
+        # integer arrays, with the offset of each node's ids in another array.
+        job_submission_files = list(self.job_submission_files)
+        job_submission_file_indexes = dict((job_submission_file, i) for i, job_submission_file in enumerate(job_submission_files))
+        data = {
+            'names': [node_record.name for node_record in self.dag_nodes],
+            'job_submission_files': job_submission_files,
+            'job_submission_file_indexes': array('i'),
+            'appearance_order': array('i'),
+            'done': array('i'),
+            'vars': {},
+            'raw_vars': {},
+            'max_retries': {},
+            'no_retry_exit_codes': {},
+            'priority': {},
+            'retry_num': {},
+            'dag_max_retries': self.max_retries,
+            'dag_no_retry_exit_codes': self.no_retry_exit_codes,
+        }
+        for ids_key in ['parent_ids', 'child_ids']:
+            data[ids_key] = array('i')
+            data[ids_key + '_offsets'] = array('i', [0])
+        for node_record in self.dag_nodes:
+            node_id = node_record.node_id
+            data['job_submission_file_indexes'].append(job_submission_file_indexes[node_record.job_submission_file])
+            data['appearance_order'].append(self.dag_nodes_appearance_order.get(node_record.name, -1))
+            if node_record.done:
+                data['done'].append(node_id)
+            for key in ['vars', 'raw_vars', 'max_retries', 'no_retry_exit_codes', 'priority', 'retry_num']:
+                if getattr(node_record, key) is not None:
+                    data[key][node_id] = getattr(node_record, key)
+            for ids_key in ['parent_ids', 'child_ids']:
+                data[ids_key].extend(getattr(node_record, ids_key))
+                data[ids_key + '_offsets'].append(len(data[ids_key]))
+        for key in list(data.keys()):
+            if isinstance(data[key], array):
+                data[key] = array_to_bytes(data[key])
+        return data
+
+
+    def __set_cache_data(self, data):
+        for key in ['job_submission_file_indexes', 'appearance_order', 'done', 'parent_ids', 'parent_ids_offsets',
+                    'child_ids', 'child_ids_offsets']:
+            data[key] = array_from_bytes('i', data[key])
+        self.job_submission_files = dict((job_submission_file, job_submission_file) for job_submission_file in data['job_submission_files'])
+        job_submission_files = data['job_submission_files']
+        for node_id, node in enumerate(data['names']):
+            node_record = DagNode(self, node, node_id, job_submission_files[data['job_submission_file_indexes'][node_id]])
+            for ids_key in ['parent_ids', 'child_ids']:
+                start, end = data[ids_key + '_offsets'][node_id], data[ids_key + '_offsets'][node_id+1]
+                if end > start:
+                    setattr(node_record, ids_key, data[ids_key][start:end])
+            self.dag[node] = node_record
+            self.dag_nodes.append(node_record)
+            if data['appearance_order'][node_id] >= 0:
+                self.dag_nodes_appearance_order[node] = data['appearance_order'][node_id]
+        for node_id in data['done']:
+            self.dag_nodes[node_id].done = True
+        for key in ['vars', 'raw_vars', 'max_retries', 'no_retry_exit_codes', 'priority', 'retry_num']:
+            for node_id, value in data[key].items():
+                setattr(self.dag_nodes[node_id], key, value)
+        self.max_retries = data['dag_max_retries']
+        self.no_retry_exit_codes = data['dag_no_retry_exit_codes']
+
+
+    def __parse_line(self, i, linestrip, all_jobs_parsed=False):
+        # Returns False if the line refers to a node that is not yet known.
+        if linestrip.startswith('VARS '):
+            return self.__parse_vars_line(i, linestrip, all_jobs_parsed)
+        if linestrip.startswith('PARENT '):
+            return self.__parse_parent_line(i, linestrip, all_jobs_parsed)
+        if linestrip.startswith('RETRY '):
+            return self.__parse_retry_line(i, linestrip, all_jobs_parsed)
+        if linestrip.startswith('PRIORITY '):
+            return self.__parse_priority_line(i, linestrip, all_jobs_parsed)
+        return True
+
+
+    def __get_line_node(self, linestrip):
+        # The node of a VARS, RETRY or PRIORITY line (None for other lines).
+        if linestrip.startswith('VARS ') or linestrip.startswith('RETRY ') or linestrip.startswith('PRIORITY '):
+            items = linestrip.split(None, 2)
+            if len(items) > 1:
+                return items[1]
+        return None
+
+
+    def __parse_job_line(self, i, linestrip):
+        items = linestrip.split()
+        if len(items) < 3 or len(items) > 4 or (len(items) == 4 and items[3] != 'DONE'):
+            msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
+            msg += "Unexpected line format.\n"
+            msg += "Expected line format:\n"
+            msg += "JOB <node> <job-submission-file> [DONE]"
+            raise SyntaxError(msg)
+        node = items[1]
+        if node in self.dag_nodes_appearance_order:
+            msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
+            msg += "Node '%s' was already defined in line %i." % (node, self.dag_nodes_appearance_order[node])
+            raise SyntaxError(msg)
+        self.dag_nodes_appearance_order[node] = i
+        self.reset_node(node)
+        self.dag[node].job_submission_file = self.intern_job_submission_file(items[2])
+        if len(items) == 4:
+            self.dag[node].done = True
+
+
+    def __parse_vars_line(self, i, linestrip, all_jobs_parsed=False):
+        # Returns False if the line refers to a node that is not yet known.
+        items = linestrip.split(None, 2)
+        wrong_line_format_msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
+        wrong_line_format_msg += "Unexpected line format.\n"
+        wrong_line_format_msg += "Expected line format:\n"
+        wrong_line_format_msg += "VARS <node> <macro-1-key>=\"<macro-1-value>\" [<macro-2-key>=\"<macro-2-value>\" ...]\n"
+        wrong_line_format_msg += "(where macro values are allowed to contain white spaces)"
+        if len(items) < 3:
+            raise SyntaxError(wrong_line_format_msg)
+        node = items[1]
+        if node not in self.dag:
+            if not all_jobs_parsed:
+                return False
+            msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
+            msg += "Found a VARS line for node '%s', but there is no JOB line for this node." % (node)
+            raise SyntaxError(msg)
+        if self.dag[node].vars is not None:
+            msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
+            msg += "Found a second VARS line for node '%s'.\n" % (node)
+            msg += "Only one VARS line can be specified per node."
+            raise SyntaxError(msg)
+        self.dag[node].vars = parse_macros(items[2])
+        if not is_canonical_macros_text(items[2], self.dag[node].vars):
+            # Text which is not a well formed macro is kept, so that the line
+            # is written back as it was read.
+            self.dag[node].raw_vars = items[2]
+            if not is_well_formed_macros_text(items[2]):
+                msg  = "Dag file %s line %i: " % (self.dag_file, i)
+                msg += "ignoring the text of the VARS line for node '%s' which is not a <macro-key>=\"<macro-value>\" pair." % (node)
+                logging.getLogger(__name__).warning(msg)
+        return True
+
+
+    def __parse_parent_line(self, i, linestrip, all_jobs_parsed=False):
+        # Returns False if the line refers to a node that is not yet known.
+        j = linestrip.find(' CHILD ')
+        if j == -1:
+            msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
+            msg += "Unexpected line format.\n"
+            msg += 'Expected line format:\n'
+            msg += 'PARENT <parent-node-1> [<parent-node-2> ...] CHILD <child-node-1> [<child-node-2> ...]'
+            raise SyntaxError(msg)
+        parents = linestrip[:j][len('PARENT '):].replace(',', ' ').split()
+        children = linestrip[j+len(' CHILD '):].replace(',', ' ').split()
+        for parent in parents:
+            if parent not in self.dag:
+                if not all_jobs_parsed:
+                    return False
+                msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
+                msg += "There is no JOB line for parent node '%s'." % (parent)
+                raise SyntaxError(msg)
+        for child in children:
+            if child not in self.dag:
+                if not all_jobs_parsed:
+                    return False
+                msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
+                msg += "There is no JOB line for child node '%s'." % (child)
+                raise SyntaxError(msg)
+        for child in children:
+            for parent in parents:
+                self.__add_dependency(self.dag[parent], self.dag[child])
+        return True
+
+
+    def __parse_retry_line(self, i, linestrip, all_jobs_parsed=False):
+        # Returns False if the line refers to a node that is not yet known.
+        # The retry numbers of the nodes are set once the whole file is parsed.
+        items = linestrip.split()
+        wrong_line_format_msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
+        wrong_line_format_msg += "Unexpected line format.\n"
+        wrong_line_format_msg += "Expected line format:\n"
+        wrong_line_format_msg += "RETRY [<node> | ALL_NODES] <max-retries> [UNLESS-EXIT <exit-code1>[,<exit-code2>...]]\n"
+        wrong_line_format_msg += "(with max-retries a non-negative integer value and exit-code an integer value)"
+        if len(items) not in [3, 5]:
+            raise SyntaxError(wrong_line_format_msg)
+        try:
+            max_retries = int(items[2])
+            if max_retries < 0:
+                raise ValueError
+        except ValueError:
+            raise SyntaxError(wrong_line_format_msg)
+        if len(items) == 5:
+            if items[3] != 'UNLESS-EXIT':
+                raise SyntaxError(wrong_line_format_msg)
+            try:
+                no_retry_exit_codes = [int(code) for code in items[4].split(',')]
+            except ValueError:
+                raise SyntaxError(wrong_line_format_msg)
+        if items[1] == 'ALL_NODES':
+            if self.max_retries is not None:
+                msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
+                msg += "Found a second RETRY ALL_NODES line.\n"
+                msg += "Only one RETRY ALL_NODES line can be specified."
+                raise SyntaxError(msg)
+            # A RETRY ALL_NODES line overrides the RETRY lines found before it.
+            self.max_retries = max_retries
+            self.__retry_all_nodes_line = i
+            self.__retry_all_nodes_has_exit_codes = (len(items) == 5)
+            for node_record in self.dag_nodes:
+                node_record.max_retries = None
+            if len(items) == 5:
+                self.no_retry_exit_codes = no_retry_exit_codes
+                for node_record in self.dag_nodes:
+                    node_record.no_retry_exit_codes = None
+        else:
+            node = items[1]
+            if node not in self.dag:
+                if not all_jobs_parsed:
+                    return False
+                msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
+                msg += "Found a RETRY line for node '%s', but there is no JOB line for this node." % (node)
+                raise SyntaxError(msg)
+            overridden = self.__retry_all_nodes_line is not None and i < self.__retry_all_nodes_line
+            if self.dag[node].max_retries is not None and not overridden:
+                msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
+                msg += "Found a second RETRY line for node '%s'.\n" % (node)
+                msg += "Only one RETRY line can be specified per node."
+                raise SyntaxError(msg)
+            if not overridden:
+                self.dag[node].max_retries = max_retries
+            if len(items) == 5 and not (overridden and self.__retry_all_nodes_has_exit_codes):
+                self.dag[node].no_retry_exit_codes = no_retry_exit_codes
+        return True
+
+
+    def __parse_priority_line(self, i, linestrip, all_jobs_parsed=False):
+        # Returns False if the line refers to a node that is not yet known.
+        items = linestrip.split()
+        wrong_line_format_msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
+        wrong_line_format_msg += "Unexpected line format.\n"
+        wrong_line_format_msg += "Expected line format:\n"
+        wrong_line_format_msg += "PRIORITY <node> <priority>\n"
+        wrong_line_format_msg += "(with priority an integer value)"
+        if len(items) != 3:
+            raise SyntaxError(wrong_line_format_msg)
+        try:
+            priority = int(items[2])
+        except ValueError:
+            raise SyntaxError(wrong_line_format_msg)
+        node = items[1]
+        if node not in self.dag:
+            if not all_jobs_parsed:
+                return False
+            msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
+            msg += "Found a PRIORITY line for node '%s', but there is no JOB line for this node." % (node)
+            raise SyntaxError(msg)
+        if self.dag[node].priority is not None:
+            msg  = "Error parsing dag file %s line %i.\n" % (self.dag_file, i)
+            msg += "Found a second PRIORITY line for node '%s'.\n" % (node)
+            msg += "Only one PRIORITY line can be specified per node."
+            raise SyntaxError(msg)
+        self.dag[node].priority = priority
+        return True
+
+
+    def __set_retry_nums(self):
+        for node in self.dag:
+            if self.get_max_retries(node):
+                self.dag[node].retry_num = -1
+            else:
+                self.dag[node].retry_num = None
+
+
+    def get_parents(self, node):
+        return self.dag[node].get_parents()
+
+
+    def get_children(self, node):
+        return self.dag[node].get_children()
+
+
+    def init_num_pending_parents(self):
+        # The number of pending parents of a node is the number of its parents
+        # that are not done. A node is ready to run when this number is zero.
+        dag_nodes = self.dag_nodes
+        for node_record in dag_nodes:
+            node_record.num_pending_parents = len([parent_id for parent_id in node_record.parent_ids if not dag_nodes[parent_id].done])
+
+
+    def release_children(self, node):
+        # To be called once when a node is done. Decrements the number of pending
+        # parents of the node's children and returns the children that are left
+        # with no pending parents.
+        released_children = []
+        for child_id in self.dag[node].child_ids:
+            child_record = self.dag_nodes[child_id]
+            if child_record.num_pending_parents:
+                child_record.num_pending_parents -= 1
+                if child_record.num_pending_parents == 0:
+                    released_children.append(child_record.name)
+        return released_children
+
+
+    def get_priority(self, node):
+        priority = self.dag[node].priority
+        return priority if priority is not None else 0
+
+
+    def get_critical_path_weights(self, runtimes=None, default_runtime=1.0):
+        # The critical path weight of a node is its runtime plus the largest
+        # weight of its children, i.e. the least time it takes to run the node
+        # and all its descendants. The runtime of a node is taken from the
+        # given runtimes (a dict node -> seconds) if there, else it is the mean
+        # of the given runtimes of the nodes with the same job submission file
+        # or default_runtime; done nodes take no time. The weights are computed
+        # in reverse topological order and returned as an array by node id.
+        runtimes = runtimes or {}
+        job_submission_file_runtimes = {}
+        for node, runtime in runtimes.items():
+            if node in self.dag:
+                job_submission_file_runtimes.setdefault(self.dag[node].job_submission_file, []).append(runtime)
+        for job_submission_file, file_runtimes in list(job_submission_file_runtimes.items()):
+            job_submission_file_runtimes[job_submission_file] = float(sum(file_runtimes)) / len(file_runtimes)
+        dag_nodes = self.dag_nodes
+        weights = array('d', [0.0]) * len(dag_nodes)
+        for node_record in dag_nodes:
+            if node_record.done:
+                continue
+            runtime = runtimes.get(node_record.name)
+            if runtime is None:
+                runtime = job_submission_file_runtimes.get(node_record.job_submission_file, default_runtime)
+            weights[node_record.node_id] = runtime
+        num_pending_children = array('i', [len(node_record.child_ids) for node_record in dag_nodes])
+        node_ids = [node_record.node_id for node_record in dag_nodes if not node_record.child_ids]
+        while node_ids:
+            node_id = node_ids.pop()
+            node_record = dag_nodes[node_id]
+            if node_record.child_ids:
+                weights[node_id] += max([weights[child_id] for child_id in node_record.child_ids])
+            for parent_id in node_record.parent_ids:
+                num_pending_children[parent_id] -= 1
+                if num_pending_children[parent_id] == 0:
+                    node_ids.append(parent_id)
+        return weights
 
 
     def get_max_retries(self, node):
-        return self.dag[node].get('max_retries', self.max_retries)
+        max_retries = self.dag[node].max_retries
+        return max_retries if max_retries is not None else self.max_retries
 
 
     def get_no_retry_exit_codes(self, node):
-        return self.dag[node].get('no_retry_exit_codes', self.no_retry_exit_codes)
+        no_retry_exit_codes = self.dag[node].no_retry_exit_codes
+        return no_retry_exit_codes if no_retry_exit_codes is not None else self.no_retry_exit_codes
 
 
-    def write(self, dag_file='', use_dag_nodes_appearance_order=False, add_done_labels=False):
+    def write(self, dag_file='', use_dag_nodes_appearance_order=False, add_done_labels=False, done_nodes=None,
+              group_dependencies=False):
+        # If given, done_nodes is the set of nodes to label as done instead of
+        # those whose record says so (e.g. a snapshot taken by another thread).
+        # With group_dependencies, the children that have the same parents are
+        # written in a single PARENT ... CHILD ... line instead of one line per
+        # dependency.
         dag_file = dag_file.strip()
         if dag_file == '':
             if self.dag_file != '':
@@ -206,26 +595,72 @@ class Dag(object):
             nodes = sorted(self.dag_nodes_appearance_order, key=self.dag_nodes_appearance_order.get)
         else:
             nodes = self.get_nodes()
-        jobs_lines = []
+        lines = self.__generate_lines(nodes, add_done_labels, done_nodes, group_dependencies)
+        write_file_atomically(dag_file, self.__generate_chunks(lines))
+
+
+    def __generate_lines(self, nodes, add_done_labels, done_nodes, group_dependencies):
         for node in nodes:
-            job_line = 'JOB %s %s' % (node, self.dag[node]['job_submission_file'])
-            if add_done_labels and self.dag[node]['done']:
+            node_record = self.dag[node]
+            job_line = 'JOB %s %s' % (node, node_record.job_submission_file)
+            if add_done_labels and (node in done_nodes if done_nodes is not None else node_record.done):
                 job_line += ' DONE'
-            jobs_lines.append(job_line)
-            if self.dag[node].get('vars', ''):
-                vars_line = 'VARS %s %s' % (node, self.dag[node]['vars'])
-                jobs_lines.append(vars_line)
-            if 'max_retries' in self.dag[node]:
-                retry_line = 'RETRY %s %i' % (node, self.dag[node]['max_retries'])
-                jobs_lines.append(retry_line)
-        dependency_lines = []
+            yield job_line
+            if node_record.vars or node_record.raw_vars:
+                yield 'VARS %s %s' % (node, self.__get_macros_text(node_record))
+            if node_record.max_retries is not None:
+                yield 'RETRY %s %i' % (node, node_record.max_retries)
+            if node_record.priority is not None:
+                yield 'PRIORITY %s %i' % (node, node_record.priority)
+        if group_dependencies:
+            for line in self.__generate_grouped_dependency_lines(nodes):
+                yield line
+        else:
+            for node in nodes:
+                for parent_id in self.dag[node].parent_ids:
+                    yield 'PARENT %s CHILD %s' % (self.dag_nodes[parent_id].name, node)
+        if self.max_retries is not None:
+            yield 'RETRY ALL_NODES %i' % (self.max_retries)
+
+
+    def __get_macros_text(self, node_record):
+        # The macros are written back as they were read, unless they were
+        # changed since.
+        if node_record.raw_vars is not None and parse_macros(node_record.raw_vars) == node_record.vars:
+            return node_record.raw_vars
+        return format_macros(node_record.vars)
+
+
+    def __generate_grouped_dependency_lines(self, nodes):
+        # Group the children by their set of parents, keeping the order in
+        # which the groups first appear.
+        children_by_parent_ids = OrderedDict()
         for node in nodes:
-            for parent in self.dag[node]['parents']:
-                dependency_lines.append('PARENT %s CHILD %s' % (parent, node))
-        retry_all_nodes_line = ['RETRY ALL_NODES %i' % (self.max_retries)] if self.max_retries is not None else [] 
-        content = '\n'.join(jobs_lines + dependency_lines + retry_all_nodes_line)
-        with open(dag_file, 'w') as fd:
-            fd.write(content)
+            parent_ids = self.dag[node].parent_ids
+            if parent_ids:
+                children_by_parent_ids.setdefault(tuple(sorted(parent_ids)), []).append(node)
+        for parent_ids, children in children_by_parent_ids.items():
+            parents = ' '.join([self.dag_nodes[parent_id].name for parent_id in parent_ids])
+            yield 'PARENT %s CHILD %s' % (parents, ' '.join(children))
+
+
+    def __generate_chunks(self, lines, chunk_size=C.DAG_WRITE_CHUNK_SIZE):
+        # Join the lines (with no trailing new line) in chunks of about
+        # chunk_size characters, so that the file content is never held in
+        # memory as a whole.
+        chunk_lines = []
+        chunk_length = 0
+        first_chunk = True
+        for line in lines:
+            chunk_lines.append(line)
+            chunk_length += len(line) + 1
+            if chunk_length >= chunk_size:
+                yield ('' if first_chunk else '\n') + '\n'.join(chunk_lines)
+                first_chunk = False
+                chunk_lines = []
+                chunk_length = 0
+        if chunk_lines:
+            yield ('' if first_chunk else '\n') + '\n'.join(chunk_lines)
 
 
     def __str__(self):
@@ -248,7 +683,16 @@ class Dag(object):
 
 
     def __setitem__(self, node, value):
-        self.dag[node] = value
+        # The value can be a node record or any dict-like node record, which
+        # is copied into a new node record.
+        if isinstance(value, DagNode) and value.dag is self and value.name == node:
+            self.dag[node] = value
+            self.dag_nodes[value.node_id] = value
+            return
+        node_items = list(value.items())
+        self.reset_node(node)
+        for key, item_value in node_items:
+            self.dag[node][key] = item_value
 
 
     def __dict__(self):
@@ -0,0 +1,171 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from array import array
+
+
+# The keys under which the attributes of a node can be accessed as if the node
+# was a dict. The first three are always set; the others are set only when not
+# None.
+NODE_REQUIRED_KEYS = ['job_submission_file', 'parents', 'done']
+NODE_OPTIONAL_KEYS = ['vars', 'max_retries', 'no_retry_exit_codes', 'priority', 'retry_num', 'job_id', 'num_pending_parents']
+NODE_KEYS = NODE_REQUIRED_KEYS + NODE_OPTIONAL_KEYS
+
+NO_NODE_IDS = ()
+
+
+class DagNode(object):
+    # A compact record of a DAG node. The parents and children are kept as
+    # arrays of integer node ids, which the DAG maps back to nodes. For the
+    # sake of the existing code, a node can also be used as a dict with the
+    # keys in NODE_KEYS (plus any other key, kept in an extra dict).
+
+    __slots__ = ['dag', 'name', 'node_id', 'job_submission_file', 'parent_ids', 'child_ids', 'done',
+                 'vars', 'raw_vars', 'max_retries', 'no_retry_exit_codes', 'priority', 'retry_num', 'job_id',
+                 'num_pending_parents', 'extra']
+
+    def __init__(self, dag, name, node_id, job_submission_file=''):
+        self.dag = dag
+        self.name = name
+        self.node_id = node_id
+        self.job_submission_file = job_submission_file
+        self.parent_ids = NO_NODE_IDS
+        self.child_ids = NO_NODE_IDS
+        self.done = False
+        self.vars = None
+        # The macros text of the VARS line, only kept if writing the macros
+        # back would not reproduce it (e.g. because of its spacing).
+        self.raw_vars = None
+        self.max_retries = None
+        self.no_retry_exit_codes = None
+        self.priority = None
+        self.retry_num = None
+        self.job_id = None
+        self.num_pending_parents = None
+        self.extra = None
+
+
+    def add_parent_id(self, parent_id):
+        if self.parent_ids is NO_NODE_IDS:
+            self.parent_ids = array('i')
+        self.parent_ids.append(parent_id)
+
+
+    def add_child_id(self, child_id):
+        if self.child_ids is NO_NODE_IDS:
+            self.child_ids = array('i')
+        self.child_ids.append(child_id)
+
+
+    def get_parents(self):
+        return [self.dag.get_node_name(parent_id) for parent_id in self.parent_ids]
+
+
+    def get_children(self):
+        return [self.dag.get_node_name(child_id) for child_id in self.child_ids]
+
+
+    def __getitem__(self, key):
+        if key == 'parents':
+            return self.get_parents()
+        if key in NODE_KEYS:
+            value = getattr(self, key)
+            if value is None:
+                raise KeyError(key)
+            return value
+        if self.extra is None or key not in self.extra:
+            raise KeyError(key)
+        return self.extra[key]
+
+
+    def __setitem__(self, key, value):
+        if key == 'parents':
+            self.dag.set_parents(self.name, value)
+        elif key == 'job_submission_file':
+            self.job_submission_file = self.dag.intern_job_submission_file(value)
+        elif key in NODE_KEYS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+
+    def __delitem__(self, key):
+        if key in NODE_REQUIRED_KEYS:
+            raise KeyError('%s can not be removed from a node' % (key))
+        if key not in self:
+            raise KeyError(key)
+        if key in NODE_KEYS:
+            setattr(self, key, None)
+        else:
+            del self.extra[key]
+
+
+    def __contains__(self, key):
+        if key in NODE_REQUIRED_KEYS:
+            return True
+        if key in NODE_KEYS:
+            return getattr(self, key) is not None
+        return self.extra is not None and key in self.extra
+
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+
+    def keys(self):
+        keys = [key for key in NODE_KEYS if key in self]
+        if self.extra is not None:
+            keys.extend(self.extra.keys())
+        return keys
+
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+    def __len__(self):
+        return len(self.keys())
+
+
+    def __repr__(self):
+        return repr(dict(self.items()))
@@ -0,0 +1,110 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import os
+import sys
+
+from array import array
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from SlurmDagman.dag.utils.rescue_dag import get_dag_file_rootname
+from SlurmDagman.utils.files import write_file_atomically
+
+
+# To be increased whenever the format of the cached data changes.
+DAG_CACHE_VERSION = 4
+# The highest protocol that both python 2 and python 3 can read.
+DAG_CACHE_PICKLE_PROTOCOL = 2
+
+
+def get_dag_cache_format():
+    # Integer arrays are cached as raw bytes, which can only be read back on
+    # a platform with the same byte order and integer size.
+    return (DAG_CACHE_VERSION, sys.version_info[0], sys.byteorder, array('i').itemsize)
+
+
+def array_to_bytes(a):
+    return a.tobytes() if hasattr(a, 'tobytes') else a.tostring()
+
+
+def array_from_bytes(typecode, data):
+    a = array(typecode)
+    if hasattr(a, 'frombytes'):
+        a.frombytes(data)
+    else:
+        a.fromstring(data)
+    return a
+
+
+def get_dag_cache_file_name(dag_file):
+    # The dag file and its rescue dag files share the same cache file.
+    return get_dag_file_rootname(dag_file) + '.slurm_dagman.cache'
+
+
+def get_dag_file_signature(dag_file):
+    # The path, size and modification time of the dag file, and the hash of
+    # its content (to be computed only if the others match).
+    stat = os.stat(dag_file)
+    return {'path': os.path.abspath(dag_file), 'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': None}
+
+
+def compute_dag_file_hash(dag_file):
+    sha1 = hashlib.sha1()
+    with open(dag_file, 'rb') as fd:
+        while True:
+            data = fd.read(1024*1024)
+            if not data:
+                break
+            sha1.update(data)
+    return sha1.hexdigest()
+
+
+def read_dag_cache(dag_file):
+    # Return the data cached for the dag file, or None if there is no cache
+    # for the current content of the dag file. The cache file holds two
+    # pickles: a header, which is checked first, and the data.
+    cache_file = get_dag_cache_file_name(dag_file)
+    if not os.path.isfile(cache_file):
+        return None
+    signature = get_dag_file_signature(dag_file)
+    try:
+        with open(cache_file, 'rb') as fd:
+            header = pickle.load(fd)
+            if header.get('format') != get_dag_cache_format():
+                return None
+            for key in ['path', 'size', 'mtime']:
+                if header.get(key) != signature[key]:
+                    return None
+            if header.get('sha1') != compute_dag_file_hash(dag_file):
+                return None
+            return pickle.load(fd)
+    except Exception:
+        # A corrupted or incompatible cache is as good as no cache.
+        return None
+
+
+def write_dag_cache(dag_file, data):
+    signature = get_dag_file_signature(dag_file)
+    signature['sha1'] = compute_dag_file_hash(dag_file)
+    header = dict(signature, format=get_dag_cache_format())
+    content = [pickle.dumps(header, DAG_CACHE_PICKLE_PROTOCOL), pickle.dumps(data, DAG_CACHE_PICKLE_PROTOCOL)]
+    write_file_atomically(get_dag_cache_file_name(dag_file), content, binary=True)
@@ -0,0 +1,94 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+
+try:
+    from sys import intern
+except ImportError:
+    pass
+
+
+# A <macro-key>="<macro-value>" pair of a VARS line. Inside a value, \" stands
+# for a double quote and \\ for a backslash; any other backslash is kept as is.
+MACRO_PATTERN = r'([^\s"=]+)="([^"\\]*(?:\\.[^"\\]*)*)"'
+MACRO = re.compile(MACRO_PATTERN)
+MACRO_VALUE_ESCAPE = re.compile(r'\\(["\\])')
+
+# The text of VARS macros which are all well formed, and a text which
+# format_macros writes back unchanged: no escapes other than \" and a single
+# space between the macros.
+WELL_FORMED_MACROS_TEXT = re.compile(r'\s*(?:%s(?:\s+|$))*$' % (MACRO_PATTERN))
+CANONICAL_MACRO_PATTERN = r'[^\s"=]+="[^"\\]*(?:\\"[^"\\]*)*"'
+CANONICAL_MACROS_TEXT = re.compile(r'%s(?: %s)*$' % (CANONICAL_MACRO_PATTERN, CANONICAL_MACRO_PATTERN))
+
+
+def parse_macros(string):
+    # Parse the macros of a VARS line, i.e. a string like
+    #   <macro-1-key>="<macro-1-value>" [<macro-2-key>="<macro-2-value>" ...]
+    # into a dict. If a key is given more than once, the last value wins.
+    # Text which is not a well formed macro is ignored. The keys, which are
+    # usually the same for all the nodes, are interned.
+    pairs = MACRO.findall(string)
+    if not pairs:
+        return {}
+    macrokeys, macrovalues = zip(*pairs)
+    if '\\' in string:
+        if '\\\\' in string:
+            macrovalues = [MACRO_VALUE_ESCAPE.sub(unescape_macro_value_char, macrovalue) for macrovalue in macrovalues]
+        else:
+            macrovalues = [macrovalue.replace('\\"', '"') for macrovalue in macrovalues]
+    return dict(zip(map(intern, macrokeys), macrovalues))
+
+
+def unescape_macro_value_char(match):
+    return match.group(1)
+
+
+def is_well_formed_macros_text(string):
+    return WELL_FORMED_MACROS_TEXT.match(string) is not None
+
+
+def format_macros(macros):
+    # Inverse of parse_macros. A backslash is only escaped where it would
+    # otherwise be read as the start of an escape sequence, so that values
+    # written without unneeded escapes are written back unchanged.
+    items = []
+    for macrokey, macrovalue in macros.items():
+        if '\\' not in macrovalue:
+            items.append('%s="%s"' % (macrokey, macrovalue.replace('"', '\\"')))
+            continue
+        value_chars = []
+        for k, c in enumerate(macrovalue):
+            if c == '"':
+                value_chars.append('\\"')
+            elif c == '\\' and (k+1 == len(macrovalue) or macrovalue[k+1] in '"\\'):
+                value_chars.append('\\\\')
+            else:
+                value_chars.append(c)
+        items.append('%s="%s"' % (macrokey, ''.join(value_chars)))
+    return ' '.join(items)
+
+
+def is_canonical_macros_text(string, macros):
+    # Whether format_macros(macros) gives back string, the text from which
+    # macros were parsed. Without escapes other than \", irregular white
+    # spaces or repeated keys, it does; otherwise the macros are formatted to
+    # find out.
+    if CANONICAL_MACROS_TEXT.match(string) is not None and string.count('="') == len(macros):
+        return True
+    return format_macros(macros) == string
@@ -33,6 +33,36 @@ def exit(msg):
     sys.exit(1)
 
 
+def get_worker_params(options):
+    # The params of the worker that runs the DAG.
+    return {'dag_file': options['dag_file'],
+            'outfile': options['outfile'],
+            'proxy': options['proxy_file'],
+            'sleep_time': options['sleep_time'],
+            'max_jobs_queued': options['max_jobs_queued'],
+            'max_jobs_pending': options['max_jobs_pending'],
+            'max_jobs_submit': options['max_jobs_submit'],
+            'submit_wait_time': options['submit_wait_time'],
+            'array_submit': options['array_submit'],
+            'max_array_size': options['max_array_size'],
+            'submit_concurrency': options['submit_concurrency'],
+            'min_sleep_time': options['min_sleep_time'],
+            'checkpoint_interval': options['checkpoint_interval'],
+            'checkpoint_completions': options['checkpoint_completions'],
+            'group_dependencies': options['group_dependencies'],
+            'profile': options['profile'],
+            'profile_per_iteration': options['profile_per_iteration'],
+            'adaptive_submit': options['adaptive_submit'],
+            'min_submit_rate': options['min_submit_rate'],
+            'max_submit_rate': options['max_submit_rate'],
+            'submit_latency_target': options['submit_latency_target'],
+            'dag_cache': options['dag_cache'],
+            'metrics': options['metrics'],
+            'metrics_textfile_dir': options['metrics_textfile_dir'],
+            'replay_journal': (options['do_rescue_from'] == 0 and not options['no_rescue']),
+            'working_dir': options['working_dir']}
+
+
 options = {}
 
 parser = ArgumentParser(description="Submit a DAG to SLURM via slurm_dagman")
@@ -59,6 +89,29 @@ parser.add_argument("--no-rescue",
                     default = False,
                     help = "(ignore rescue DAGs)")
 
+parser.add_argument("--no-daemon",
+                    action = "store_true",
+                    dest = "no_daemon",
+                    default = False,
+                    help = "(start a new slurm_dagman process even if a slurm_dagman_daemon is running)")
+
+parser.add_argument("--dag-cache",
+                    action = "store_true",
+                    dest = "dag_cache",
+                    default = package_config.get_param('DAGMAN', 'dag_cache', 'boolean'),
+                    help = "(load the parsed DAG from a cache file when it is up to date, otherwise save it there)")
+
+parser.add_argument("--metrics",
+                    action = "store_true",
+                    dest = "metrics",
+                    default = package_config.get_param('DAGMAN', 'metrics', 'boolean'),
+                    help = "(write performance metrics in JSON and Prometheus text format at every iteration)")
+
+parser.add_argument("--metrics-textfile-dir",
+                    dest = "metrics_textfile_dir",
+                    default = package_config.get_param('DAGMAN', 'metrics_textfile_dir'),
+                    help = "(directory where to write the Prometheus metrics file, e.g. the node exporter textfile directory)")
+
 user = getpass.getuser()
 uid = pwd.getpwnam(user).pw_uid
 parser.add_argument("--use-proxy",
@@ -102,6 +155,84 @@ parser.add_argument("--submit-wait-time",
                     default = int(package_config.get_param('DAGMAN', 'submit_wait_time')),
                     help = "(time -in seconds- to wait after a job submission)")
 
+parser.add_argument("--array-submit",
+                    action = "store_true",
+                    dest = "array_submit",
+                    default = package_config.get_param('DAGMAN', 'array_submit', 'boolean'),
+                    help = "(submit the ready nodes that share a job submission file as slurm job arrays)")
+
+parser.add_argument("--max-array-size",
+                    type = int,
+                    dest = "max_array_size",
+                    default = int(package_config.get_param('DAGMAN', 'max_array_size')),
+                    help = "(maximum number of nodes that can be submitted in a single slurm job array)")
+
+parser.add_argument("--submit-concurrency",
+                    type = int,
+                    dest = "submit_concurrency",
+                    default = int(package_config.get_param('DAGMAN', 'submit_concurrency')),
+                    help = "(number of job submissions that can run at the same time)")
+
+parser.add_argument("--min-sleep-time",
+                    type = int,
+                    dest = "min_sleep_time",
+                    default = int(package_config.get_param('DAGMAN', 'min_sleep_time')),
+                    help = "(minimum time -in seconds- to sleep between two slurm dagman iterations)")
+
+parser.add_argument("--checkpoint-interval",
+                    type = int,
+                    dest = "checkpoint_interval",
+                    default = int(package_config.get_param('DAGMAN', 'checkpoint_interval')),
+                    help = "(time -in seconds- between two periodic rescue DAG checkpoints; 0 disables time based checkpoints)")
+
+parser.add_argument("--checkpoint-completions",
+                    type = int,
+                    dest = "checkpoint_completions",
+                    default = int(package_config.get_param('DAGMAN', 'checkpoint_completions')),
+                    help = "(number of node completions after which a rescue DAG checkpoint is written; 0 disables completion based checkpoints)")
+
+parser.add_argument("--group-dependencies",
+                    action = "store_true",
+                    dest = "group_dependencies",
+                    default = package_config.get_param('DAGMAN', 'group_dependencies', 'boolean'),
+                    help = "(write the dependencies of the children that have the same parents in a single PARENT ... CHILD ... line in the rescue DAG files)")
+
+parser.add_argument("--profile",
+                    action = "store_true",
+                    dest = "profile",
+                    default = package_config.get_param('DAGMAN', 'profile', 'boolean'),
+                    help = "(profile the slurm dagman work iterations with cProfile and dump the stats next to the DAG file)")
+
+parser.add_argument("--profile-per-iteration",
+                    action = "store_true",
+                    dest = "profile_per_iteration",
+                    default = package_config.get_param('DAGMAN', 'profile_per_iteration', 'boolean'),
+                    help = "(dump the profiling stats of each iteration to a separate file instead of cumulative stats)")
+
+parser.add_argument("--adaptive-submit",
+                    action = "store_true",
+                    dest = "adaptive_submit",
+                    default = package_config.get_param('DAGMAN', 'adaptive_submit', 'boolean'),
+                    help = "(adapt the job submission rate to the latency and the errors of sbatch, between --min-submit-rate and --max-submit-rate; --submit-wait-time only sets the initial rate)")
+
+parser.add_argument("--min-submit-rate",
+                    type = int,
+                    dest = "min_submit_rate",
+                    default = int(package_config.get_param('DAGMAN', 'min_submit_rate')),
+                    help = "(minimum job submission rate (in submissions per minute) with --adaptive-submit)")
+
+parser.add_argument("--max-submit-rate",
+                    type = int,
+                    dest = "max_submit_rate",
+                    default = int(package_config.get_param('DAGMAN', 'max_submit_rate')),
+                    help = "(maximum job submission rate (in submissions per minute) with --adaptive-submit)")
+
+parser.add_argument("--submit-latency-target",
+                    type = int,
+                    dest = "submit_latency_target",
+                    default = int(package_config.get_param('DAGMAN', 'submit_latency_target')),
+                    help = "(sbatch latency (in seconds) above which the job submission rate is halved with --adaptive-submit)")
+
 parser.add_argument("dagfile",
                     nargs = 1,
                     help = "(a DAG file)")
@@ -137,6 +268,11 @@ if args.do_rescue_from > 0:
     rename_rescue_dag_files(args.do_rescue_from + 1, options['dag_file'])
 
 options['no_rescue'] = args.no_rescue
+options['no_daemon'] = args.no_daemon
+options['working_dir'] = None
+options['dag_cache'] = args.dag_cache
+options['metrics'] = args.metrics
+options['metrics_textfile_dir'] = os.path.abspath(os.path.expanduser(args.metrics_textfile_dir)) if args.metrics_textfile_dir else None
 if args.logfile is None:
     options['logfile'] = dag_file_rootname + '.slurm_dagman.log'
 else:
@@ -161,3 +297,16 @@ options['max_jobs_queued'] = max(args.max_jobs_queued, 0)
 options['max_jobs_submit'] = max(args.max_jobs_submit, 0)
 options['max_jobs_pending'] = max(args.max_jobs_pending, 0)
 options['submit_wait_time'] = max(args.submit_wait_time, 0)
+options['array_submit'] = args.array_submit
+options['max_array_size'] = max(args.max_array_size, 0)
+options['submit_concurrency'] = max(args.submit_concurrency, 1)
+options['min_sleep_time'] = max(args.min_sleep_time, 0)
+options['checkpoint_interval'] = max(args.checkpoint_interval, 0)
+options['checkpoint_completions'] = max(args.checkpoint_completions, 0)
+options['group_dependencies'] = args.group_dependencies
+options['profile'] = args.profile
+options['profile_per_iteration'] = args.profile_per_iteration
+options['adaptive_submit'] = args.adaptive_submit
+options['min_submit_rate'] = max(args.min_submit_rate, 0)
+options['max_submit_rate'] = max(args.max_submit_rate, 0)
+options['submit_latency_target'] = max(args.submit_latency_target, 0)
@@ -0,0 +1,460 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import platform
+import threading
+import time
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+from SlurmDagman import constants as C
+from SlurmDagman.backends.base import SlurmBackend
+from SlurmDagman.backends.cli import CliBackend
+from SlurmDagman.process.status import is_process_alive
+from SlurmDagman.process.worker import Worker, SACCT_END_STATES
+from SlurmDagman.utils.files import write_file_atomically
+from SlurmDagman.utils.process import get_current_effective_user
+from SlurmDagman.utils.slurm import get_array_job_id
+
+
+# The directory of the daemon of a user: its pid file, its out file and the
+# spool directory where the DAGs to run are submitted.
+DAEMON_DIR = os.path.join('~', '.slurm_dagman', 'daemon')
+
+SPOOL_FILE_SUFFIX = '.dag.json'
+
+
+def get_daemon_dir():
+    return os.path.expanduser(DAEMON_DIR)
+
+
+def get_spool_dir(daemon_dir):
+    return os.path.join(daemon_dir, 'spool')
+
+
+def get_daemon_pid_file(daemon_dir):
+    return os.path.join(daemon_dir, 'daemon.pid')
+
+
+def get_running_daemon_pid(daemon_dir=None):
+    # Return the pid of the daemon running on this host, or None.
+    daemon_dir = daemon_dir if daemon_dir is not None else get_daemon_dir()
+    try:
+        with open(get_daemon_pid_file(daemon_dir), 'r') as fd:
+            daemon = json.load(fd)
+    except (IOError, OSError, ValueError):
+        return None
+    if daemon.get('host') != platform.node() or not is_process_alive(daemon.get('pid')):
+        return None
+    return daemon['pid']
+
+
+def submit_dag_to_daemon(worker_params, daemon_dir=None):
+    # Write the params of the worker that will run the DAG in the spool
+    # directory, where the daemon picks them up. Return the spool file name.
+    daemon_dir = daemon_dir if daemon_dir is not None else get_daemon_dir()
+    spool_dir = get_spool_dir(daemon_dir)
+    if not os.path.isdir(spool_dir):
+        os.makedirs(spool_dir)
+    dag_file_hash = hashlib.sha1(worker_params['dag_file'].encode('utf-8')).hexdigest()[:16]
+    spool_file = os.path.join(spool_dir, '%.6f_%s%s' % (time.time(), dag_file_hash, SPOOL_FILE_SUFFIX))
+    write_file_atomically(spool_file, json.dumps(worker_params, sort_keys=True) + '\n')
+    return spool_file
+
+
+def get_fair_shares(budget, demands):
+    # Split the budget in max-min fair shares: no share is larger than its
+    # demand, and what a demand doesn't need is split among the others.
+    shares = [0] * len(demands)
+    remaining = sorted(range(len(demands)), key=lambda i: demands[i])
+    while remaining:
+        share = budget // len(remaining)
+        i = remaining[0]
+        if demands[i] <= share:
+            shares[i] = demands[i]
+            budget -= demands[i]
+            remaining.pop(0)
+            continue
+        extra = budget - share*len(remaining)
+        for n, i in enumerate(remaining):
+            shares[i] = share + (1 if n < extra else 0)
+        break
+    return shares
+
+
+class SlurmQueryBroker(object):
+    # Runs the squeue and sacct queries for all the DAGs of the daemon: one
+    # squeue query for all the queued jobs of the user and one sacct query
+    # for the jobs (of all the DAGs' wckeys) that ended since the previous
+    # poll, at most once per poll interval. The squeue result is shared by
+    # all the DAGs and the sacct records are routed to the DAG that submitted
+    # the job, which gets them with its next sacct query.
+
+    def __init__(self, backend, user, poll_interval):
+        super(SlurmQueryBroker, self).__init__()
+        self.backend = backend
+        self.user = user
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.clients = []
+        # Array job id (or job id) -> client that submitted it.
+        self.job_owners = {}
+        self.squeue_out = []
+        self.squeue_err = []
+        self.sacct_err = []
+        self.start_time = datetime.datetime.now()
+        self.last_poll_time = None
+        self.last_sacct_poll_time = None
+        self.num_polls = 0
+
+
+    def add_client(self, client):
+        with self.lock:
+            self.clients.append(client)
+
+
+    def remove_client(self, client):
+        with self.lock:
+            self.clients.remove(client)
+            for job_id in client.job_ids:
+                if self.job_owners.get(job_id) is client:
+                    del self.job_owners[job_id]
+
+
+    def add_jobs(self, client, job_ids):
+        with self.lock:
+            for job_id in job_ids:
+                job_id = get_array_job_id(job_id)
+                self.job_owners[job_id] = client
+                client.job_ids.add(job_id)
+
+
+    def get_squeue_records(self):
+        with self.lock:
+            self.__poll_if_needed()
+            return list(self.squeue_out), list(self.squeue_err)
+
+
+    def get_sacct_records(self, client):
+        with self.lock:
+            self.__poll_if_needed()
+            records, client.sacct_records = client.sacct_records, []
+            return records, list(self.sacct_err)
+
+
+    def __poll_if_needed(self):
+        if self.last_poll_time is None or time.time() - self.last_poll_time >= self.poll_interval:
+            self.__poll()
+
+
+    def __poll(self):
+        self.last_poll_time = time.time()
+        self.num_polls += 1
+        poll_time = datetime.datetime.now()
+        wckeys = set([client.wckey for client in self.clients if client.wckey is not None])
+        squeue_out, self.squeue_err = self.backend.squeue(self.user, None, array=True)
+        self.squeue_out = [job for job in squeue_out if job[2] in wckeys]
+        self.sacct_err = []
+        if not wckeys:
+            self.last_sacct_poll_time = poll_time
+            return
+        # The window starts where the previous one ended; the records
+        # written too late for it are asked for by job id by the workers.
+        since = self.start_time
+        if self.last_sacct_poll_time is not None:
+            since = self.last_sacct_poll_time
+        sacct_out, self.sacct_err = self.backend.sacct(','.join(sorted(wckeys)), states=SACCT_END_STATES,
+                                                       starttime=since.isoformat().split('.')[0],
+                                                       endtime=poll_time.isoformat().split('.')[0], array=True)
+        for record in sacct_out:
+            client = self.job_owners.get(get_array_job_id(record[0]))
+            if client is not None:
+                client.sacct_records.append(record)
+        if not self.sacct_err:
+            self.last_sacct_poll_time = poll_time
+
+
+class DaemonBackend(SlurmBackend):
+    # The backend of a DAG run by the daemon. The submissions and cancels go
+    # to the Slurm backend, the squeue and sacct queries to the broker.
+
+    def __init__(self, broker, backend):
+        super(DaemonBackend, self).__init__()
+        self.broker = broker
+        self.backend = backend
+        self.simulated = backend.simulated
+        self.wckey = None
+        self.job_ids = set()
+        self.sacct_records = []
+        # Array job id (or job id) -> submission time.
+        self.submit_times = {}
+
+
+    def submit(self, script, sbatch_options, working_dir=None):
+        for option in sbatch_options:
+            if option.startswith('--wckey='):
+                self.wckey = option.split('=', 1)[1]
+        submit_time = time.time()
+        job_id, error = self.backend.submit(script, sbatch_options, working_dir=working_dir)
+        if job_id is not None:
+            self.submit_times[job_id] = submit_time
+            self.broker.add_jobs(self, [job_id])
+        return job_id, error
+
+
+    def sacct(self, wckey, job_ids=None, states=None, starttime=None, endtime=None, array=False):
+        self.wckey = wckey
+        if job_ids is None:
+            return self.broker.get_sacct_records(self)
+        # The jobs asked for explicitly are those the worker found neither in
+        # the queue nor in the recent accounting records. The jobs submitted
+        # after the last poll are left for the next one.
+        last_poll_time = self.broker.last_poll_time
+        if last_poll_time is not None:
+            job_ids = [job_id for job_id in job_ids if self.submit_times.get(job_id, 0) < last_poll_time]
+        if not job_ids:
+            return [], []
+        self.broker.add_jobs(self, job_ids)
+        return self.backend.sacct(wckey, job_ids=job_ids, states=states, starttime=starttime, endtime=endtime, array=array)
+
+
+    def squeue(self, user, job_ids, array=False):
+        out, err = self.broker.get_squeue_records()
+        if job_ids is None:
+            return out, err
+        job_ids = set(job_ids)
+        return [job for job in out if job[0] in job_ids or get_array_job_id(job[0]) in job_ids], err
+
+
+    def cancel(self, wckey):
+        return self.backend.cancel(wckey)
+
+
+class Daemon(object):
+    # Runs many DAGs in one process, each with a worker in its own thread.
+    # The DAGs are submitted to the daemon by writing the params of their
+    # workers in the spool directory. The Slurm queries of the workers are
+    # batched by a broker, and the max_jobs_queued and max_jobs_pending
+    # budgets of the daemon are shared fairly among the DAGs.
+
+    def __init__(self, daemon_dir=None, poll_interval=None, max_jobs_queued=0, max_jobs_pending=0, scan_interval=None,
+                 exit_when_idle=False, backend=None):
+        super(Daemon, self).__init__()
+        self.daemon_dir = daemon_dir if daemon_dir is not None else get_daemon_dir()
+        self.spool_dir = get_spool_dir(self.daemon_dir)
+        self.pid_file = get_daemon_pid_file(self.daemon_dir)
+        self.poll_interval = poll_interval if poll_interval is not None else C.DAEMON_POLL_INTERVAL
+        self.max_jobs_queued = max(max_jobs_queued, 0)
+        self.max_jobs_pending = max(max_jobs_pending, 0)
+        self.scan_interval = scan_interval if scan_interval is not None else C.DAEMON_SCAN_INTERVAL
+        self.exit_when_idle = exit_when_idle
+        self.backend = backend if backend is not None else CliBackend()
+        self.broker = SlurmQueryBroker(self.backend, get_current_effective_user(), self.poll_interval)
+        # DAG file -> dict with the worker of the DAG, its thread, its backend
+        # and its log handler.
+        self.dags = OrderedDict()
+        self.stop_event = threading.Event()
+
+
+    def run(self):
+        daemon_pid = get_running_daemon_pid(self.daemon_dir)
+        if daemon_pid is not None:
+            raise Exception('Another slurm_dagman daemon (PID %s) is running for directory %s.' % (daemon_pid, self.daemon_dir))
+        if not os.path.isdir(self.spool_dir):
+            os.makedirs(self.spool_dir)
+        write_file_atomically(self.pid_file, json.dumps({'pid': os.getpid(), 'host': platform.node()}) + '\n')
+        logging.info('******************************************************')
+        logging.info('** slurm_dagman daemon PID = %s' % (os.getpid()))
+        logging.info('******************************************************')
+        logging.info('Spool directory: %s' % (self.spool_dir))
+        logging.info('Slurm poll interval: %s secs' % (self.poll_interval))
+        logging.info('Max jobs queued: %s, max jobs pending: %s (0 = no limit)' % (self.max_jobs_queued, self.max_jobs_pending))
+        try:
+            while not self.stop_event.is_set():
+                self.__start_spooled_dags()
+                self.__reap_finished_dags()
+                if self.exit_when_idle and not self.dags:
+                    logging.info('No DAGs left to run.')
+                    break
+                self.__share_job_budgets()
+                self.stop_event.wait(self.scan_interval)
+        finally:
+            if get_running_daemon_pid(self.daemon_dir) == os.getpid():
+                os.remove(self.pid_file)
+        return 0
+
+
+    def __start_spooled_dags(self):
+        for spool_file in sorted(os.listdir(self.spool_dir)):
+            # Skip the temporary files of submissions being written.
+            if spool_file.startswith('.') or not spool_file.endswith(SPOOL_FILE_SUFFIX):
+                continue
+            spool_file = os.path.join(self.spool_dir, spool_file)
+            try:
+                with open(spool_file, 'r') as fd:
+                    worker_params = json.load(fd)
+            except (IOError, OSError, ValueError):
+                logging.exception('Failed to read DAG submission %s.' % (spool_file))
+                worker_params = None
+            os.remove(spool_file)
+            if worker_params is not None:
+                self.__start_dag(worker_params)
+
+
+    def __start_dag(self, worker_params):
+        dag_file = worker_params['dag_file']
+        if dag_file in self.dags:
+            logging.warning('DAG %s is already running; ignoring its new submission.' % (dag_file))
+            return
+        logger, handler = self.__get_dag_logger(dag_file, worker_params.get('outfile'))
+        backend = DaemonBackend(self.broker, self.backend)
+        try:
+            worker = Worker(backend=backend, logger=logger, **dict((str(k), v) for k, v in worker_params.items()))
+        except Exception:
+            logging.exception('Failed to start DAG %s.' % (dag_file))
+            self.__close_dag_logger(logger, handler)
+            return
+        # DAGs started in the same second get the same wckey, which must be
+        # unique to cancel the jobs of a DAG.
+        wckeys = set([dag['worker'].wckey for dag in self.dags.values()])
+        wckey, n = worker.wckey, 1
+        while worker.wckey in wckeys:
+            worker.wckey = '%s_%i' % (wckey, n)
+            n += 1
+        # The DAG gets its share of the job budgets from the next round.
+        if self.max_jobs_queued > 0:
+            worker.max_jobs_queued_share = 0
+        if self.max_jobs_pending > 0:
+            worker.max_jobs_pending_share = 0
+        self.broker.add_client(backend)
+        dag = {'worker': worker, 'backend': backend, 'logger': logger, 'handler': handler}
+        dag['thread'] = threading.Thread(target=self.__run_dag, args=(dag,), name=os.path.basename(dag_file))
+        dag['thread'].daemon = True
+        self.dags[dag_file] = dag
+        dag['thread'].start()
+        logging.info('Started DAG %s' % (dag_file))
+
+
+    def __get_dag_logger(self, dag_file, outfile):
+        # Each DAG logs to its own out file, not to the one of the daemon.
+        logger = logging.getLogger('SlurmDagman.daemon.%s' % (hashlib.sha1(dag_file.encode('utf-8')).hexdigest()[:16]))
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        handler = None
+        if outfile is not None:
+            handler = logging.FileHandler(outfile)
+            handler.setFormatter(logging.Formatter("%(asctime)-15s %(message)s", datefmt='%m/%d/%y %H:%M:%S'))
+            logger.addHandler(handler)
+        return logger, handler
+
+
+    def __close_dag_logger(self, logger, handler):
+        if handler is not None:
+            logger.removeHandler(handler)
+            handler.close()
+
+
+    def __run_dag(self, dag):
+        # Like the slurm_dagman executable: when the DAG doesn't complete,
+        # the queued jobs are cancelled and a rescue DAG file is written.
+        try:
+            rc = dag['worker'].run()
+        except Exception:
+            dag['logger'].exception('Error running slurm_dagman.')
+            rc = 1
+        if rc > 0:
+            self.__terminate_dag(dag)
+        dag['rc'] = rc
+
+
+    def __terminate_dag(self, dag):
+        try:
+            dag['worker'].terminate()
+        except Exception:
+            dag['logger'].exception('Error terminating slurm dagman worker.')
+        try:
+            dag['worker'].write_rescue_dag_file()
+        except Exception:
+            dag['logger'].exception('Failed to write rescue DAG.')
+
+
+    def __reap_finished_dags(self):
+        for dag_file, dag in list(self.dags.items()):
+            if dag['thread'].is_alive():
+                continue
+            self.broker.remove_client(dag['backend'])
+            self.__close_dag_logger(dag['logger'], dag['handler'])
+            del self.dags[dag_file]
+            logging.info('DAG %s finished (rc = %s)' % (dag_file, dag.get('rc')))
+
+
+    def __share_job_budgets(self):
+        workers = [dag['worker'] for dag in self.dags.values()]
+        if self.max_jobs_queued > 0:
+            shares = self.__share_job_budget(self.max_jobs_queued, [worker.num_nodes_queued for worker in workers],
+                                             [worker.num_nodes_ready for worker in workers],
+                                             [worker.max_jobs_queued for worker in workers],
+                                             [worker.max_jobs_queued_share for worker in workers])
+            for worker, share in zip(workers, shares):
+                worker.max_jobs_queued_share = share
+        if self.max_jobs_pending > 0:
+            shares = self.__share_job_budget(self.max_jobs_pending, [worker.num_nodes_pending for worker in workers],
+                                             [worker.num_nodes_ready for worker in workers],
+                                             [worker.max_jobs_pending for worker in workers],
+                                             [worker.max_jobs_pending_share for worker in workers])
+            for worker, share in zip(workers, shares):
+                worker.max_jobs_pending_share = share
+
+
+    def __share_job_budget(self, budget, num_jobs, num_nodes_ready, max_jobs, current_shares):
+        # The target of each DAG is its max-min fair share of the budget,
+        # given its demand: the jobs it has plus its ready nodes, within its
+        # own limit. Jobs are not taken back from a DAG above its target, so
+        # a DAG may only add jobs from the part of the budget that is free,
+        # up to its target. Until a DAG sees its new share, it may still
+        # submit up to its current one, so the budget it holds is the larger
+        # of its jobs and its current share; it keeps what it holds up to its
+        # target, and what it gives back is only free in the next round.
+        demands = []
+        for n, num_ready, max_n in zip(num_jobs, num_nodes_ready, max_jobs):
+            demands.append(min(n + num_ready, max_n) if max_n > 0 else n + num_ready)
+        targets = get_fair_shares(budget, demands)
+        held = [max(n, share or 0) for n, share in zip(num_jobs, current_shares)]
+        kept = [min(h, max(target, n)) for h, target, n in zip(held, targets, num_jobs)]
+        deficits = [max(target - k, 0) for target, k in zip(targets, kept)]
+        free = max(budget - sum(held), 0)
+        return [k + extra for k, extra in zip(kept, get_fair_shares(free, deficits))]
+
+
+    def terminate(self):
+        # Stop all the running DAGs. The thread of each DAG then cancels its
+        # queued jobs and writes its rescue DAG file, so that the DAGs are
+        # terminated in parallel.
+        self.stop_event.set()
+        dags = list(self.dags.values())
+        for dag in dags:
+            dag['worker'].stop()
+        for dag in dags:
+            dag['thread'].join()
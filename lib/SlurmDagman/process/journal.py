@@ -0,0 +1,108 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+
+
+# Journal record types.
+JOURNAL_START = 'START'
+JOURNAL_SUBMITTED = 'SUBMITTED'
+JOURNAL_ARRAY = 'ARRAY'
+JOURNAL_RETRY = 'RETRY'
+JOURNAL_DONE = 'DONE'
+JOURNAL_FAILED = 'FAILED'
+
+# Number of fields of each record type (including the type). The last field
+# of a record can contain white spaces.
+JOURNAL_RECORD_NUM_FIELDS = {
+    JOURNAL_START: 3,       # START <wckey> <start-time>
+    JOURNAL_SUBMITTED: 4,   # SUBMITTED <node> <job-id> <retry-num>
+    JOURNAL_ARRAY: 3,       # ARRAY <array-job-id> <tasks-file>
+    JOURNAL_RETRY: 3,       # RETRY <node> <retry-num>
+    JOURNAL_DONE: 2,        # DONE <node>
+    JOURNAL_FAILED: 2,      # FAILED <node>
+}
+
+
+class Journal(object):
+    # An append-only file with one line per record. Records are buffered by
+    # the file object and only made durable (fsync) by sync(), which allows
+    # to batch the records of a whole worker iteration in a single fsync.
+
+    def __init__(self, journal_file):
+        super(Journal, self).__init__()
+        self.journal_file = journal_file
+        self.fd = None
+        self.num_unsynced_records = 0
+
+
+    def exists(self):
+        return os.path.isfile(self.journal_file)
+
+
+    def read(self):
+        # Return the list of records in the journal file, each record being a
+        # list of fields. Lines that are not a complete record (as the last
+        # line can be if the writer was killed) are skipped.
+        records = []
+        if not self.exists():
+            return records
+        with open(self.journal_file, 'r') as fd:
+            for line in fd:
+                if not line.endswith('\n'):
+                    break
+                fields = line.rstrip('\n').split(' ', 1)
+                num_fields = JOURNAL_RECORD_NUM_FIELDS.get(fields[0])
+                if num_fields is None:
+                    continue
+                fields = line.rstrip('\n').split(' ', num_fields - 1)
+                if len(fields) == num_fields and all(fields):
+                    records.append(fields)
+        return records
+
+
+    def open(self):
+        if self.fd is None:
+            self.fd = open(self.journal_file, 'a')
+
+
+    def append(self, record_type, *fields):
+        if self.fd is None:
+            return
+        self.fd.write('%s\n' % (' '.join([record_type] + ['%s' % (field) for field in fields])))
+        self.num_unsynced_records += 1
+
+
+    def sync(self):
+        if self.fd is None or self.num_unsynced_records == 0:
+            return
+        self.fd.flush()
+        os.fsync(self.fd.fileno())
+        self.num_unsynced_records = 0
+
+
+    def close(self):
+        if self.fd is not None:
+            self.sync()
+            self.fd.close()
+            self.fd = None
+
+
+    def remove(self):
+        self.close()
+        if self.exists():
+            os.remove(self.journal_file)
@@ -0,0 +1,254 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+from SlurmDagman.utils.files import write_file_atomically
+
+
+# Upper bounds (in seconds) of the buckets of the duration histograms.
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Metric(object):
+    # A metric with a value per combination of label values.
+
+    metric_type = None
+
+    def __init__(self, name, help_text, label_names=()):
+        super(Metric, self).__init__()
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def get_samples(self):
+        # A list of (name suffix, label names and values, value) tuples.
+        samples = []
+        with self.lock:
+            for label_values, value in self.values.items():
+                samples.append(('', list(zip(self.label_names, label_values)), value))
+        return samples
+
+
+    def to_dict(self):
+        with self.lock:
+            if not self.label_names:
+                return self.values.get((), None)
+            return [dict(list(zip(self.label_names, label_values)) + [('value', value)]) for label_values, value in self.values.items()]
+
+
+class Counter(Metric):
+
+    metric_type = 'counter'
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+
+    metric_type = 'gauge'
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+
+class Histogram(Metric):
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=DURATION_BUCKETS):
+        super(Histogram, self).__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            if label_values not in self.values:
+                self.values[label_values] = {'bucket_counts': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            histogram = self.values[label_values]
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    histogram['bucket_counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+
+    def get_samples(self):
+        # The bucket counts are already cumulative, as Prometheus wants them.
+        samples = []
+        with self.lock:
+            for label_values, histogram in self.values.items():
+                labels = list(zip(self.label_names, label_values))
+                for upper_bound, bucket_count in zip(self.buckets, histogram['bucket_counts']):
+                    samples.append(('_bucket', labels + [('le', format_value(upper_bound))], bucket_count))
+                samples.append(('_bucket', labels + [('le', '+Inf')], histogram['count']))
+                samples.append(('_sum', labels, histogram['sum']))
+                samples.append(('_count', labels, histogram['count']))
+        return samples
+
+
+    def to_dict(self):
+        with self.lock:
+            histograms = []
+            for label_values, histogram in self.values.items():
+                h = dict(zip(self.label_names, label_values))
+                h['buckets'] = OrderedDict((format_value(upper_bound), bucket_count) for upper_bound, bucket_count in zip(self.buckets, histogram['bucket_counts']))
+                h['sum'] = histogram['sum']
+                h['count'] = histogram['count']
+                histograms.append(h)
+            return histograms
+
+
+class MetricsRegistry(object):
+    # A set of metrics that can be written in the Prometheus text format (as
+    # read by the textfile collector of the node exporter) and in JSON. The
+    # constant labels are added to all the metrics in the Prometheus format.
+
+    def __init__(self, constant_labels=None):
+        super(MetricsRegistry, self).__init__()
+        self.metrics = OrderedDict()
+        self.constant_labels = list(constant_labels.items()) if constant_labels else []
+
+
+    def counter(self, name, help_text, label_names=()):
+        return self.__add(Counter(name, help_text, label_names))
+
+
+    def gauge(self, name, help_text, label_names=()):
+        return self.__add(Gauge(name, help_text, label_names))
+
+
+    def histogram(self, name, help_text, label_names=(), buckets=DURATION_BUCKETS):
+        return self.__add(Histogram(name, help_text, label_names, buckets))
+
+
+    def __add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError("Metric '%s' is already in the registry." % (metric.name))
+        self.metrics[metric.name] = metric
+        return metric
+
+
+    def format_prometheus(self):
+        lines = []
+        for metric in self.metrics.values():
+            samples = metric.get_samples()
+            if not samples:
+                continue
+            lines.append('# HELP %s %s' % (metric.name, metric.help_text))
+            lines.append('# TYPE %s %s' % (metric.name, metric.metric_type))
+            for suffix, labels, value in samples:
+                lines.append('%s%s%s %s' % (metric.name, suffix, format_labels(self.constant_labels + labels), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+    def to_dict(self):
+        return OrderedDict((metric.name, metric.to_dict()) for metric in self.metrics.values())
+
+
+    def write(self, prometheus_file=None, json_file=None):
+        # The files are rewritten atomically, but not synced to disk, as they
+        # are rewritten often and losing them is harmless.
+        if prometheus_file:
+            write_file_atomically(prometheus_file, self.format_prometheus(), sync=False)
+        if json_file:
+            write_file_atomically(json_file, json.dumps(self.to_dict(), indent=1) + '\n', sync=False)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % (','.join(['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in labels]))
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class DagmanMetrics(MetricsRegistry):
+    # The metrics of a slurm dagman worker. A work iteration (cycle) is
+    # delimited by start_cycle and end_cycle.
+
+    def __init__(self, constant_labels=None):
+        super(DagmanMetrics, self).__init__(constant_labels)
+        self.backend_call_duration = self.histogram('slurm_dagman_backend_call_duration_seconds', 'Wall time of the calls to Slurm (sbatch, sacct, squeue, scancel).', ['call'])
+        self.cycle_duration = self.histogram('slurm_dagman_cycle_duration_seconds', 'Wall time of the work iterations (without the sleep).')
+        self.cycles = self.counter('slurm_dagman_cycles_total', 'Number of work iterations.')
+        self.submissions = self.counter('slurm_dagman_submissions_total', 'Number of node submissions, by result (success or failure).', ['result'])
+        self.transitions = self.counter('slurm_dagman_node_transitions_total', 'Number of node state changes.')
+        self.last_cycle_duration = self.gauge('slurm_dagman_last_cycle_duration_seconds', 'Wall time of the last work iteration.')
+        self.last_cycle_submissions = self.gauge('slurm_dagman_last_cycle_submissions', 'Number of node submissions in the last work iteration.')
+        self.last_cycle_transitions = self.gauge('slurm_dagman_last_cycle_transitions', 'Number of node state changes in the last work iteration.')
+        self.submit_rate = self.gauge('slurm_dagman_submit_rate_per_minute', 'Current job submission rate with adaptive submission.')
+        self.submission_failure_ratio = self.gauge('slurm_dagman_submission_failure_ratio', 'Fraction of the node submissions that failed.')
+        self.nodes = self.gauge('slurm_dagman_nodes', 'Number of nodes by state.', ['state'])
+        self.resident_memory = self.gauge('slurm_dagman_resident_memory_bytes', 'Resident memory of the slurm dagman process.')
+        self.max_resident_memory = self.gauge('slurm_dagman_max_resident_memory_bytes', 'Peak resident memory of the slurm dagman process.')
+        self.last_update_time = self.gauge('slurm_dagman_last_update_timestamp_seconds', 'Time at which the metrics were last updated.')
+        self.cycle_start_time = None
+        self.cycle_num_state_changes = 0
+        self.cycle_num_submissions = 0
+        self.num_submissions = 0
+        self.num_submission_failures = 0
+
+
+    def start_cycle(self, start_time, num_state_changes):
+        self.cycle_start_time = start_time
+        self.cycle_num_state_changes = num_state_changes
+        self.cycle_num_submissions = 0
+
+
+    def count_submission(self, success):
+        self.submissions.inc(1, 'success' if success else 'failure')
+        self.cycle_num_submissions += 1
+        self.num_submissions += 1
+        if not success:
+            self.num_submission_failures += 1
+        self.submission_failure_ratio.set(float(self.num_submission_failures) / self.num_submissions)
+
+
+    def end_cycle(self, end_time, num_state_changes):
+        # Returns False if no cycle was in progress.
+        if self.cycle_start_time is None:
+            return False
+        cycle_duration = end_time - self.cycle_start_time
+        num_transitions = num_state_changes - self.cycle_num_state_changes
+        self.cycle_duration.observe(cycle_duration)
+        self.cycles.inc()
+        self.transitions.inc(num_transitions)
+        self.last_cycle_duration.set(cycle_duration)
+        self.last_cycle_submissions.set(self.cycle_num_submissions)
+        self.last_cycle_transitions.set(num_transitions)
+        self.last_update_time.set(end_time)
+        self.cycle_start_time = None
+        return True
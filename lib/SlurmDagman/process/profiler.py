@@ -0,0 +1,81 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import cProfile
+import marshal
+import os
+
+from SlurmDagman.utils.files import write_file_atomically
+
+
+class IterationProfiler(object):
+    # Profiles the work iterations of a worker with cProfile. Between start()
+    # and stop() the profiler collects stats; stop() dumps them (in the pstats
+    # format) either to a single file with the cumulative stats of all the
+    # profiled iterations or, per iteration, to one file per iteration in a
+    # directory.
+
+    def __init__(self, profile_file, profile_dir):
+        super(IterationProfiler, self).__init__()
+        self.profile_file = profile_file
+        self.profile_dir = profile_dir
+        self.profiler = None
+        self.running = False
+
+
+    def start(self):
+        # Returns whether the profiler is running. Since python 3.12 only one
+        # profiler can be active per process, so it can not be started while
+        # another one (e.g. that of another DAG of the daemon) is active.
+        if self.running:
+            return True
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+        try:
+            self.profiler.enable()
+        except ValueError:
+            return False
+        self.running = True
+        return True
+
+
+    def stop(self, iteration, per_iteration=False):
+        # Stop profiling and dump the stats. Returns the file to which the
+        # stats were dumped, or None if the profiler was not running.
+        if not self.running:
+            return None
+        self.profiler.disable()
+        self.running = False
+        if per_iteration:
+            if not os.path.isdir(self.profile_dir):
+                os.mkdir(self.profile_dir)
+            profile_file = os.path.join(self.profile_dir, 'iteration_%06i.prof' % (iteration))
+        else:
+            profile_file = self.profile_file
+        self.profiler.create_stats()
+        write_file_atomically(profile_file, marshal.dumps(self.profiler.stats), binary=True, sync=False)
+        if per_iteration:
+            self.reset()
+        return profile_file
+
+
+    def reset(self):
+        # Forget the stats collected so far.
+        if self.running:
+            self.profiler.disable()
+            self.running = False
+        self.profiler = None
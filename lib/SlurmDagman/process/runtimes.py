@@ -0,0 +1,48 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+
+from SlurmDagman.dag.utils.rescue_dag import get_dag_file_rootname
+from SlurmDagman.utils.files import write_file_atomically
+
+
+# The runtimes (in seconds) of the nodes of a DAG in its previous runs are kept
+# in a file next to the DAG file, as a JSON dict node -> runtime, and used to
+# order the ready nodes by critical path.
+
+
+def get_runtimes_file_name(dag_file):
+    # The dag file and its rescue dag files share the same runtimes file.
+    return get_dag_file_rootname(dag_file) + '.slurm_dagman.runtimes'
+
+
+def read_runtimes(runtimes_file):
+    # Return the runtimes in the runtimes file, or an empty dict if it can
+    # not be read.
+    try:
+        with open(runtimes_file, 'r') as fd:
+            runtimes = json.load(fd)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(runtimes, dict):
+        return {}
+    return dict((node, float(runtime)) for node, runtime in runtimes.items() if isinstance(runtime, (int, float)))
+
+
+def write_runtimes(runtimes_file, runtimes):
+    write_file_atomically(runtimes_file, json.dumps(runtimes, sort_keys=True) + '\n', sync=False)
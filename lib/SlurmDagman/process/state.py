@@ -0,0 +1,148 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import heapq
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+
+NODE_UNREADY = 0
+NODE_READY = 1
+NODE_QUEUED = 2
+NODE_DONE = 3
+NODE_FAILED = 4
+
+NODE_STATES = [NODE_UNREADY, NODE_READY, NODE_QUEUED, NODE_DONE, NODE_FAILED]
+
+
+class NodeStateStore(object):
+
+    def __init__(self):
+        super(NodeStateStore, self).__init__()
+        self.node_states = {}
+        # Number of times a node was given a state, which allows to tell
+        # whether anything happened between two points in time.
+        self.num_state_changes = 0
+        # One insertion-ordered set of nodes per state.
+        self.state_nodes = OrderedDict((state, OrderedDict()) for state in NODE_STATES)
+        # The ready nodes are also kept in a heap, ordered by their sort key
+        # (smallest first, see set_ready_sort_key) and then by the order in
+        # which they became ready. The set of ready nodes maps each node to
+        # the sequence number of its heap entry; the entries of the nodes
+        # that left the ready state by other means than pop_node are stale
+        # and skipped when popped.
+        self.ready_sort_key = None
+        self.ready_heap = []
+        self.ready_seq = 0
+
+
+    def reset(self):
+        self.node_states.clear()
+        self.num_state_changes = 0
+        for state in self.state_nodes:
+            self.state_nodes[state].clear()
+        del self.ready_heap[:]
+
+
+    def set_ready_sort_key(self, sort_key):
+        # Order the ready nodes by sort_key(node) (e.g. a tuple), smallest
+        # first, instead of in the order in which they became ready.
+        self.ready_sort_key = sort_key
+        ready_nodes = list(self.state_nodes[NODE_READY].keys())
+        self.state_nodes[NODE_READY].clear()
+        del self.ready_heap[:]
+        for node in ready_nodes:
+            self.__add_ready_node(node)
+
+
+    def __add_ready_node(self, node):
+        sort_key = self.ready_sort_key(node) if self.ready_sort_key is not None else 0
+        self.ready_seq += 1
+        self.state_nodes[NODE_READY][node] = self.ready_seq
+        heapq.heappush(self.ready_heap, (sort_key, self.ready_seq, node))
+
+
+    def __add_state_node(self, node, state):
+        if state == NODE_READY:
+            self.__add_ready_node(node)
+        else:
+            self.state_nodes[state][node] = None
+
+
+    def add_node(self, node, state=NODE_UNREADY):
+        if node in self.node_states:
+            raise ValueError("Node '%s' is already in the state store." % (node))
+        self.node_states[node] = state
+        self.__add_state_node(node, state)
+
+
+    def set_node_state(self, node, state):
+        # A node that was popped has no state (None) until it is given a new one.
+        current_state = self.node_states[node]
+        if current_state is not None:
+            del self.state_nodes[current_state][node]
+        self.node_states[node] = state
+        self.__add_state_node(node, state)
+        self.num_state_changes += 1
+
+
+    def get_node_state(self, node):
+        return self.node_states[node]
+
+
+    def pop_node(self, state):
+        # Remove and return the node that has been the longest in the given
+        # state (for the ready state, the first one in the ready order), or
+        # None if there is no node in that state. The popped node is left
+        # without state until set_node_state is called for it.
+        if not self.state_nodes[state]:
+            return None
+        if state == NODE_READY:
+            return self.__pop_ready_node()
+        node, _ = self.state_nodes[state].popitem(last=False)
+        self.node_states[node] = None
+        return node
+
+
+    def __pop_ready_node(self):
+        ready_nodes = self.state_nodes[NODE_READY]
+        while self.ready_heap:
+            _, seq, node = heapq.heappop(self.ready_heap)
+            if ready_nodes.get(node) == seq:
+                del ready_nodes[node]
+                self.node_states[node] = None
+                return node
+        return None
+
+
+    def get_nodes(self, state):
+        return list(self.state_nodes[state].keys())
+
+
+    def count(self, state):
+        return len(self.state_nodes[state])
+
+
+    def __len__(self):
+        return len(self.node_states)
+
+
+    def __contains__(self, node):
+        return node in self.node_states
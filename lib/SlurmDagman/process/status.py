@@ -0,0 +1,99 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import errno
+import glob
+import hashlib
+import json
+import os
+
+from SlurmDagman.dag.utils.rescue_dag import get_dag_file_rootname
+from SlurmDagman.utils.files import write_file_atomically
+
+
+# The directory where each worker registers (with a symbolic link) its status
+# file, so that the status of all the DAGs of a user can be found without
+# searching for them.
+STATUS_INDEX_DIR = os.path.join('~', '.slurm_dagman', 'status')
+
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+STATUS_STOPPED = 'stopped'
+STATUS_CANCELLED = 'cancelled'
+STATUS_ERROR = 'error'
+
+
+def get_status_file_name(dag_file):
+    return os.path.abspath(get_dag_file_rootname(dag_file)) + '.slurm_dagman.status'
+
+
+def get_status_index_dir():
+    return os.path.expanduser(STATUS_INDEX_DIR)
+
+
+def register_status_file(status_file):
+    # Add a link to the status file in the status index directory (the name
+    # of the link is derived from the path of the status file).
+    status_file = os.path.abspath(status_file)
+    index_dir = get_status_index_dir()
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    link_name = os.path.join(index_dir, '%s.status' % (hashlib.sha1(status_file.encode('utf-8')).hexdigest()[:16]))
+    if os.path.islink(link_name) and os.readlink(link_name) == status_file:
+        return
+    if os.path.lexists(link_name):
+        os.remove(link_name)
+    os.symlink(status_file, link_name)
+
+
+def find_status_files(remove_dangling_links=True):
+    # Return the status files registered in the status index directory. The
+    # links to status files that don't exist anymore are removed.
+    status_files = []
+    for link_name in sorted(glob.glob(os.path.join(get_status_index_dir(), '*.status'))):
+        if os.path.exists(link_name):
+            status_files.append(os.readlink(link_name))
+        elif remove_dangling_links:
+            try:
+                os.remove(link_name)
+            except OSError:
+                pass
+    return status_files
+
+
+def write_status(status_file, status):
+    write_file_atomically(status_file, json.dumps(status, sort_keys=True) + '\n', sync=False)
+
+
+def read_status(status_file):
+    # Return the status in the status file, or None if it can not be read.
+    try:
+        with open(status_file, 'r') as fd:
+            return json.load(fd)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def is_process_alive(pid):
+    # Only meaningful for processes on this host.
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM means the process exists but belongs to somebody else.
+        return e.errno == errno.EPERM
+    return True
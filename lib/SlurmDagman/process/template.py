@@ -0,0 +1,97 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+
+
+class SubmissionTemplate(object):
+
+    def __init__(self, job_submission_file):
+        super(SubmissionTemplate, self).__init__()
+        self.job_submission_file = job_submission_file
+        # Alternating literal text and macro keys, starting and ending with
+        # literal text: [text, key, text, key, ..., text].
+        self.parts = ['']
+        self.mtime = None
+
+
+    def parse(self):
+        self.mtime = os.stat(self.job_submission_file).st_mtime
+        self.parts = ['']
+        with open(self.job_submission_file, 'r') as fd:
+            for line in fd:
+                self.__parse_line(line)
+
+
+    def __parse_line(self, line):
+        # A macro is written as $(<key>) and can not span more than one line.
+        startindex = 0
+        while True:
+            i = line.find('$(', startindex)
+            if i == -1:
+                break
+            j = line.find(')', i)
+            if j == -1:
+                break
+            self.parts[-1] += line[startindex:i]
+            self.parts.append(line[i+2:j])
+            self.parts.append('')
+            startindex = j+1
+        self.parts[-1] += line[startindex:]
+
+
+    def get_macro_keys(self):
+        return self.parts[1::2]
+
+
+    def render(self, get_macro_value):
+        # get_macro_value is called with each macro key and must return the
+        # value to put in place of the macro (an empty string if undefined).
+        rendered_parts = self.parts[:]
+        for k in range(1, len(rendered_parts), 2):
+            rendered_parts[k] = get_macro_value(rendered_parts[k])
+        return ''.join(rendered_parts)
+
+
+class SubmissionTemplateCache(object):
+
+    def __init__(self, validation_interval=60):
+        super(SubmissionTemplateCache, self).__init__()
+        # A cached template is checked against the modification time of its
+        # job submission file at most once every validation_interval seconds.
+        self.validation_interval = validation_interval
+        self.templates = {}
+        self.validation_times = {}
+
+
+    def get_template(self, job_submission_file):
+        template = self.templates.get(job_submission_file)
+        now = time.time()
+        if template is not None and now - self.validation_times[job_submission_file] < self.validation_interval:
+            return template
+        if template is None or os.stat(job_submission_file).st_mtime != template.mtime:
+            template = SubmissionTemplate(job_submission_file)
+            template.parse()
+            self.templates[job_submission_file] = template
+        self.validation_times[job_submission_file] = now
+        return template
+
+
+    def clear(self):
+        self.templates.clear()
+        self.validation_times.clear()
@@ -0,0 +1,84 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading
+import time
+
+
+class SubmitRateController(object):
+
+    def __init__(self, min_rate, max_rate, latency_target, initial_rate=None):
+        super(SubmitRateController, self).__init__()
+        # An AIMD (additive increase, multiplicative decrease) controller of
+        # the job submission rate, in submissions per minute. Every sbatch
+        # call that succeeds within the latency target increases the rate by
+        # one submission per minute; a call that fails or takes longer than
+        # the latency target (a busy slurmctld) halves it, at most once per
+        # latency target period so that a burst of slow calls counts as one.
+        self.lock = threading.Lock()
+        self.min_rate = None
+        self.max_rate = None
+        self.latency_target = None
+        self.rate = None
+        self.set_limits(min_rate, max_rate, latency_target)
+        self.rate = self.__clamp(initial_rate if initial_rate is not None else self.max_rate)
+        self.next_submit_time = None
+        self.last_decrease_time = None
+
+
+    def __clamp(self, rate):
+        return min(max(rate, self.min_rate), self.max_rate)
+
+
+    def set_limits(self, min_rate, max_rate, latency_target):
+        with self.lock:
+            self.min_rate = max(float(min_rate), 1.0)
+            self.max_rate = max(float(max_rate), self.min_rate)
+            self.latency_target = max(float(latency_target), 0.0)
+            if self.rate is not None:
+                self.rate = self.__clamp(self.rate)
+
+
+    def get_rate(self):
+        with self.lock:
+            return self.rate
+
+
+    def wait(self):
+        # Wait until the next submission is allowed. The slot is reserved
+        # before sleeping, so that concurrent submitters are spaced out.
+        with self.lock:
+            now = time.time()
+            if self.next_submit_time is None or self.next_submit_time < now:
+                self.next_submit_time = now
+            submit_time = self.next_submit_time
+            self.next_submit_time += 60.0 / self.rate
+        if submit_time > now:
+            time.sleep(submit_time - now)
+
+
+    def record(self, latency, error):
+        with self.lock:
+            if error or latency > self.latency_target:
+                now = time.time()
+                if self.last_decrease_time is not None and \
+                   now - self.last_decrease_time < max(self.latency_target, 1.0):
+                    return
+                self.last_decrease_time = now
+                self.rate = self.__clamp(self.rate / 2.0)
+            else:
+                self.rate = self.__clamp(self.rate + 1.0)
@@ -0,0 +1,92 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import errno
+import os
+import select
+import stat
+import time
+
+
+class WakeupTrigger(object):
+
+    def __init__(self, wakeup_file, check_interval=1):
+        super(WakeupTrigger, self).__init__()
+        # The wakeup file is a named pipe: a write to it wakes up the sleeper
+        # immediately. It does not need to exist; it is looked up (with a
+        # single stat) once per sleep, so that a missing file costs nothing
+        # on a shared file system. check_interval is how often the sleeper
+        # checks whether wake was called.
+        self.wakeup_file = wakeup_file
+        self.check_interval = check_interval
+        self.fifo_fd = None
+        self.woken = False
+
+
+    def __open_fifo(self):
+        if self.fifo_fd is not None:
+            return True
+        try:
+            if not stat.S_ISFIFO(os.stat(self.wakeup_file).st_mode):
+                return False
+            # Opening for reading and writing keeps the pipe open even when
+            # there are no writers, so that select does not return at EOF.
+            self.fifo_fd = os.open(self.wakeup_file, os.O_RDWR | os.O_NONBLOCK)
+        except OSError:
+            return False
+        return True
+
+
+    def __drain_fifo(self):
+        try:
+            while os.read(self.fifo_fd, 4096):
+                pass
+        except OSError as e:
+            if e.errno not in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                raise
+
+
+    def close(self):
+        if self.fifo_fd is not None:
+            os.close(self.fifo_fd)
+            self.fifo_fd = None
+
+
+    def wake(self):
+        # Wake up the sleeper (from another thread) within check_interval
+        # seconds.
+        self.woken = True
+
+
+    def sleep(self, seconds):
+        # Sleep the given time or until woken up. Return True if woken up.
+        end_time = time.time() + seconds
+        self.__open_fifo()
+        while True:
+            if self.woken:
+                self.woken = False
+                return True
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                return False
+            if self.fifo_fd is not None:
+                readable, _, _ = select.select([self.fifo_fd], [], [], min(self.check_interval, remaining))
+                if readable:
+                    self.__drain_fifo()
+                    return True
+            else:
+                time.sleep(min(self.check_interval, remaining))
@@ -15,53 +15,188 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import copy
 import datetime
+import hashlib
 import logging
 import os
 import platform
 import re
 import shutil
-import subprocess
+import threading
 import time
 
+from multiprocessing.pool import ThreadPool
+
 try:
     from collections import OrderedDict
 except ImportError:
     from ordereddict import OrderedDict
 
+from SlurmDagman import constants as C
+from SlurmDagman.backends.cli import CliBackend
 from SlurmDagman.config.data.process import process_config
 from SlurmDagman.config.manager import ConfigManager, ConfigurationError
 from SlurmDagman.config.utils.converters import text_to_bool
 from SlurmDagman.dag import Dag
 from SlurmDagman.dag.utils.rescue_dag import build_next_rescue_dag_file_name, get_dag_file_rootname
+from SlurmDagman.process.journal import Journal, JOURNAL_START, JOURNAL_SUBMITTED, JOURNAL_ARRAY, JOURNAL_RETRY, JOURNAL_DONE, JOURNAL_FAILED
+from SlurmDagman.process.metrics import DagmanMetrics
+from SlurmDagman.process.profiler import IterationProfiler
+from SlurmDagman.process.runtimes import get_runtimes_file_name, read_runtimes, write_runtimes
+from SlurmDagman.process.status import get_status_file_name, register_status_file, write_status, \
+                                       STATUS_RUNNING, STATUS_COMPLETED, STATUS_FAILED, STATUS_STOPPED, STATUS_CANCELLED, STATUS_ERROR
+from SlurmDagman.process.template import SubmissionTemplateCache
+from SlurmDagman.process.throttle import SubmitRateController
+from SlurmDagman.process.wakeup import WakeupTrigger
+from SlurmDagman.process.state import NodeStateStore, NODE_UNREADY, NODE_READY, NODE_QUEUED, NODE_DONE, NODE_FAILED
+from SlurmDagman.utils.files import get_file_signature
+from SlurmDagman.utils.process import get_current_effective_user, get_max_resident_memory, get_resident_memory
+from SlurmDagman.utils.slurm import build_array_task_job_id, expand_array_job_id, get_array_job_id
+
+
+ARRAY_TASK_MARKER = '#SLURM_DAGMAN_TASK'
+
+# Job states (in sacct --state abbreviations) in which a job has ended.
+SACCT_END_STATES = ['BF', 'CA', 'CD', 'DL', 'F', 'NF', 'OOM', 'PR', 'TO']
+
+# The params of the worker that are kept in the process config file, and can
+# thus be changed while the DAG runs: (name, type, section, unit in the logs).
+# Their defaults are those of the process config (see config/defaults).
+WORKER_PARAMS = [
+    ('sleep_time', 'int', 'DAGMAN', 'seconds'),
+    ('max_jobs_queued', 'int', 'DAGMAN', None),
+    ('max_jobs_pending', 'int', 'DAGMAN', None),
+    ('max_jobs_submit', 'int', 'DAGMAN', None),
+    ('submit_wait_time', 'int', 'DAGMAN', None),
+    ('array_submit', 'boolean', 'DAGMAN', None),
+    ('max_array_size', 'int', 'DAGMAN', None),
+    ('submit_concurrency', 'int', 'DAGMAN', None),
+    ('min_sleep_time', 'int', 'DAGMAN', 'seconds'),
+    ('checkpoint_interval', 'int', 'DAGMAN', 'seconds'),
+    ('checkpoint_completions', 'int', 'DAGMAN', None),
+    ('group_dependencies', 'boolean', 'DAGMAN', None),
+    ('profile', 'boolean', 'DAGMAN', None),
+    ('profile_per_iteration', 'boolean', 'DAGMAN', None),
+    ('adaptive_submit', 'boolean', 'DAGMAN', None),
+    ('min_submit_rate', 'int', 'DAGMAN', None),
+    ('max_submit_rate', 'int', 'DAGMAN', None),
+    ('submit_latency_target', 'int', 'DAGMAN', 'seconds'),
+    ('drain', 'boolean', 'DAGMAN', None),
+    ('cancel', 'boolean', 'DAGMAN', None),
+]
 
 
 class Worker(object):
 
-    def __init__(self, dag_file=None, outfile=None, proxy=None, sleep_time=None, max_jobs_queued=None,
-                 max_jobs_pending=None, max_jobs_submit=None, submit_wait_time=None):
+    def __init__(self, dag_file=None, outfile=None, proxy=None, backend=None, replay_journal=False, dag_cache=False,
+                 metrics=False, metrics_textfile_dir=None, logger=None, working_dir=None, register_status=None, **params):
+        # The other keyword arguments are params of WORKER_PARAMS; those not
+        # given (or None) keep their value from the process config.
         super(Worker, self).__init__()
         self.outfile = outfile
-        self.__set_logging()
-        logging.info('Using python %s' % (platform.python_version()))
+        self.__set_logging(logger)
+        self.logger.info('Using python %s' % (platform.python_version()))
         self.__init_dag(dag_file)
         self.proxy = proxy
+        self.dag_cache = dag_cache
+        # The directory the DAG was submitted from, if this process doesn't
+        # run in it (see the daemon). The relative job submission files are
+        # read from there and the jobs are submitted from there.
+        self.working_dir = working_dir
         self.__init_params()
         self.__init_process_config()
         self.process_config.set_params(process_config.get_params())
         self.process_config_file = get_dag_file_rootname(dag_file) + '.slurm_dagman.cfg'
-        self.set_params(sleep_time, max_jobs_queued, max_jobs_pending, max_jobs_submit, submit_wait_time)
-        self.dag_done = {}
-        self.num_nodes_total = 0
-        self.num_nodes_done = 0
-        self.num_nodes_queued = 0
-        self.num_nodes_ready = 0
-        self.num_nodes_unready = 0
-        self.num_nodes_failed = 0
+        # The signature of the process config file and the params in it when
+        # it was last read or written, to tell whether it has to be read or
+        # written again.
+        self.process_config_file_signature = None
+        self.process_config_file_params = None
+        # The controller of the job submission rate with adaptive_submit.
+        self.submit_rate_controller = None
+        self.set_params(**params)
+        # The dag owns the node records, including those of the done nodes;
+        # the state store only refers to the nodes by name.
+        self.node_states = NodeStateStore()
         self.start_time = datetime.datetime.now().isoformat().split('.')[0]
         self.wckey = 'slurm_dagman_%s' % (self.start_time.lower())
+        self.user = get_current_effective_user()
+        # The backend through which the jobs are submitted and queried.
+        self.backend = backend if backend is not None else CliBackend()
+        # Whether to register the status file in the status index directory
+        # (see slurm_dag_status); by default not for a simulated cluster.
+        self.register_status = register_status if register_status is not None else not self.backend.simulated
         self.queued_job_ids = []
+        self.queued_job_nodes = {}
+        self.queued_job_states = {}
+        # The shares of the job budgets of the daemon running this worker,
+        # which further limit max_jobs_queued and max_jobs_pending (None = no
+        # limit).
+        self.max_jobs_queued_share = None
+        self.max_jobs_pending_share = None
+        # The runtimes of the nodes, from the previous runs of the DAG and
+        # from this one, by which the ready nodes are ordered (critical path
+        # first). A job is timed from the first poll that sees it running.
+        self.runtimes_file = get_runtimes_file_name(dag_file)
+        self.node_runtimes = {}
+        self.node_runtimes_changed = False
+        self.job_run_start_times = {}
+        self.last_sacct_poll_time = None
+        # Queued job id -> number of consecutive polls in which the job was
+        # neither in the squeue nor in the sacct result. A job submitted
+        # since the previous poll is not counted as missing yet, as Slurm may
+        # not show it right away.
+        self.missing_job_polls = {}
+        self.job_submit_times = {}
+        self.last_poll_time = None
+        self.array_jobs = {}
+        self.array_files_dir = get_dag_file_rootname(dag_file) + '.slurm_dagman.arrays'
+        self.num_array_submissions = 0
+        self.submission_templates = SubmissionTemplateCache()
+        self.wakeup_trigger = WakeupTrigger(get_dag_file_rootname(dag_file) + '.slurm_dagman.wakeup')
+        self.stop_requested = False
+        # Every change of state of the nodes is recorded in the journal, so
+        # that the DAG can be resumed if this process dies without writing a
+        # rescue DAG file. An existing journal is only replayed if asked for.
+        self.journal = Journal(get_dag_file_rootname(dag_file) + '.slurm_dagman.journal')
+        self.replay_journal = replay_journal
+        # Checkpoints of the rescue DAG file are written while the DAG runs
+        # by a helper thread, at most one at a time.
+        self.checkpoint_thread = None
+        self.checkpoint_written = False
+        self.last_checkpoint_time = None
+        self.last_checkpoint_num_nodes_done = 0
+        # A JSON snapshot of the status of the DAG is written at the end of
+        # every iteration.
+        self.status_file = get_status_file_name(dag_file)
+        self.iteration_start_time = None
+        self.iteration_duration = None
+        self.num_nodes_running = 0
+        self.num_nodes_pending = 0
+        self.num_nodes_unknown = 0
+        # The work iterations are profiled while the profile parameter is set.
+        self.profiler = IterationProfiler(get_dag_file_rootname(dag_file) + '.slurm_dagman.prof',
+                                          get_dag_file_rootname(dag_file) + '.slurm_dagman.profile')
+        self.profiler_unavailable = False
+        self.num_iterations = 0
+        # Performance metrics, written at the end of every iteration.
+        self.metrics = None
+        if metrics:
+            self.__init_metrics(dag_file, metrics_textfile_dir)
+
+
+    def __init_metrics(self, dag_file, metrics_textfile_dir=None):
+        dag_file_rootname = os.path.abspath(get_dag_file_rootname(dag_file))
+        self.metrics = DagmanMetrics({'dag': dag_file_rootname})
+        self.metrics_json_file = dag_file_rootname + '.slurm_dagman.metrics.json'
+        if metrics_textfile_dir:
+            # The node exporter reads all the *.prom files in its textfile
+            # directory, so the file name must be unique for each dag.
+            dag_file_rootname_hash = hashlib.sha1(dag_file_rootname.encode('utf-8')).hexdigest()[:8]
+            dag_file_basename = re.sub('[^A-Za-z0-9_.-]', '_', os.path.basename(dag_file_rootname))
+            self.metrics_prometheus_file = os.path.join(metrics_textfile_dir, 'slurm_dagman_%s_%s.prom' % (dag_file_basename, dag_file_rootname_hash))
+        else:
+            self.metrics_prometheus_file = dag_file_rootname + '.slurm_dagman.prom'
 
 
     def __init_dag(self, dag_file=None):
@@ -72,21 +207,57 @@ class Worker(object):
 
     def reset_dag(self):
         self.__init_dag()
+        self.node_states.reset()
 
 
     def set_dag_file(self, dag_file):
         self.dag.set_dag_file(dag_file)
 
 
-    def __set_logging(self):
+    @property
+    def num_nodes_total(self):
+        return len(self.node_states)
+
+
+    @property
+    def num_nodes_unready(self):
+        return self.node_states.count(NODE_UNREADY)
+
+
+    @property
+    def num_nodes_ready(self):
+        return self.node_states.count(NODE_READY)
+
+
+    @property
+    def num_nodes_queued(self):
+        return self.node_states.count(NODE_QUEUED)
+
+
+    @property
+    def num_nodes_done(self):
+        return self.node_states.count(NODE_DONE)
+
+
+    @property
+    def num_nodes_failed(self):
+        return self.node_states.count(NODE_FAILED)
+
+
+    def __set_logging(self, logger=None):
+        # Several workers in the same process (see the daemon) each need their
+        # own logger; a single worker logs with the root logger.
+        if logger is not None:
+            self.logger = logger
+            return
+        self.logger = logging.getLogger()
         if self.outfile is not None:
             logging.basicConfig(format="%(asctime)-15s %(message)s", datefmt='%m/%d/%y %H:%M:%S', filename=self.outfile, level=logging.DEBUG)
 
 
     def __init_params(self):
-        self.sleep_time, self.max_jobs_queued, self.max_jobs_pending, self.max_jobs_submit, self.submit_wait_time, \
-        self.drain, self.cancel\
-            = list(self.__get_config_params(process_config).values())
+        for name, value in self.__get_config_params(process_config).items():
+            setattr(self, name, value)
 
 
     def __init_process_config(self):
@@ -103,13 +274,8 @@ class Worker(object):
  
     def __get_config_params(self, config, fallback=False, sanitize=True):
         params = OrderedDict()
-        params['sleep_time'] = self.__get_config_param(config, 'DAGMAN', 'sleep_time', fallback, 'int')
-        params['max_jobs_queued'] = self.__get_config_param(config, 'DAGMAN', 'max_jobs_queued', fallback, 'int')
-        params['max_jobs_pending'] = self.__get_config_param(config, 'DAGMAN', 'max_jobs_pending', fallback, 'int')
-        params['max_jobs_submit'] = self.__get_config_param(config, 'DAGMAN', 'max_jobs_submit', fallback, 'int')
-        params['submit_wait_time'] = self.__get_config_param(config, 'DAGMAN', 'submit_wait_time', fallback, 'int')
-        params['drain'] = self.__get_config_param(config, 'DAGMAN', 'drain', fallback, 'boolean')
-        params['cancel'] = self.__get_config_param(config, 'DAGMAN', 'cancel', fallback, 'boolean')
+        for name, cast, section, _ in WORKER_PARAMS:
+            params[name] = self.__get_config_param(config, section, name, fallback, cast)
         if sanitize:
             for name, value in list(params.items()):
                 params[name] = self.__replace_negative_int_by_zero(value)
@@ -137,38 +303,33 @@ class Worker(object):
         self.__init_params()
 
 
-    def set_params(self, sleep_time=None, max_jobs_queued=None, max_jobs_pending=None, max_jobs_submit=None,
-                   submit_wait_time=None, drain=None, cancel=None):
-        if sleep_time is not None:
-            self.sleep_time = self.__replace_negative_int_by_zero(sleep_time)
-        if max_jobs_queued is not None:
-            self.max_jobs_queued = self.__replace_negative_int_by_zero(max_jobs_queued)
-        if max_jobs_pending is not None:
-            self.max_jobs_pending = self.__replace_negative_int_by_zero(max_jobs_pending)
-        if max_jobs_submit is not None:
-            self.max_jobs_submit = self.__replace_negative_int_by_zero(max_jobs_submit)
-        if submit_wait_time is not None:
-            self.submit_wait_time = self.__replace_negative_int_by_zero(submit_wait_time)
-        if drain is not None:
-            self.drain = drain
-        if cancel is not None:
-            self.cancel = cancel
+    def set_params(self, **params):
+        # Set the given params of WORKER_PARAMS; a param given as None is left
+        # unchanged.
+        names = set([name for name, _, _, _ in WORKER_PARAMS])
+        for name in params:
+            if name not in names:
+                raise TypeError("set_params() got an unexpected keyword argument '%s'" % (name))
+        for name, _, _, _ in WORKER_PARAMS:
+            if params.get(name) is not None:
+                setattr(self, name, self.__replace_negative_int_by_zero(params[name]))
         self.__set_process_config_params()
         self.__write_process_config()
 
 
     def __set_process_config_params(self):
-        self.process_config.set_param('DAGMAN', 'sleep_time', self.sleep_time)
-        self.process_config.set_param('DAGMAN', 'max_jobs_queued', self.max_jobs_queued)
-        self.process_config.set_param('DAGMAN', 'max_jobs_pending', self.max_jobs_pending)
-        self.process_config.set_param('DAGMAN', 'max_jobs_submit', self.max_jobs_submit )
-        self.process_config.set_param('DAGMAN', 'submit_wait_time', self.submit_wait_time )
-        self.process_config.set_param('DAGMAN', 'drain', self.drain)
-        self.process_config.set_param('DAGMAN', 'cancel', self.cancel)
+        for name, _, section, _ in WORKER_PARAMS:
+            self.process_config.set_param(section, name, getattr(self, name))
  
 
     def __write_process_config(self):
+        params = self.process_config.get_params()
+        if params == self.process_config_file_params and \
+           get_file_signature(self.process_config_file) == self.process_config_file_signature:
+            return
         self.process_config.write_to_file(self.process_config_file)
+        self.process_config_file_signature = get_file_signature(self.process_config_file)
+        self.process_config_file_params = params
 
 
     def __load_process_config(self):
@@ -200,43 +361,23 @@ class Worker(object):
         # type.) In case of such a failure, we get None for that parameter;
         # so we have to handle the case of a parameter being None. Finally,
         # we will return True if there is no None parameter and False otherwise.
-        params = list(self.__get_process_config_params().values())
-        sleep_time, max_jobs_queued, max_jobs_pending, max_jobs_submit, submit_wait_time, \
-        drain, cancel \
-            = params[:]
-        if log_changes:
-            if sleep_time is not None and sleep_time != self.sleep_time:
-                logging.info("Dag config change detected: sleep_time set to %s seconds" % (sleep_time))
-            if max_jobs_queued is not None and max_jobs_queued != self.max_jobs_queued:
-                logging.info("Dag config change detected: max_jobs_queued set to %s" % (max_jobs_queued))
-            if max_jobs_pending is not None and max_jobs_pending != self.max_jobs_pending:
-                logging.info("Dag config change detected: max_jobs_pending set to %s" % (max_jobs_pending))
-            if max_jobs_submit is not None and max_jobs_submit != self.max_jobs_submit:
-                logging.info("Dag config change detected: max_jobs_submit set to %s" % (max_jobs_submit))
-            if submit_wait_time is not None and submit_wait_time != self.submit_wait_time:
-                logging.info("Dag config change detected: submit_wait_time set to %s" % (submit_wait_time))
-            if drain is not None and drain != self.drain:
-                logging.info("Dag config change detected: drain set to %s" % (drain))
-            if cancel is not None and cancel != self.cancel:
-                logging.info("Dag config change detected: cancel set to %s" % (cancel))
-        if sleep_time is not None:
-            self.sleep_time = sleep_time
-        if max_jobs_queued is not None:
-            self.max_jobs_queued = max_jobs_queued
-        if max_jobs_pending is not None:
-            self.max_jobs_pending = max_jobs_pending
-        if max_jobs_submit is not None:
-            self.max_jobs_submit = max_jobs_submit
-        if submit_wait_time is not None:
-            self.submit_wait_time = submit_wait_time
-        if drain is not None:
-            self.drain = drain
-        if cancel is not None:
-            self.cancel = cancel
-        return None not in params
+        params = self.__get_process_config_params()
+        for name, _, _, unit in WORKER_PARAMS:
+            value = params[name]
+            if value is None:
+                continue
+            if log_changes and value != getattr(self, name):
+                self.logger.info("Dag config change detected: %s set to %s%s" % (name, value, ' ' + unit if unit else ''))
+            setattr(self, name, value)
+        return None not in list(params.values())
 
 
     def __handle_process_config_loading_parsing_and_writing(self):
+        # The process config file is only read again if it changed since it
+        # was last read or written (by us).
+        signature = get_file_signature(self.process_config_file)
+        if signature is not None and signature == self.process_config_file_signature:
+            return
         rewrite = False
         self.__reset_process_config()
         if not self.__load_process_config():
@@ -247,114 +388,505 @@ class Worker(object):
         if rewrite:
             self.__set_process_config_params()
             self.__write_process_config()
+        else:
+            self.process_config_file_signature = signature
+            self.process_config_file_params = self.process_config.get_params()
 
 
     def __parse_dag_file(self):
-        self.dag.parse()
+        start_time = time.time()
+        self.dag.parse(use_cache=self.dag_cache)
+        if self.dag.loaded_from_cache:
+            self.logger.info('DAG loaded from cache in %.1f secs.' % (time.time() - start_time))
+        else:
+            self.logger.info('DAG parsed in %.1f secs.' % (time.time() - start_time))
 
 
     def __pre_execute_dag(self):
-        nodes_all = self.dag.get_nodes()
-        self.num_nodes_total = len(nodes_all)
-        self.num_nodes_unready = len(nodes_all)
-        for node in nodes_all:
-            if self.dag[node]['done']:
-                self.dag_done[node] = copy.deepcopy(self.dag[node])
-                self.dag.__dict__().pop(node)
-        del nodes_all
-        nodes_done = list(self.dag_done.keys())
-        self.num_nodes_done = len(nodes_done)
-        self.num_nodes_unready -= self.num_nodes_done
-        nodes_not_done = self.dag.get_nodes()
-        for node in nodes_not_done:
-            self.dag[node]['status'] = 0
-            self.dag_done[node] = {'parents': []}
-            parents = copy.copy(self.dag[node]['parents'])
-            for parent in parents:
-                if parent in nodes_done:
-                    if parent not in self.dag_done[node]['parents']:
-                        self.dag_done[node]['parents'].append(parent)
-                    self.dag[node]['parents'].remove(parent)
-            if not self.dag[node]['parents']:
-                self.__mark_node_as_ready(node)
-
-
-    def __pre_write_dag(self):
-        for node in list(self.dag_done.keys()):
-            if node not in self.dag:
-                self.dag[node] = copy.deepcopy(self.dag_done[node])
+        queued_nodes = self.__open_journal()
+        self.dag.init_num_pending_parents()
+        self.__init_ready_order()
+        for node in self.dag.get_nodes():
+            if self.dag[node].done:
+                self.node_states.add_node(node, NODE_DONE)
+            elif node in queued_nodes:
+                self.node_states.add_node(node, NODE_QUEUED)
             else:
-                for parent in self.dag_done[node]['parents']:
-                    if parent not in self.dag[node]['parents']:
-                        self.dag[node]['parents'].append(parent)
-            self.dag_done.pop(node)
+                self.node_states.add_node(node, NODE_UNREADY)
+                if self.dag[node].num_pending_parents == 0:
+                    self.__mark_node_as_ready(node)
+        self.__reattach_queued_nodes(queued_nodes)
+        self.journal.sync()
+
+
+    def __init_ready_order(self):
+        # The ready nodes are submitted by decreasing DAG priority (PRIORITY
+        # lines) and then by decreasing critical path weight, so that the
+        # long chains of dependencies start first.
+        start_time = time.time()
+        self.node_runtimes = read_runtimes(self.runtimes_file)
+        weights = self.dag.get_critical_path_weights(self.node_runtimes)
+        dag = self.dag
+        def sort_key(node):
+            node_record = dag[node]
+            return (-(node_record.priority or 0), -weights[node_record.node_id])
+        self.node_states.set_ready_sort_key(sort_key)
+        self.logger.info('Critical path weights computed in %.1f secs (%i node runtimes known).'
+                         % (time.time() - start_time, len(self.node_runtimes)))
+
+
+    def __write_runtimes(self):
+        if not self.node_runtimes_changed:
+            return
+        try:
+            write_runtimes(self.runtimes_file, self.node_runtimes)
+        except (IOError, OSError):
+            self.logger.exception('Failed to write the runtimes file %s.' % (self.runtimes_file))
+        self.node_runtimes_changed = False
+
+
+    def __open_journal(self):
+        # Replay the journal if asked for (otherwise discard it) and open it
+        # for appending. Returns the nodes that, according to the journal, are
+        # still queued, as a dict node -> (job id, retry number).
+        queued_nodes = OrderedDict()
+        if self.replay_journal and self.journal.exists():
+            queued_nodes = self.__replay_journal()
+        else:
+            self.journal.remove()
+        new_journal = not self.journal.exists()
+        self.journal.open()
+        if new_journal:
+            self.journal.append(JOURNAL_START, self.wckey, self.start_time)
+        return queued_nodes
+
+
+    def __replay_journal(self):
+        self.logger.info('Replaying journal %s' % (self.journal.journal_file))
+        queued_nodes = OrderedDict()
+        num_done = 0
+        for record in self.journal.read():
+            record_type = record[0]
+            if record_type == JOURNAL_START:
+                # Keep submitting (and querying) with the wckey of the journal.
+                self.wckey, self.start_time = record[1], record[2]
+                continue
+            if record_type == JOURNAL_ARRAY:
+                self.array_jobs[record[1]] = {'tasks_file': record[2], 'num_tasks_queued': 0}
+                self.num_array_submissions += 1
+                continue
+            node = record[1]
+            if node not in self.dag:
+                self.logger.warning('Ignoring journal record for unknown node %s' % (node))
+                continue
+            queued_nodes.pop(node, None)
+            if record_type == JOURNAL_SUBMITTED:
+                queued_nodes[node] = (record[2], int(record[3]))
+            elif record_type == JOURNAL_RETRY:
+                # The retry number is incremented again when the node is
+                # made ready.
+                if self.dag[node].retry_num is not None:
+                    self.dag[node].retry_num = int(record[2]) - 1
+            elif record_type == JOURNAL_DONE:
+                if not self.dag[node].done:
+                    num_done += 1
+                self.dag[node].done = True
+        self.logger.info('Journal replayed: %i nodes done, %i nodes queued' % (num_done, len(queued_nodes)))
+        return queued_nodes
+
+
+    def __reattach_queued_nodes(self, queued_nodes):
+        # Resume the monitoring of the jobs submitted by a previous process.
+        # The nodes are left as if they had been submitted by this process;
+        # they are already in the queued state and their submission is
+        # already in the journal.
+        for node, (job_id, retry_num) in queued_nodes.items():
+            if self.dag[node].retry_num is not None:
+                self.dag[node].retry_num = retry_num
+            array_job_id = get_array_job_id(job_id)
+            if array_job_id in self.array_jobs:
+                self.array_jobs[array_job_id]['num_tasks_queued'] += 1
+            self.dag[node].job_id = job_id
+            self.queued_job_nodes[job_id] = node
+            self.queued_job_ids.append(job_id)
+            self.logger.info('Re-attached to node %s: %s' % (node, job_id))
+        for array_job_id in list(self.array_jobs.keys()):
+            if self.array_jobs[array_job_id]['num_tasks_queued'] == 0:
+                self.array_jobs.pop(array_job_id)
 
 
     def write_rescue_dag_file(self):
+        # A checkpoint being written has the same file name; let it finish
+        # so that it doesn't overwrite the rescue dag file.
+        self.__wait_for_checkpoint()
         if self.num_nodes_done > 0:
             rescue_dag_file = build_next_rescue_dag_file_name(self.dag.get_dag_file())
-            logging.info('Writing rescue dag file %s ...' % (rescue_dag_file))
+            self.logger.info('Writing rescue dag file %s ...' % (rescue_dag_file))
             self.__write_dag_file(rescue_dag_file, True)
-            logging.info('Rescue dag file saved.')
+            self.logger.info('Rescue dag file saved.')
+        # The rescue dag file has everything the journal would be needed for.
+        self.journal.remove()
+
+
+    def __write_dag_file(self, dag_file, add_done_labels=True, done_nodes=None):
+        self.dag.write(dag_file, use_dag_nodes_appearance_order=True, add_done_labels=add_done_labels, done_nodes=done_nodes,
+                       group_dependencies=self.group_dependencies)
+
+
+    def __checkpoint_rescue_dag_file(self):
+        # Start writing a checkpoint of the rescue dag file if one is due
+        # (and none is being written). The done nodes are snapshotted here,
+        # so that the helper thread doesn't see the nodes finishing while it
+        # writes. The rest of the dag doesn't change during the execution.
+        if self.checkpoint_thread is not None and self.checkpoint_thread.is_alive():
+            return
+        num_nodes_done = self.num_nodes_done
+        if num_nodes_done == self.last_checkpoint_num_nodes_done:
+            return
+        checkpoint_due = False
+        if self.checkpoint_interval > 0 and time.time() - self.last_checkpoint_time >= self.checkpoint_interval:
+            checkpoint_due = True
+        if self.checkpoint_completions > 0 and num_nodes_done - self.last_checkpoint_num_nodes_done >= self.checkpoint_completions:
+            checkpoint_due = True
+        if not checkpoint_due:
+            return
+        done_nodes = frozenset(self.node_states.get_nodes(NODE_DONE))
+        self.last_checkpoint_time = time.time()
+        self.last_checkpoint_num_nodes_done = num_nodes_done
+        self.checkpoint_thread = threading.Thread(target=self.__write_checkpoint, args=(done_nodes,))
+        self.checkpoint_thread.daemon = True
+        self.checkpoint_thread.start()
+
+
+    def __write_checkpoint(self, done_nodes):
+        # Runs in the checkpoint thread. The checkpoint has the name of the
+        # rescue dag file that would be written at exit, so that it is picked
+        # up by slurm_submit_dag if this process gets killed.
+        rescue_dag_file = build_next_rescue_dag_file_name(self.dag.get_dag_file())
+        try:
+            start_time = time.time()
+            self.__write_dag_file(rescue_dag_file, True, done_nodes)
+            self.checkpoint_written = True
+            self.logger.info('Rescue dag checkpoint %s saved (%i nodes done) in %.1f secs.' % (rescue_dag_file, len(done_nodes), time.time() - start_time))
+        except Exception:
+            self.logger.exception('Failed to write rescue dag checkpoint %s.' % (rescue_dag_file))
+
+
+    def __wait_for_checkpoint(self):
+        if self.checkpoint_thread is not None:
+            self.checkpoint_thread.join()
+            self.checkpoint_thread = None
 
 
-    def __write_dag_file(self, dag_file, add_done_labels=True):
-        self.__pre_write_dag()
-        self.dag.write(dag_file, use_dag_nodes_appearance_order=True, add_done_labels=add_done_labels)
+    def __remove_checkpoint(self):
+        # A checkpoint is not needed once the DAG completed successfully.
+        if self.checkpoint_written:
+            rescue_dag_file = build_next_rescue_dag_file_name(self.dag.get_dag_file())
+            if os.path.isfile(rescue_dag_file):
+                os.remove(rescue_dag_file)
+            self.checkpoint_written = False
+
+
+    def __update_submit_rate_controller(self):
+        if not self.adaptive_submit:
+            self.submit_rate_controller = None
+        elif self.submit_rate_controller is None:
+            initial_rate = 60.0 / self.submit_wait_time if self.submit_wait_time > 0 else None
+            self.submit_rate_controller = SubmitRateController(self.min_submit_rate, self.max_submit_rate,
+                                                               self.submit_latency_target, initial_rate)
+        else:
+            self.submit_rate_controller.set_limits(self.min_submit_rate, self.max_submit_rate, self.submit_latency_target)
 
 
     def __submit_ready_nodes(self, num_nodes_pending):
+        self.__update_submit_rate_controller()
+        if self.array_submit or self.submit_concurrency > 1:
+            self.__submit_ready_nodes_in_batch(num_nodes_pending)
+            return
         num_submitted_nodes = 0
-        for node in self.dag:
-            if self.max_jobs_queued > 0 and len(self.queued_job_ids) >= self.max_jobs_queued:
+        # Nodes that fail to be submitted are put back in the ready state only
+        # after the loop, so that they are not retried in the same iteration.
+        nodes_to_retry = []
+        max_jobs_queued = self.__get_job_limit(self.max_jobs_queued, self.max_jobs_queued_share)
+        max_jobs_pending = self.__get_job_limit(self.max_jobs_pending, self.max_jobs_pending_share)
+        while True:
+            if max_jobs_queued is not None and len(self.queued_job_ids) >= max_jobs_queued:
                 break
-            if self.max_jobs_pending > 0 and (num_nodes_pending+num_submitted_nodes) >= self.max_jobs_pending:
+            if max_jobs_pending is not None and (num_nodes_pending+num_submitted_nodes) >= max_jobs_pending:
                 break
-            if self.dag[node]['status'] == 1: # node ready to be submitted
-                # Submit a job
-                job_id, error = self.__submit(self.dag[node]['job_submission_file'], node)
-                if job_id is not None:
-                    if 'retry_num' in self.dag[node] and self.dag[node]['retry_num'] > 0:
-                        logging.info('Submitted node %s (retry number %i out of %i): %s' % (node, self.dag[node]['retry_num'], self.dag.get_max_retries(node), job_id))
-                    else:
-                        logging.info('Submitted node %s: %s' % (node, job_id))
-                    self.__mark_node_as_queued(node, job_id)
-                    self.queued_job_ids.append(job_id)
-                    num_submitted_nodes += 1
-                else:
-                    self.__mark_node_as_queued(node)
-                    if 'retry_num' in self.dag[node] and self.dag[node]['retry_num'] > 0:
-                        logging.error('Failed to submit node %s (retry number %i out of %i)' % (node, self.dag[node]['retry_num'], self.dag.get_max_retries(node)))
-                    else:
-                        logging.error('Failed to submit node %s' % (node))
-                    if 'retry_num' in self.dag[node] and self.dag[node]['retry_num'] < self.dag.get_max_retries(node):
-                        self.__mark_node_as_ready(node)
-                        logging.info('Node %s will be retried.' % (node))
-                    else:
-                        self.__mark_node_as_failed(node)
-                    if error is not None:
-                        logging.debug('Error was: %s' % (error))
-                if self.max_jobs_submit > 0 and num_submitted_nodes >= self.max_jobs_submit:
+            node = self.node_states.pop_node(NODE_READY)
+            if node is None:
+                break
+            # Submit a job
+            job_id, error = self.__submit(self.dag[node].job_submission_file, node)
+            if self.__handle_submission_result(node, job_id, error, nodes_to_retry):
+                num_submitted_nodes += 1
+            if self.max_jobs_submit > 0 and num_submitted_nodes >= self.max_jobs_submit:
+                break
+            if self.submit_wait_time > 0 and self.submit_rate_controller is None:
+                time.sleep(self.submit_wait_time)
+        self.__retry_nodes(nodes_to_retry)
+
+
+    def __submit_ready_nodes_in_batch(self, num_nodes_pending):
+        # Take as many ready nodes as the limits allow and prepare their
+        # submissions (one per node or one per job array). With a submit
+        # concurrency larger than 1, the sbatch calls are run in a pool of
+        # threads, but the results are always applied in this thread. As in
+        # the serial submission, only the nodes that were submitted count
+        # against the limits: as long as submissions fail, more ready nodes
+        # are taken.
+        num_submitted_nodes = 0
+        nodes_to_retry = []
+        while True:
+            nodes = []
+            num_nodes_to_submit = self.__get_num_nodes_to_submit(num_nodes_pending+num_submitted_nodes, num_submitted_nodes)
+            while len(nodes) < num_nodes_to_submit:
+                node = self.node_states.pop_node(NODE_READY)
+                if node is None:
                     break
-                if self.submit_wait_time > 0:
-                    time.sleep(self.submit_wait_time)
+                nodes.append(node)
+            if not nodes:
+                break
+            num_jobs_queued = len(self.queued_job_ids)
+            self.__run_submissions(self.__prepare_submissions(nodes), nodes_to_retry)
+            num_submitted_nodes += len(self.queued_job_ids) - num_jobs_queued
+            if len(self.queued_job_ids) - num_jobs_queued == len(nodes):
+                break
+        self.__retry_nodes(nodes_to_retry)
+
+
+    def __run_submissions(self, submissions, nodes_to_retry):
+        if self.submit_concurrency > 1 and len(submissions) > 1:
+            pool = ThreadPool(min(self.submit_concurrency, len(submissions)))
+            try:
+                results = pool.imap(self.__run_submission, submissions)
+                for submission, (job_id, error) in zip(submissions, results):
+                    self.__apply_submission_result(submission, job_id, error, nodes_to_retry)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for submission in submissions:
+                job_id, error = self.__run_submission(submission)
+                self.__apply_submission_result(submission, job_id, error, nodes_to_retry)
+
+
+    def __prepare_submissions(self, nodes):
+        # The scripts of single node submissions are only rendered when they
+        # are submitted; those of job arrays are needed to group the nodes.
+        submissions = []
+        if self.array_submit:
+            for job_submission_file, array_nodes, scripts in self.__group_nodes_for_array_submission(nodes):
+                if len(array_nodes) == 1:
+                    submissions.append(self.__prepare_submission(array_nodes[0], script=scripts[0]))
+                else:
+                    submissions.append(self.__prepare_array_submission(job_submission_file, array_nodes, scripts))
+        else:
+            for node in nodes:
+                submissions.append(self.__prepare_submission(node))
+        return submissions
+
+
+    def __run_submission(self, submission):
+        # Runs in the submission threads; it must not change the worker state.
+        script = submission['script']
+        if script is None:
+            node = submission['nodes'][0]
+            script = submission['template'].render(lambda macrokey: self.__get_macro_value(node, macrokey))
+        result = self.__sbatch(script, submission['sbatch_options'])
+        if self.submit_wait_time > 0 and self.submit_rate_controller is None:
+            time.sleep(self.submit_wait_time)
+        return result
+
+
+    def __apply_submission_result(self, submission, job_id, error, nodes_to_retry):
+        if submission['tasks_file'] is None:
+            self.__handle_submission_result(submission['nodes'][0], job_id, error, nodes_to_retry)
+            return
+        if job_id is None:
+            os.remove(submission['tasks_file'])
+        else:
+            self.array_jobs[job_id] = {'tasks_file': submission['tasks_file'], 'num_tasks_queued': len(submission['nodes'])}
+            self.journal.append(JOURNAL_ARRAY, job_id, submission['tasks_file'])
+        for task_id, node in enumerate(submission['nodes']):
+            task_job_id = None
+            if job_id is not None:
+                task_job_id = build_array_task_job_id(job_id, task_id)
+            self.__handle_submission_result(node, task_job_id, error, nodes_to_retry)
+
+
+    def __get_num_nodes_to_submit(self, num_nodes_pending, num_submitted_nodes):
+        limits = [self.num_nodes_ready]
+        max_jobs_queued = self.__get_job_limit(self.max_jobs_queued, self.max_jobs_queued_share)
+        if max_jobs_queued is not None:
+            limits.append(max_jobs_queued - len(self.queued_job_ids))
+        max_jobs_pending = self.__get_job_limit(self.max_jobs_pending, self.max_jobs_pending_share)
+        if max_jobs_pending is not None:
+            limits.append(max_jobs_pending - num_nodes_pending)
+        if self.max_jobs_submit > 0:
+            limits.append(self.max_jobs_submit - num_submitted_nodes)
+        return max(min(limits), 0)
+
+
+    def __get_job_limit(self, max_jobs, max_jobs_share):
+        # The smaller of a max_jobs_* param (0 = no limit) and the share of
+        # the daemon budget (None = no limit), or None if there is no limit.
+        if max_jobs > 0 and max_jobs_share is not None:
+            return min(max_jobs, max_jobs_share)
+        if max_jobs > 0:
+            return max_jobs
+        return max_jobs_share
+
+
+    def __group_nodes_for_array_submission(self, nodes):
+        # Nodes can go in the same job array if they have the same job submission
+        # file and their scripts have the same header (i.e. the same #SBATCH
+        # directives) once the node macros are replaced. Returns a list of
+        # (job_submission_file, nodes, scripts) tuples in submission order.
+        groups = OrderedDict()
+        for node in nodes:
+            job_submission_file = self.dag[node].job_submission_file
+            script = self.__render_job_submission_file(job_submission_file, node)
+            key = (job_submission_file, self.__get_job_script_header(script))
+            if key not in groups:
+                groups[key] = ([], [])
+            groups[key][0].append(node)
+            groups[key][1].append(script)
+        arrays = []
+        for (job_submission_file, _), (group_nodes, scripts) in groups.items():
+            max_array_size = self.max_array_size if self.max_array_size > 0 else len(group_nodes)
+            for i in range(0, len(group_nodes), max_array_size):
+                arrays.append((job_submission_file, group_nodes[i:i+max_array_size], scripts[i:i+max_array_size]))
+        return arrays
+
+
+    def __get_job_script_header(self, script):
+        # The header of a job script are the lines (shebang, #SBATCH directives,
+        # comments and empty lines) before the first command.
+        header_lines = []
+        for line in script.splitlines(True):
+            if line.strip() and not line.lstrip().startswith('#'):
+                break
+            header_lines.append(line)
+        return ''.join(header_lines)
+
+
+    def __handle_submission_result(self, node, job_id, error, nodes_to_retry):
+        if job_id is not None:
+            if self.dag[node].retry_num is not None and self.dag[node].retry_num > 0:
+                self.logger.info('Submitted node %s (retry number %i out of %i): %s' % (node, self.dag[node].retry_num, self.dag.get_max_retries(node), job_id))
+            else:
+                self.logger.info('Submitted node %s: %s' % (node, job_id))
+            self.__mark_node_as_queued(node, job_id)
+            self.queued_job_ids.append(job_id)
+            if self.metrics is not None:
+                self.metrics.count_submission(True)
+            return True
+        self.__mark_node_as_queued(node)
+        if self.metrics is not None:
+            self.metrics.count_submission(False)
+        if self.dag[node].retry_num is not None and self.dag[node].retry_num > 0:
+            self.logger.error('Failed to submit node %s (retry number %i out of %i)' % (node, self.dag[node].retry_num, self.dag.get_max_retries(node)))
+        else:
+            self.logger.error('Failed to submit node %s' % (node))
+        if self.dag[node].retry_num is not None and self.dag[node].retry_num < self.dag.get_max_retries(node):
+            nodes_to_retry.append(node)
+        else:
+            self.__mark_node_as_failed(node)
+        if error is not None:
+            self.logger.debug('Error was: %s' % (error))
+        return False
+
+
+    def __retry_nodes(self, nodes):
+        for node in nodes:
+            self.__mark_node_as_ready(node)
+            self.logger.info('Node %s will be retried.' % (node))
+
+
+    def __get_submission_template(self, job_submission_file):
+        if self.working_dir is not None:
+            job_submission_file = os.path.join(self.working_dir, job_submission_file)
+        return self.submission_templates.get_template(job_submission_file)
+
+
+    def __render_job_submission_file(self, job_submission_file, node):
+        template = self.__get_submission_template(job_submission_file)
+        return template.render(lambda macrokey: self.__get_macro_value(node, macrokey))
 
 
     def __submit(self, job_submission_file, node):
-        with open(job_submission_file + '.tmp', 'w') as fd1:
-            with open(job_submission_file, 'r') as fd2:
-                for line in fd2:
-                    fd1.write(self.__replace_vars(line, node))
-        cmd = ['sbatch', '--job-name=%s' % (node), '--wckey=%s' % (self.wckey), job_submission_file + '.tmp']
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = p.communicate()
-        out = out.decode('utf-8').strip()
-        err = err.decode('utf-8').strip()
-        os.remove(job_submission_file + '.tmp')
-        if err or not out:
-            return None, err
-        job_id = out.strip('\n').split()[-1]
-        return job_id, None
+        script = self.__render_job_submission_file(job_submission_file, node)
+        return self.__sbatch(script, ['--job-name=%s' % (node)])
+
+
+    def __prepare_submission(self, node, script=None):
+        # Without a script, the script is rendered from the template when the
+        # node is submitted.
+        template = None
+        if script is None:
+            template = self.__get_submission_template(self.dag[node].job_submission_file)
+        return {'nodes': [node], 'script': script, 'template': template, 'sbatch_options': ['--job-name=%s' % (node)],
+                'tasks_file': None}
+
+
+    def __prepare_array_submission(self, job_submission_file, nodes, scripts):
+        # The scripts of the nodes are written one after the other into a tasks
+        # file, each one preceded by a marker line with its array task id. The
+        # array job script has the common header of the node scripts and extracts
+        # from the tasks file the script of its task, which it then runs.
+        if not os.path.isdir(self.array_files_dir):
+            os.mkdir(self.array_files_dir)
+        self.num_array_submissions += 1
+        tasks_file = os.path.join(self.array_files_dir, '%s_%i.tasks' % (self.wckey, self.num_array_submissions))
+        with open(tasks_file, 'w') as fd:
+            for task_id, (node, script) in enumerate(zip(nodes, scripts)):
+                fd.write('%s %i %s\n' % (ARRAY_TASK_MARKER, task_id, node))
+                fd.write(script if script.endswith('\n') else script + '\n')
+        header = self.__get_job_script_header(scripts[0])
+        interpreter = '/bin/sh'
+        if header.startswith('#!'):
+            interpreter = header.splitlines()[0][2:].strip()
+            header = '#!/bin/bash\n' + header.split('\n', 1)[1]
+        else:
+            header = '#!/bin/bash\n' + header
+        array_script  = header
+        array_script += 'SLURM_DAGMAN_TASKS_FILE="%s"\n' % (tasks_file)
+        array_script += 'SLURM_DAGMAN_TASK_SCRIPT=$(mktemp "${TMPDIR:-/tmp}/slurm_dagman_task.XXXXXX")\n'
+        array_script += 'awk -v task_id="${SLURM_ARRAY_TASK_ID}" \'$1 == "%s" {found = ($2 == task_id); next} found\' ' % (ARRAY_TASK_MARKER)
+        array_script += '"${SLURM_DAGMAN_TASKS_FILE}" > "${SLURM_DAGMAN_TASK_SCRIPT}"\n'
+        array_script += '%s "${SLURM_DAGMAN_TASK_SCRIPT}"\n' % (interpreter)
+        array_script += 'rc=$?\n'
+        array_script += 'rm -f "${SLURM_DAGMAN_TASK_SCRIPT}"\n'
+        array_script += 'exit ${rc}\n'
+        sbatch_options = ['--job-name=%s' % (os.path.basename(job_submission_file)), '--array=0-%i' % (len(nodes) - 1)]
+        return {'nodes': nodes, 'script': array_script, 'template': None, 'sbatch_options': sbatch_options, 'tasks_file': tasks_file}
+
+
+    def __sbatch(self, script, sbatch_options):
+        # With adaptive_submit, the sbatch calls are paced by the submit rate
+        # controller, which is fed back their latency and errors.
+        controller = self.submit_rate_controller
+        if controller is not None:
+            controller.wait()
+        start_time = time.time()
+        job_id, error = self.__call_backend('sbatch', self.backend.submit, script, sbatch_options + ['--wckey=%s' % (self.wckey)],
+                                            working_dir=self.working_dir)
+        if controller is not None:
+            controller.record(time.time() - start_time, error is not None)
+        return job_id, error
+
+
+    def __call_backend(self, call, function, *args, **kwargs):
+        # Call the backend, timing the call if metrics are enabled.
+        if self.metrics is None:
+            return function(*args, **kwargs)
+        start_time = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.metrics.backend_call_duration.observe(time.time() - start_time, call)
 
 
     def __handle_proxy(self):
@@ -369,50 +901,87 @@ class Worker(object):
             os.environ['X509_USER_PROXY'] = self.proxy
 
 
-    def __replace_vars(self, string, node):
-        startindex = 0
-        while True:
-            i = string.find('$(', startindex)
-            j = string.find(')', max(startindex, i))
-            startindex = j+1
-            if not (i > -1 and j > i):
-                break
-            macrokey = string[i+2:j]
-            m = self.dag[node].get('vars', '').split(macrokey+'="')
-            if len(m) == 2:
-                n = m[1].find('"')
-                if n > -1:
-                    macrovalue = m[1][:n]
-                    string = string[:i] + macrovalue + string[j+1:]
-                    startindex += (len(macrovalue) - (len(macrokey) + 3))
-                else:
-                    string = string[:i] + string[j+1:]
-                    startindex -= (len(macrokey) + 3)
-            else:
-                string = string[:i] + string[j+1:]
-                startindex -= (len(macrokey) + 3)
-        return string
-
-
-    def __sacct(self):
-        cmd = ['sacct', '--noheader', '-P', '--wckeys=%s' % (self.wckey), '--format=JobID,JobName,State,NodeList,ExitCode', '--jobs=%s' % (','.join(self.queued_job_ids)), '--starttime=%s' % (self.start_time)]
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = p.communicate()
-        out = out.decode('utf-8').strip().split('\n')
-        err = err.decode('utf-8').strip().split('\n')
-        out = [l for l in out if l and l.find('|batch|') == -1 and l.find('|extern|') == -1]
-        if len(err) == 1 and err[0] == '': err = []
-        return out, err
+    def __get_macro_value(self, node, macrokey):
+        macros = self.dag[node].vars
+        return macros.get(macrokey, '') if macros else ''
+
+
+    def __sacct(self, job_ids=None, states=None, starttime=None, endtime=None):
+        return self.__call_backend('sacct', self.backend.sacct, self.wckey, job_ids=job_ids, states=states, starttime=starttime,
+                                   endtime=endtime, array=bool(self.array_jobs))
+
+
+    def __query_sacct(self, poll_time, squeue_result):
+        # Ask sacct for the jobs that ended since the previous successful
+        # poll. A job whose accounting record was written too late to be in
+        # that window is missing from both the squeue and the sacct results;
+        # once it has been missing for more than one poll, it is asked for
+        # explicitly. Returns a dict job_id -> (status, exit_code).
+        sacct_result = OrderedDict()
+        if not self.queued_job_ids:
+            self.last_sacct_poll_time = poll_time
+            self.last_poll_time = time.time()
+            return sacct_result
+        starttime = self.start_time
+        if self.last_sacct_poll_time is not None:
+            starttime = self.last_sacct_poll_time.isoformat().split('.')[0]
+        endtime = poll_time.isoformat().split('.')[0]
+        sacct_out, sacct_err = self.__sacct(states=SACCT_END_STATES, starttime=starttime, endtime=endtime)
+        self.__parse_sacct_output(sacct_out, sacct_result)
+        missing_job_ids = []
+        missing_job_polls = {}
+        last_poll_time, self.last_poll_time = self.last_poll_time, time.time()
+        for job_id in self.queued_job_ids:
+            if job_id in squeue_result or job_id in sacct_result:
+                continue
+            if last_poll_time is None or self.job_submit_times.get(job_id, 0) >= last_poll_time:
+                continue
+            missing_job_polls[job_id] = self.missing_job_polls.get(job_id, 0) + 1
+            if missing_job_polls[job_id] > 1:
+                missing_job_ids.append(job_id)
+        self.missing_job_polls = missing_job_polls
+        if missing_job_ids:
+            missing_sacct_out, _ = self.__sacct(job_ids=self.__get_job_ids_for_query(missing_job_ids), starttime=self.start_time)
+            self.__parse_sacct_output(missing_sacct_out, sacct_result)
+        if not sacct_err:
+            self.last_sacct_poll_time = poll_time
+        return sacct_result
+
+
+    def __parse_sacct_output(self, sacct_out, sacct_result):
+        for job_id, job_name, status, computing_node, exit_code in sacct_out:
+            try:
+                exit_code = int(exit_code.split(':')[0])
+            except ValueError:
+                exit_code = 'undefined'
+            # A record can be for a job array and cover many tasks.
+            for job_id in expand_array_job_id(job_id):
+                if job_id in self.queued_job_nodes:
+                    sacct_result[job_id] = (status, exit_code)
+
+
+    def __get_job_ids_for_query(self, queued_job_ids):
+        # The tasks of a job array are queried by the array job id.
+        job_ids = []
+        array_job_ids = set()
+        for job_id in queued_job_ids:
+            array_job_id = get_array_job_id(job_id)
+            if array_job_id != job_id:
+                if array_job_id in array_job_ids:
+                    continue
+                array_job_ids.add(array_job_id)
+            job_ids.append(array_job_id)
+        return job_ids
 
 
     def __squeue(self):
-        cmd = ['squeue', '--noheader', '--format="%i|%T|%w|%N"']
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = p.communicate()
-        out = out.decode('utf-8').strip().split('\n')
-        err = err.decode('utf-8').strip().split('\n')
-        out = [l for l in out if l and l.find('|%s|' % (self.wckey)) > 0]
-        if len(err) == 1 and err[0] == '': err = []
+        # Ask only for the jobs queued by this DAG. Rows from other DAGs of
+        # the same user that would still slip through are dropped by wckey.
+        if not self.queued_job_ids:
+            return [], []
+        out, err = self.__call_backend('squeue', self.backend.squeue, self.user, self.__get_job_ids_for_query(self.queued_job_ids),
+                                       array=bool(self.array_jobs))
+        out = [job for job in out if job[2] == self.wckey]
         return out, err
 
 
@@ -420,150 +989,285 @@ class Worker(object):
         num_nodes_running = 0
         num_nodes_pending = 0
         num_nodes_unknown = 0
-        sacct_out, _ = self.__sacct()
+        poll_time = datetime.datetime.now()
         squeue_out, _ = self.__squeue()
         squeue_result = {}
-        for job in squeue_out:
-            job_id, status, wckey, computing_node = job.split('|')
-            squeue_result[job_id] = {'status': status, 'computing_node': computing_node}
+        for job_id, status, wckey, computing_node in squeue_out:
+            for job_id in expand_array_job_id(job_id):
+                squeue_result[job_id] = {'status': status, 'computing_node': computing_node}
+        sacct_result = self.__query_sacct(poll_time, squeue_result)
+        # Only the jobs whose status changed since the previous poll are
+        # processed. The squeue status has precedence over the sacct one.
+        job_changes = OrderedDict()
+        for job_id, (status, exit_code) in sacct_result.items():
+            job_changes[job_id] = (status, exit_code)
+        for job_id in squeue_result:
+            if job_id in self.queued_job_nodes:
+                job_changes[job_id] = (squeue_result[job_id]['status'], 'undefined')
         nodes_done = set()
-        for job in sacct_out:
-            job_id, job_name, status, computing_node, exit_code = job.split('|')
-            try:
-                exit_code = int(exit_code.split(':')[0])
-            except ValueError:
-                exit_code = 'undefined'
-            if job_id in squeue_result:
-                status = squeue_result[job_id]['status']
-                computing_node = squeue_result[job_id]['computing_node']
-            #if self.dag[job_name]['status'] == 2:
-            if status == 'PENDING':
-                num_nodes_pending += 1
-            elif status in ['RUNNING', 'COMPLETING']:
-                num_nodes_running += 1
+        for job_id, (status, exit_code) in job_changes.items():
+            if status == self.queued_job_states.get(job_id):
+                continue
+            node = self.queued_job_nodes[job_id]
+            if status in ['PENDING', 'RUNNING', 'COMPLETING', 'RESIZING', 'REQUEUED', 'REVOKED', 'SUSPENDED']:
+                self.queued_job_states[job_id] = status
+                if status == 'RUNNING' and job_id not in self.job_run_start_times:
+                    self.job_run_start_times[job_id] = time.time()
             elif status == 'COMPLETED':
-                logging.info('Node %s completed' % (job_name))
-                self.__mark_node_as_done(job_name)
-                nodes_done.add(job_name)
-                self.queued_job_ids.remove(job_id)
-            elif status in ['RESIZING', 'REQUEUED', 'REVOKED', 'SUSPENDED']:
-                num_nodes_unknown += 1
+                self.logger.info('Node %s completed' % (node))
+                if job_id in self.job_run_start_times:
+                    self.node_runtimes[node] = round(time.time() - self.job_run_start_times[job_id], 1)
+                    self.node_runtimes_changed = True
+                self.__mark_node_as_done(node)
+                nodes_done.add(node)
+                self.__forget_queued_job(job_id)
             else:
                 if status == 'FAILED':
-                    logging.info('Node %s failed (exit code %s)' % (job_name, exit_code))
+                    self.logger.info('Node %s failed (exit code %s)' % (node, exit_code))
                 else:
-                    logging.info('Node %s in status %s (exit_code %s) assumed to have failed' % (job_name, status, exit_code))
-                if 'retry_num' in self.dag[job_name] and self.dag[job_name]['retry_num'] < self.dag.get_max_retries(job_name) and exit_code not in self.dag.get_no_retry_exit_codes(job_name):
-                    self.__mark_node_as_ready(job_name)
-                    logging.info('Node %s will be retried' % (job_name))
+                    self.logger.info('Node %s in status %s (exit_code %s) assumed to have failed' % (node, status, exit_code))
+                if self.dag[node].retry_num is not None and self.dag[node].retry_num < self.dag.get_max_retries(node) and exit_code not in self.dag.get_no_retry_exit_codes(node):
+                    self.__mark_node_as_ready(node)
+                    self.logger.info('Node %s will be retried' % (node))
                 else:
-                    self.__mark_node_as_failed(job_name)
-                self.queued_job_ids.remove(job_id)
+                    self.__mark_node_as_failed(node)
+                self.__forget_queued_job(job_id)
+        for status in self.queued_job_states.values():
+            if status == 'PENDING':
+                num_nodes_pending += 1
+            elif status in ['RUNNING', 'COMPLETING']:
+                num_nodes_running += 1
+            else:
+                num_nodes_unknown += 1
         if nodes_done:
             self.__fix_parents(nodes_done)
         return num_nodes_running, num_nodes_pending, num_nodes_unknown
 
 
+    def __forget_queued_job(self, job_id):
+        self.queued_job_ids.remove(job_id)
+        self.queued_job_nodes.pop(job_id, None)
+        self.queued_job_states.pop(job_id, None)
+        self.job_run_start_times.pop(job_id, None)
+        self.missing_job_polls.pop(job_id, None)
+        self.job_submit_times.pop(job_id, None)
+        array_job_id = get_array_job_id(job_id)
+        if array_job_id in self.array_jobs:
+            self.array_jobs[array_job_id]['num_tasks_queued'] -= 1
+            if self.array_jobs[array_job_id]['num_tasks_queued'] == 0:
+                try:
+                    os.remove(self.array_jobs[array_job_id]['tasks_file'])
+                except OSError:
+                    self.logger.warning('Failed to remove tasks file %s' % (self.array_jobs[array_job_id]['tasks_file']))
+                self.array_jobs.pop(array_job_id)
+
+
     def __fix_parents(self, nodes_done):
-        for node in self.dag:
-            if self.dag[node]['status'] == 0:
-                for node_done in nodes_done:
-                    if node_done in self.dag[node]['parents']:
-                        if node not in self.dag_done: 
-                            self.dag_done[node] = {'parents': []}
-                        self.dag_done[node]['parents'].append(node_done)
-                        self.dag[node]['parents'].remove(node_done)
-                        if not self.dag[node]['parents']:
-                            self.__mark_node_as_ready(node)
-                            break
+        for node_done in nodes_done:
+            for node in self.dag.release_children(node_done):
+                if self.node_states.get_node_state(node) == NODE_UNREADY:
+                    self.__mark_node_as_ready(node)
 
 
     def __mark_node_as_ready(self, node):
-        self.dag[node]['status'] = 1
-        self.num_nodes_ready += 1
-        if 'retry_num' in self.dag[node]:
-            self.dag[node]['retry_num'] += 1
-            if self.dag[node]['retry_num'] > 0:
-                self.num_nodes_queued -= 1
-            else:
-                self.num_nodes_unready -= 1
-        else:
-            self.num_nodes_unready -= 1
+        if self.dag[node].retry_num is not None:
+            self.dag[node].retry_num += 1
+            if self.dag[node].retry_num > 0:
+                self.journal.append(JOURNAL_RETRY, node, self.dag[node].retry_num)
+        self.node_states.set_node_state(node, NODE_READY)
 
 
     def __mark_node_as_queued(self, node, job_id=None):
         if job_id is not None:
-            self.dag[node]['job_id'] = job_id
-        self.dag[node]['status'] = 2
-        self.num_nodes_queued += 1
-        self.num_nodes_ready -= 1
+            self.dag[node].job_id = job_id
+            self.queued_job_nodes[job_id] = node
+            self.job_submit_times[job_id] = time.time()
+            retry_num = self.dag[node].retry_num
+            self.journal.append(JOURNAL_SUBMITTED, node, job_id, retry_num if retry_num is not None else -1)
+        self.node_states.set_node_state(node, NODE_QUEUED)
 
 
     def __mark_node_as_done(self, node):
-        self.dag[node]['status'] = 3
-        self.dag[node]['done'] = True
-        self.num_nodes_done += 1
-        self.num_nodes_queued -= 1
-        for parent in self.dag_done[node]['parents']:
-            if parent not in self.dag[node]['parents']:
-                self.dag[node]['parents'].append(parent)
-        self.dag_done.pop(node)
-        self.dag_done[node] = copy.deepcopy(self.dag[node])
-        self.dag.__dict__().pop(node)
+        self.node_states.set_node_state(node, NODE_DONE)
+        self.dag[node].done = True
+        self.journal.append(JOURNAL_DONE, node)
 
 
     def __mark_node_as_failed(self, node):
-        self.dag[node]['status'] = 4
-        self.num_nodes_failed += 1
-        self.num_nodes_queued -= 1
+        self.node_states.set_node_state(node, NODE_FAILED)
+        self.journal.append(JOURNAL_FAILED, node)
 
 
     def __execute_dag(self):
         self.__pre_execute_dag()
-        logging.info('******************************************************')
-        logging.info('** PID = %s' % (os.getpid()))
+        # The status file is written before it is registered, so that the
+        # link to it is never dangling.
+        self.__write_status(STATUS_RUNNING)
+        self.__register_status_file()
+        self.logger.info('******************************************************')
+        self.logger.info('** PID = %s' % (os.getpid()))
         if os.getppid():
-            logging.info('** Parent PID = %s' % (os.getppid()))
-        logging.info('******************************************************')
-        logging.info('DAG file: %s' % (self.dag.get_dag_file()))
-        logging.info('DAGMan config file for this DAG: %s' % (self.process_config_file))
-        logging.info('Sleep time between iterations: %s secs' % (self.sleep_time))
-        logging.info('Will submit jobs with wckey=%s' % (self.wckey))
+            self.logger.info('** Parent PID = %s' % (os.getppid()))
+        self.logger.info('******************************************************')
+        self.logger.info('DAG file: %s' % (self.dag.get_dag_file()))
+        self.logger.info('DAGMan config file for this DAG: %s' % (self.process_config_file))
+        self.logger.info('Sleep time between iterations: %s secs (at least %s secs)' % (self.sleep_time, min(self.min_sleep_time, self.sleep_time)))
+        self.logger.info('Write to %s (a named pipe created with mkfifo) to wake up from sleep' % (self.wakeup_trigger.wakeup_file))
+        self.logger.info('Will submit jobs with wckey=%s' % (self.wckey))
+        self.logger.info('Set profile = yes in %s to profile the iterations' % (self.process_config_file))
+        if self.checkpoint_interval > 0 or self.checkpoint_completions > 0:
+            self.logger.info('Rescue dag checkpoints every %s secs or %s node completions (0 = never)' % (self.checkpoint_interval, self.checkpoint_completions))
+        self.last_checkpoint_time = time.time()
+        self.last_checkpoint_num_nodes_done = self.num_nodes_done
+        sleep_time = 0
         while True:
+            num_state_changes = self.node_states.num_state_changes
+            self.num_iterations += 1
+            self.iteration_start_time = time.time()
+            if self.profile:
+                self.__start_profiler()
+            if self.metrics is not None:
+                self.metrics.start_cycle(time.time(), num_state_changes)
             num_nodes_running, num_nodes_pending, num_nodes_unknown = self.__monitor()
-            logging.info('Of %i nodes total:' % (self.num_nodes_total))
-            logging.info('  Done   Queued    Ready   Un-Ready   Failed')
-            logging.info('   ===      ===      ===        ===      ===')
-            logging.info('%6s   %6s   %6s     %6s   %6s' % (self.num_nodes_done, self.num_nodes_queued, self.num_nodes_ready, self.num_nodes_unready, self.num_nodes_failed))
+            self.num_nodes_running, self.num_nodes_pending, self.num_nodes_unknown = num_nodes_running, num_nodes_pending, num_nodes_unknown
+            self.journal.sync()
+            self.logger.info('Of %i nodes total:' % (self.num_nodes_total))
+            self.logger.info('  Done   Queued    Ready   Un-Ready   Failed')
+            self.logger.info('   ===      ===      ===        ===      ===')
+            self.logger.info('%6s   %6s   %6s     %6s   %6s' % (self.num_nodes_done, self.num_nodes_queued, self.num_nodes_ready, self.num_nodes_unready, self.num_nodes_failed))
             if self.num_nodes_queued > 0:
-                logging.info('Of %i nodes queued: %i running, %i pending, %i other' % (self.num_nodes_queued, num_nodes_running, num_nodes_pending, num_nodes_unknown))
-            if self.num_nodes_ready > 0 and not self.drain and not self.cancel:
+                self.logger.info('Of %i nodes queued: %i running, %i pending, %i other' % (self.num_nodes_queued, num_nodes_running, num_nodes_pending, num_nodes_unknown))
+            if self.num_nodes_ready > 0 and not self.drain and not self.cancel and not self.stop_requested:
                 self.__submit_ready_nodes(num_nodes_pending=num_nodes_pending)
+                self.journal.sync()
             else:
                 if self.num_nodes_done == self.num_nodes_total:
-                    logging.info('DAG completed successfully.')
+                    self.logger.info('DAG completed successfully.')
                     return 0
                 elif self.num_nodes_queued == 0:
                     if self.num_nodes_failed:
-                        logging.info('DAG failed.')
+                        self.logger.info('DAG failed.')
                         return 1
                     else:
-                        logging.info('DAG stopped.')
+                        self.logger.info('DAG stopped.')
                         return 2
             if self.cancel:
                 return 2
+            if self.stop_requested:
+                self.logger.info('DAG stopped on request.')
+                return 2
+            self.__checkpoint_rescue_dag_file()
+            self.iteration_duration = time.time() - self.iteration_start_time
+            self.__write_status(STATUS_RUNNING)
+            self.__update_metrics()
+            self.__dump_profile()
             if self.sleep_time > 0:
-                time.sleep(self.sleep_time)
+                sleep_time = self.__get_next_sleep_time(sleep_time, self.node_states.num_state_changes != num_state_changes)
+                if self.wakeup_trigger.sleep(sleep_time):
+                    self.logger.info('Woken up by %s' % (self.wakeup_trigger.wakeup_file))
             self.__handle_process_config_loading_parsing_and_writing()
 
 
+    def __write_status(self, status):
+        try:
+            write_status(self.status_file, self.__get_status(status))
+        except (IOError, OSError):
+            self.logger.exception('Failed to write the status file %s.' % (self.status_file))
+
+
+    def __get_status(self, status):
+        return {
+            'status': status,
+            'dag_file': self.dag.get_dag_file(),
+            'pid': os.getpid(),
+            'host': platform.node(),
+            'user': self.user,
+            'wckey': self.wckey,
+            'start_time': self.start_time,
+            'update_time': time.time(),
+            'iteration': self.num_iterations,
+            'iteration_start_time': self.iteration_start_time,
+            'iteration_duration': self.iteration_duration,
+            'nodes': {
+                'total': self.num_nodes_total,
+                'done': self.num_nodes_done,
+                'queued': self.num_nodes_queued,
+                'ready': self.num_nodes_ready,
+                'unready': self.num_nodes_unready,
+                'failed': self.num_nodes_failed,
+            },
+            'queued_nodes': {
+                'running': self.num_nodes_running,
+                'pending': self.num_nodes_pending,
+                'other': self.num_nodes_unknown,
+            },
+            'failed_nodes': self.node_states.get_nodes(NODE_FAILED),
+            # Job submissions per minute, with adaptive submission.
+            'submit_rate': self.submit_rate_controller.get_rate() if self.submit_rate_controller is not None else None,
+        }
+
+
+    def __start_profiler(self):
+        # Profiling is skipped (with a warning the first time) while another
+        # profiler is active in the process.
+        if self.profiler.start():
+            self.profiler_unavailable = False
+        elif not self.profiler_unavailable:
+            self.logger.warning('Profiling skipped: another profiler is active in this process (e.g. that of another DAG of the daemon).')
+            self.profiler_unavailable = True
+
+
+    def __dump_profile(self):
+        # Stop profiling the current iteration and dump the stats. If profiling
+        # was switched off, the cumulative stats are dropped, so that they
+        # start from scratch if it is switched on again.
+        try:
+            profile_file = self.profiler.stop(self.num_iterations, self.profile_per_iteration)
+            if profile_file is not None:
+                self.logger.debug('Profiling stats written to %s' % (profile_file))
+        except (IOError, OSError):
+            self.logger.exception('Failed to write the profiling stats.')
+        if not self.profile:
+            self.profiler.reset()
+
+
+    def __update_metrics(self):
+        # End the current iteration in the metrics and write them out.
+        if self.metrics is None or not self.metrics.end_cycle(time.time(), self.node_states.num_state_changes):
+            return
+        self.metrics.nodes.set(self.num_nodes_done, 'done')
+        self.metrics.nodes.set(self.num_nodes_queued, 'queued')
+        self.metrics.nodes.set(self.num_nodes_ready, 'ready')
+        self.metrics.nodes.set(self.num_nodes_unready, 'unready')
+        self.metrics.nodes.set(self.num_nodes_failed, 'failed')
+        resident_memory = get_resident_memory()
+        if resident_memory is not None:
+            self.metrics.resident_memory.set(resident_memory)
+        max_resident_memory = get_max_resident_memory()
+        if max_resident_memory is not None:
+            self.metrics.max_resident_memory.set(max_resident_memory)
+        if self.submit_rate_controller is not None:
+            self.metrics.submit_rate.set(self.submit_rate_controller.get_rate())
+        try:
+            self.metrics.write(self.metrics_prometheus_file, self.metrics_json_file)
+        except (IOError, OSError):
+            self.logger.exception('Failed to write the metrics files %s and %s.' % (self.metrics_prometheus_file, self.metrics_json_file))
+
+
+    def __get_next_sleep_time(self, sleep_time, node_states_changed):
+        # Sleep the minimum time right after an iteration in which some node
+        # changed state, as more changes are likely to follow (e.g. children
+        # becoming ready); otherwise back off exponentially up to sleep_time.
+        if node_states_changed:
+            return min(self.min_sleep_time, self.sleep_time)
+        return min(max(2*sleep_time, 1), self.sleep_time)
+
+
     def __cancel_dag(self):
         max_num_cancel_retries = 5
         cancel_retry_num = 1
         while True:
-            cmd = ['scancel', '--wckey=%s' % (self.wckey)]
-            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            out, err = p.communicate()
+            self.__call_backend('scancel', self.backend.cancel, self.wckey)
             time.sleep(60)
             squeue_out, squeue_err = self.__squeue()
             if squeue_out or squeue_err:
@@ -571,7 +1275,7 @@ class Worker(object):
                     msg  = 'After %i trials to cancel the queued DAG nodes, %i nodes are still queued.' % (cancel_retry_num, len(squeue_out))
                     msg += ' Aborting the cancel.'
                     msg += ' This is the output of squeue:'
-                    msg += '\nStdout:\n%s' % ('\n'.join(squeue_out))
+                    msg += '\nStdout:\n%s' % ('\n'.join(['|'.join(job) for job in squeue_out]))
                     if squeue_err:
                         msg += '\nStderr:\n%s' % ('\n'.join(squeue_err))
                     raise Exception(msg)
@@ -582,30 +1286,73 @@ class Worker(object):
 
     def run(self):
         self.__handle_proxy()
+        # The parsing is profiled with the first iteration.
+        if self.profile:
+            self.__start_profiler()
         try:
             self.__parse_dag_file()
         except Exception as e:
-            logging.exception('Failure parsing DAG file.')
+            self.logger.exception('Failure parsing DAG file.')
             raise
+        rc = None
         try:
             rc = self.__execute_dag()
         except Exception as e:
-            logging.exception('Failure executing DAG.')
+            self.logger.exception('Failure executing DAG.')
             raise
+        finally:
+            self.__write_status(self.__get_final_status(rc))
+            self.__update_metrics()
+            self.__dump_profile()
+            self.wakeup_trigger.close()
+            self.journal.sync()
+            self.__write_runtimes()
+            self.__wait_for_checkpoint()
+        if rc == 0:
+            self.journal.remove()
+            self.__remove_checkpoint()
         if self.cancel and rc != 0:
             self.try_to_terminate_and_write_rescue_dag_file()
             rc = -1
         return rc
 
 
+    def __register_status_file(self):
+        if not self.register_status:
+            return
+        try:
+            register_status_file(self.status_file)
+        except (IOError, OSError):
+            self.logger.exception('Failed to register the status file %s.' % (self.status_file))
+
+
+    def __get_final_status(self, rc):
+        if rc is None:
+            return STATUS_ERROR
+        if self.cancel and rc != 0:
+            return STATUS_CANCELLED
+        if rc == 0:
+            return STATUS_COMPLETED
+        if rc == 1:
+            return STATUS_FAILED
+        return STATUS_STOPPED
+
+
+    def stop(self):
+        # Ask the worker, running in another thread, to stop at the end of
+        # the current iteration (or sleep); run() then returns 2.
+        self.stop_requested = True
+        self.wakeup_trigger.wake()
+
+
     def terminate(self):
         if self.num_nodes_queued > 0:
             try:
-                logging.info('Cancelling queued DAG nodes.')
+                self.logger.info('Cancelling queued DAG nodes.')
                 self.__cancel_dag()
-                logging.info('Queued DAG nodes cancelled.')
+                self.logger.info('Queued DAG nodes cancelled.')
             except Exception as e:
-                logging.exception('Failure cancelling queued DAG nodes.')
+                self.logger.exception('Failure cancelling queued DAG nodes.')
                 raise
 
 
@@ -613,10 +1360,10 @@ class Worker(object):
         try:
             self.terminate()
         except Exception:
-            logging.warning('Failed to terminate DAG. Will write rescue DAG file with currently finished nodes.')
+            self.logger.warning('Failed to terminate DAG. Will write rescue DAG file with currently finished nodes.')
             pass
         try:
             self.write_rescue_dag_file()
         except Exception:
-            logging.exception('Failed to write rescue DAG.')
+            self.logger.exception('Failed to write rescue DAG.')
             raise
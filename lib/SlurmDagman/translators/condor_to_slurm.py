@@ -26,14 +26,14 @@ class CondorToSlurmTranslator(object):
 
     def __init__(self, condor_dag_file=None, slurm_dag_file=None,
                        slurm_partition=None, slurm_qos=None, slurm_time_limit=None, slurm_scratch_dir=None, slurm_use_setsid=None,
-                       singularity_image=None, singularity_bind_mount_dbus=None):
+                       singularity_image=None, singularity_bind_mount_dbus=None, use_dag_cache=None):
         super(CondorToSlurmTranslator, self).__init__()
         self.condor_default_cpus = '1'
         self.condor_default_memory = '1GB'
         self.__init_dags(condor_dag_file, slurm_dag_file)
         self.__init_params()
         self.set_params(slurm_partition, slurm_qos, slurm_time_limit, slurm_scratch_dir, slurm_use_setsid,
-                        singularity_image, singularity_bind_mount_dbus)
+                        singularity_image, singularity_bind_mount_dbus, use_dag_cache)
 
 
     def __init_dags(self, condor_dag_file=None, slurm_dag_file=None):
@@ -82,6 +82,7 @@ class CondorToSlurmTranslator(object):
         self.slurm_use_setsid = False
         self.singularity_image = ''
         self.singularity_bind_mount_dbus = False
+        self.use_dag_cache = package_config.get_param('DAGMAN', 'dag_cache', 'boolean')
 
 
     def reset_params(self):
@@ -89,7 +90,7 @@ class CondorToSlurmTranslator(object):
 
 
     def set_params(self, slurm_partition=None, slurm_qos=None, slurm_time_limit=None, slurm_scratch_dir=None, slurm_use_setsid=None,
-                         singularity_image=None, singularity_bind_mount_dbus=None):
+                         singularity_image=None, singularity_bind_mount_dbus=None, use_dag_cache=None):
         if slurm_partition is not None:
             self.slurm_partition = slurm_partition
         if slurm_qos is not None:
@@ -104,6 +105,8 @@ class CondorToSlurmTranslator(object):
             self.singularity_image = singularity_image
         if singularity_bind_mount_dbus is not None:
             self.singularity_bind_mount_dbus = singularity_bind_mount_dbus
+        if use_dag_cache is not None:
+            self.use_dag_cache = use_dag_cache
 
 
     def translate(self):
@@ -118,7 +121,7 @@ class CondorToSlurmTranslator(object):
 
 
     def __parse_condor_dag_file(self):
-        self.condor_dag.parse()
+        self.condor_dag.parse(use_cache=self.use_dag_cache)
 
 
     def __condor_to_slurm_dag(self):
@@ -126,7 +129,8 @@ class CondorToSlurmTranslator(object):
         for node in self.slurm_dag:
             self.slurm_dag[node]['job_submission_file'] = self.condor_dag[node]['job_submission_file'] + '.slurm'
             if 'vars' in self.slurm_dag[node]:
-                self.slurm_dag[node]['vars'] = self.slurm_dag[node]['vars'].replace('_CONDOR_SCRATCH_DIR', self.slurm_scratch_dir)
+                for macrokey, macrovalue in list(self.slurm_dag[node]['vars'].items()):
+                    self.slurm_dag[node]['vars'][macrokey] = macrovalue.replace('_CONDOR_SCRATCH_DIR', self.slurm_scratch_dir)
 
 
     def __write_slurm_dag_file(self):
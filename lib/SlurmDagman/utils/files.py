@@ -0,0 +1,61 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import tempfile
+
+
+# The umask can only be read by setting it, which is not thread-safe, so it
+# is read once when the module is imported.
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def write_file_atomically(file_name, content, binary=False, sync=True):
+    # Write the content (a string or an iterable of strings, or of bytes if
+    # binary) to a temporary file in the same directory and rename it to the
+    # given file name, so that readers see either the old or the new file,
+    # never a partial one. Unless sync is False, the temporary file is made
+    # durable before the rename.
+    file_dir = os.path.dirname(os.path.abspath(file_name))
+    fd, tmp_file_name = tempfile.mkstemp(dir=file_dir, prefix='.%s.' % (os.path.basename(file_name)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb' if binary else 'w') as f:
+            if isinstance(content, (str, bytes)):
+                f.write(content)
+            else:
+                for chunk in content:
+                    f.write(chunk)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.chmod(tmp_file_name, 0o666 & ~UMASK)
+        os.rename(tmp_file_name, file_name)
+    except Exception:
+        if os.path.exists(tmp_file_name):
+            os.remove(tmp_file_name)
+        raise
+
+
+def get_file_signature(file_name):
+    # A cheap signature of the file (a single stat call) that changes when
+    # the file is modified or replaced, or None if the file doesn't exist.
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime, stat.st_ctime)
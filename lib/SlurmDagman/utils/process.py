@@ -16,8 +16,14 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import getpass
+import os
 import subprocess
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
 
 def get_current_effective_user():
     return getpass.getuser()
@@ -63,3 +69,22 @@ def send_signal(pid, signal):
     out = out.decode('utf-8')
     err = err.decode('utf-8')
     return out, err
+
+
+def get_resident_memory():
+    # The current resident memory (in bytes) of this process, or None if it
+    # can not be known.
+    try:
+        with open('/proc/self/statm', 'r') as fd:
+            return int(fd.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def get_max_resident_memory():
+    # The peak resident memory (in bytes) of this process, or None if it can
+    # not be known.
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
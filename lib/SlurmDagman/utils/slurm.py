@@ -0,0 +1,51 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+
+
+def build_array_task_job_id(array_job_id, task_id):
+    return '%s_%s' % (array_job_id, task_id)
+
+
+def get_array_job_id(job_id):
+    # For an array task job id '<array-job-id>_<task-id>' return '<array-job-id>',
+    # for a regular job id return the job id itself.
+    return job_id.split('_', 1)[0]
+
+
+def expand_array_job_id(job_id):
+    # Slurm may report the pending tasks of a job array in a single record
+    # with a job id like '1234_[0-3,7,10-12%4]' (where '%4' is the limit of
+    # simultaneously running tasks). Expand such a job id into the list of the
+    # individual task job ids. Any other job id is returned as is in a list.
+    m = re.match(r'^([0-9]+)_\[([0-9,\-]+)(%[0-9]+)?\]$', job_id)
+    if not m:
+        return [job_id]
+    array_job_id = m.group(1)
+    job_ids = []
+    for task_range in m.group(2).split(','):
+        if not task_range:
+            continue
+        if '-' in task_range:
+            first, last = task_range.split('-', 1)
+            task_ids = range(int(first), int(last) + 1)
+        else:
+            task_ids = [int(task_range)]
+        for task_id in task_ids:
+            job_ids.append(build_array_task_job_id(array_job_id, task_id))
+    return job_ids
@@ -0,0 +1,92 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from SlurmDagman.dag import Dag
+
+
+def parse_dag(tmpdir, lines, name='test.dag'):
+    dag_file = str(tmpdir.join(name))
+    with open(dag_file, 'w') as fd:
+        fd.write('\n'.join(lines))
+    dag = Dag(dag_file)
+    dag.parse()
+    return dag
+
+
+def read_lines(path):
+    with open(str(path), 'r') as fd:
+        return fd.read().split('\n')
+
+
+def test_write_grouped_dependencies(tmpdir):
+    # The children with the same parents are written in one PARENT line, in
+    # the order in which the groups first appear.
+    dag = parse_dag(tmpdir, ['JOB A a.sh', 'JOB B a.sh', 'JOB C a.sh', 'JOB D a.sh', 'JOB E a.sh', 'JOB F a.sh',
+                             'PARENT A CHILD C',
+                             'PARENT B CHILD C D',
+                             'PARENT A CHILD D',
+                             'PARENT C CHILD E',
+                             'PARENT A CHILD F'])
+    out_file = str(tmpdir.join('grouped.dag'))
+    dag.write(out_file, use_dag_nodes_appearance_order=True, group_dependencies=True)
+    lines = read_lines(out_file)
+    assert [line for line in lines if line.startswith('PARENT ')] == ['PARENT A B CHILD C D',
+                                                                     'PARENT C CHILD E',
+                                                                     'PARENT A CHILD F']
+    # The grouped DAG has the same dependencies.
+    grouped_dag = Dag(out_file)
+    grouped_dag.parse()
+    for node in dag.get_nodes():
+        assert sorted(grouped_dag.get_parents(node)) == sorted(dag.get_parents(node))
+        assert sorted(grouped_dag.get_children(node)) == sorted(dag.get_children(node))
+
+
+def test_write_ungrouped_dependencies(tmpdir):
+    dag = parse_dag(tmpdir, ['JOB A a.sh', 'JOB B a.sh', 'JOB C a.sh', 'PARENT A B CHILD C'])
+    out_file = str(tmpdir.join('ungrouped.dag'))
+    dag.write(out_file, use_dag_nodes_appearance_order=True)
+    assert read_lines(out_file)[-2:] == ['PARENT A CHILD C', 'PARENT B CHILD C']
+
+
+def get_weights(dag, weights):
+    return dict((node, weights[dag[node].node_id]) for node in dag.get_nodes())
+
+
+def test_critical_path_weights(tmpdir):
+    # A -> B -> C and A -> D: the weight of a node is its runtime plus the
+    # largest weight of its children.
+    dag = parse_dag(tmpdir, ['JOB A a.sh', 'JOB B b.sh', 'JOB C c.sh', 'JOB D d.sh',
+                             'PARENT A CHILD B D', 'PARENT B CHILD C'])
+    weights = get_weights(dag, dag.get_critical_path_weights())
+    assert weights == {'A': 3.0, 'B': 2.0, 'C': 1.0, 'D': 1.0}
+    weights = get_weights(dag, dag.get_critical_path_weights({'A': 5, 'B': 1, 'C': 1, 'D': 10}))
+    assert weights == {'A': 15.0, 'B': 2.0, 'C': 1.0, 'D': 10.0}
+
+
+def test_critical_path_weights_default_runtimes(tmpdir):
+    # A node without a runtime takes the mean runtime of the nodes with the
+    # same job submission file, else the default runtime.
+    dag = parse_dag(tmpdir, ['JOB A a.sh', 'JOB B a.sh', 'JOB C a.sh', 'JOB D d.sh',
+                             'PARENT A CHILD C', 'PARENT B CHILD D'])
+    weights = get_weights(dag, dag.get_critical_path_weights({'A': 2, 'B': 4}, default_runtime=7.0))
+    assert weights == {'A': 5.0, 'B': 11.0, 'C': 3.0, 'D': 7.0}
+
+
+def test_critical_path_weights_done_nodes(tmpdir):
+    dag = parse_dag(tmpdir, ['JOB A a.sh DONE', 'JOB B a.sh', 'JOB C a.sh', 'PARENT A CHILD B', 'PARENT B CHILD C'])
+    weights = get_weights(dag, dag.get_critical_path_weights({'A': 100, 'B': 3, 'C': 4}))
+    assert weights == {'A': 7.0, 'B': 7.0, 'C': 4.0}
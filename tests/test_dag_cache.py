@@ -0,0 +1,86 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+
+from SlurmDagman.dag import Dag
+from SlurmDagman.dag.utils.cache import get_dag_cache_file_name
+
+
+def write_dag(dag_file, lines):
+    with open(dag_file, 'w') as fd:
+        fd.write('\n'.join(lines))
+
+
+def parse_dag(dag_file):
+    dag = Dag(dag_file)
+    dag.parse(use_cache=True)
+    return dag
+
+
+def test_cache_is_written_and_used(tmpdir):
+    dag_file = str(tmpdir.join('test.dag'))
+    write_dag(dag_file, ['JOB A a.sh', 'VARS A name="a"', 'JOB B a.sh', 'RETRY B 2', 'PARENT A CHILD B'])
+    dag = parse_dag(dag_file)
+    assert not dag.loaded_from_cache
+    assert os.path.isfile(get_dag_cache_file_name(dag_file))
+    cached_dag = parse_dag(dag_file)
+    assert cached_dag.loaded_from_cache
+    assert cached_dag.get_nodes() == dag.get_nodes()
+    assert cached_dag['A'].vars == {'name': 'a'}
+    assert cached_dag.get_max_retries('B') == 2
+    assert cached_dag.get_parents('B') == ['A']
+
+
+def test_cache_is_invalidated_by_a_change(tmpdir):
+    dag_file = str(tmpdir.join('test.dag'))
+    write_dag(dag_file, ['JOB A a.sh', 'JOB B a.sh', 'PARENT A CHILD B'])
+    parse_dag(dag_file)
+    write_dag(dag_file, ['JOB A a.sh', 'JOB B a.sh', 'JOB C a.sh', 'PARENT A CHILD B C'])
+    dag = parse_dag(dag_file)
+    assert not dag.loaded_from_cache
+    assert sorted(dag.get_children('A')) == ['B', 'C']
+    # The cache was written again for the new content.
+    assert parse_dag(dag_file).loaded_from_cache
+
+
+def test_cache_is_invalidated_by_a_change_of_content_only(tmpdir):
+    # A change that keeps the size and the modification time of the dag file
+    # is caught by the hash of its content.
+    dag_file = str(tmpdir.join('test.dag'))
+    write_dag(dag_file, ['JOB A a.sh', 'JOB B a.sh', 'PARENT A CHILD B'])
+    stat = os.stat(dag_file)
+    parse_dag(dag_file)
+    write_dag(dag_file, ['JOB A a.sh', 'JOB B a.sh', 'PARENT B CHILD A'])
+    os.utime(dag_file, (stat.st_atime, stat.st_mtime))
+    dag = parse_dag(dag_file)
+    assert not dag.loaded_from_cache
+    assert dag.get_parents('A') == ['B']
+
+
+def test_cache_of_a_rescue_dag(tmpdir):
+    # A rescue dag file shares the cache file of its dag file, which is thus
+    # not used for it.
+    dag_file = str(tmpdir.join('test.dag'))
+    write_dag(dag_file, ['JOB A a.sh', 'JOB B a.sh', 'PARENT A CHILD B'])
+    parse_dag(dag_file)
+    rescue_dag_file = dag_file + '.rescue001'
+    write_dag(rescue_dag_file, ['JOB A a.sh DONE', 'JOB B a.sh', 'PARENT A CHILD B'])
+    assert get_dag_cache_file_name(rescue_dag_file) == get_dag_cache_file_name(dag_file)
+    dag = parse_dag(rescue_dag_file)
+    assert not dag.loaded_from_cache
+    assert dag['A'].done
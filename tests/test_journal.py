@@ -0,0 +1,96 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from SlurmDagman.backends.simulator import SimulatedBackend
+from SlurmDagman.process.journal import Journal, JOURNAL_START, JOURNAL_SUBMITTED, JOURNAL_DONE
+from SlurmDagman.process.worker import Worker
+
+
+def test_journal_records(tmpdir):
+    journal = Journal(str(tmpdir.join('test.dag.slurm_dagman.journal')))
+    assert journal.read() == []
+    journal.open()
+    journal.append(JOURNAL_START, 'slurm_dagman_wckey', '2020-01-01T00:00:00')
+    journal.append(JOURNAL_SUBMITTED, 'A', '1001', -1)
+    journal.append(JOURNAL_DONE, 'A')
+    journal.close()
+    assert journal.read() == [['START', 'slurm_dagman_wckey', '2020-01-01T00:00:00'],
+                              ['SUBMITTED', 'A', '1001', '-1'],
+                              ['DONE', 'A']]
+    journal.remove()
+    assert not journal.exists()
+
+
+def test_journal_skips_incomplete_records(tmpdir):
+    # The last line is incomplete if the writer was killed while writing it.
+    journal_file = str(tmpdir.join('test.dag.slurm_dagman.journal'))
+    with open(journal_file, 'w') as fd:
+        fd.write('DONE A\nUNKNOWN A\nSUBMITTED B\nDONE B\nSUBMITTED C 10')
+    assert Journal(journal_file).read() == [['DONE', 'A'], ['DONE', 'B']]
+
+
+def write_dag(tmpdir):
+    job_submission_file = str(tmpdir.join('job.sh'))
+    with open(job_submission_file, 'w') as fd:
+        fd.write('#!/bin/bash\necho $(name)\n')
+    dag_file = str(tmpdir.join('test.dag'))
+    with open(dag_file, 'w') as fd:
+        for node in ['A', 'B', 'C']:
+            fd.write('JOB %s %s\nVARS %s name="%s"\n' % (node, job_submission_file, node, node.lower()))
+        fd.write('PARENT A CHILD B\nPARENT B CHILD C\n')
+    return dag_file
+
+
+def run_dag(dag_file, replay_journal):
+    backend = SimulatedBackend(num_slots=4, runtime=0, time_scale=1000.0, seed=0)
+    worker = Worker(dag_file=dag_file, sleep_time=0, min_sleep_time=0, submit_wait_time=0, backend=backend,
+                    replay_journal=replay_journal)
+    rc = worker.run()
+    return worker, backend, rc
+
+
+def test_journal_replay(tmpdir):
+    # The nodes that the journal of a previous process has as done are not
+    # submitted again, and the jobs keep the wckey of that process.
+    dag_file = write_dag(tmpdir)
+    journal = Journal(dag_file + '.slurm_dagman.journal')
+    journal.open()
+    journal.append(JOURNAL_START, 'slurm_dagman_previous', '2020-01-01T00:00:00')
+    journal.append(JOURNAL_SUBMITTED, 'A', '1', -1)
+    journal.append(JOURNAL_DONE, 'A')
+    journal.close()
+    worker, backend, rc = run_dag(dag_file, True)
+    assert rc == 0
+    assert worker.wckey == 'slurm_dagman_previous'
+    assert worker.num_nodes_done == 3
+    assert backend.num_calls['submit'] == 2
+    assert sorted([job.job_name for job in backend.jobs.values()]) == ['B', 'C']
+    # A DAG that completed has no journal left.
+    assert not journal.exists()
+
+
+def test_journal_discarded_without_replay(tmpdir):
+    dag_file = write_dag(tmpdir)
+    journal = Journal(dag_file + '.slurm_dagman.journal')
+    journal.open()
+    journal.append(JOURNAL_START, 'slurm_dagman_previous', '2020-01-01T00:00:00')
+    journal.append(JOURNAL_DONE, 'A')
+    journal.close()
+    worker, backend, rc = run_dag(dag_file, False)
+    assert rc == 0
+    assert worker.wckey != 'slurm_dagman_previous'
+    assert backend.num_calls['submit'] == 3
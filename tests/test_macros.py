@@ -0,0 +1,84 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from SlurmDagman.dag import Dag
+from SlurmDagman.dag.utils.macros import format_macros, parse_macros
+
+
+def write_dag(path, text):
+    with open(str(path), 'w') as fd:
+        fd.write(text)
+    return str(path)
+
+
+def read_file(path):
+    with open(str(path), 'r') as fd:
+        return fd.read()
+
+
+def test_parse_macros():
+    assert parse_macros('name="a" other="x y"') == {'name': 'a', 'other': 'x y'}
+    assert parse_macros('') == {}
+
+
+def test_parse_macros_unescapes_quotes_and_backslashes():
+    macros = parse_macros(r'quoted="say \"hi\"" path="C:\\" regex="a\d"')
+    assert macros == {'quoted': 'say "hi"', 'path': 'C:\\', 'regex': 'a\\d'}
+
+
+def test_parse_macros_last_value_wins():
+    assert parse_macros('a="1" a="2"') == {'a': '2'}
+
+
+def test_format_macros_round_trip():
+    for text in ['name="a"',
+                 'name="a" other="x y"',
+                 r'quoted="say \"hi\"" empty=""',
+                 r'path="C:\\" regex="a\d"']:
+        assert format_macros(parse_macros(text)) == text
+    macros = {'a': 'x "y" \\ z\\', 'b': ''}
+    assert parse_macros(format_macros(macros)) == macros
+
+
+def test_dag_write_keeps_vars_lines(tmpdir):
+    # Macros are written back as they were read, even with escapes or white
+    # spaces that format_macros would not write.
+    text = '\n'.join(['JOB A a.sh',
+                      r'VARS A name="a"   path="C:\\dir\\"  regex="a\d"',
+                      'JOB B b.sh',
+                      r'VARS B quoted="say \"hi\"" empty=""',
+                      'RETRY B 2',
+                      'PARENT A CHILD B'])
+    dag = Dag(write_dag(tmpdir.join('macros.dag'), text))
+    dag.parse()
+    assert dag['A'].vars == {'name': 'a', 'path': 'C:\\dir\\', 'regex': 'a\\d'}
+    assert dag['B'].vars == {'quoted': 'say "hi"', 'empty': ''}
+    out_file = str(tmpdir.join('out.dag'))
+    dag.write(out_file, use_dag_nodes_appearance_order=True)
+    assert read_file(out_file) == text
+
+
+def test_dag_write_changed_vars(tmpdir):
+    dag = Dag(write_dag(tmpdir.join('macros.dag'), 'JOB A a.sh\nVARS A name="a"  other="x"'))
+    dag.parse()
+    dag['A'].vars['name'] = 'b "c"'
+    out_file = str(tmpdir.join('out.dag'))
+    dag.write(out_file)
+    assert read_file(out_file) == 'JOB A a.sh\nVARS A %s' % (format_macros(dag['A'].vars))
+    dag = Dag(out_file)
+    dag.parse()
+    assert dag['A'].vars == {'name': 'b "c"', 'other': 'x'}
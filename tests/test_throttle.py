@@ -0,0 +1,70 @@
+"""
+Copyright (C) 2020  Universite catholique de Louvain, Belgium.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+
+from SlurmDagman.process.throttle import SubmitRateController
+
+
+def test_additive_increase():
+    controller = SubmitRateController(6, 600, 2, initial_rate=100)
+    for _ in range(5):
+        controller.record(0.5, None)
+    assert controller.get_rate() == 105
+
+
+def test_multiplicative_decrease_on_slow_call_or_error():
+    controller = SubmitRateController(6, 600, 2, initial_rate=100)
+    controller.record(3.0, None)
+    assert controller.get_rate() == 50
+    controller.last_decrease_time = time.time() - 10
+    controller.record(0.1, 'sbatch: error: Batch job submission failed')
+    assert controller.get_rate() == 25
+
+
+def test_one_decrease_per_latency_target_period():
+    # A burst of slow calls counts as a single one.
+    controller = SubmitRateController(6, 600, 60, initial_rate=100)
+    for _ in range(5):
+        controller.record(120.0, None)
+    assert controller.get_rate() == 50
+    # Fast calls still increase the rate.
+    controller.record(1.0, None)
+    assert controller.get_rate() == 51
+
+
+def test_rate_is_clamped():
+    controller = SubmitRateController(6, 600, 2)
+    assert controller.get_rate() == 600
+    controller.record(0.1, None)
+    assert controller.get_rate() == 600
+    controller = SubmitRateController(6, 600, 2, initial_rate=8)
+    controller.record(3.0, None)
+    assert controller.get_rate() == 6
+    controller.set_limits(10, 20, 2)
+    assert controller.get_rate() == 10
+    controller.set_limits(1, 5, 2)
+    assert controller.get_rate() == 5
+
+
+def test_wait_spaces_out_submissions():
+    controller = SubmitRateController(600, 600, 2)
+    start_time = time.time()
+    for _ in range(3):
+        controller.wait()
+    # 600 submissions per minute: one every 0.1 seconds, the first right away.
+    assert time.time() - start_time >= 0.19